@@ -6,9 +6,32 @@ from langchain.llms import OpenAI
 import random
 import time
 from langchain.load.dump import dumps
+from langchain.callbacks.base import BaseCallbackHandler
 import json
 from langchain.agents import tool
-    
+
+
+class CancelCallbackHandler(BaseCallbackHandler):
+    '''
+    Stops the agent executor at its next llm call, tool or action once the cancel token of the step is cancelled
+    '''
+    raise_error = True  # langchain only logs the errors of the other handlers
+
+    def __init__(self, cancel_token):
+        self.cancel_token = cancel_token
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.cancel_token.check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.cancel_token.check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.cancel_token.check()
+
+    def on_agent_action(self, action, **kwargs):
+        self.cancel_token.check()
+
 
 class Agent(AbstractAgent):
     base_url = "https://api.openai.com/v1"
@@ -17,6 +40,18 @@ class Agent(AbstractAgent):
         Agent.env = env
         self.tools = tools
 
+    def __getstate__(self):
+        # the worker processes get the agents of the env, a tool is pickled by its name:
+        # Agent.<name> is the tool, not the function the tool wraps
+        state = self.__dict__.copy()
+        state["tools"] = [tool.name for tool in self.tools]
+        state.pop("llm", None)  # built again by run
+        return state
+
+    def __setstate__(self, state):
+        state["tools"] = [getattr(Agent, name) for name in state["tools"]]
+        self.__dict__.update(state)
+
     def medical_rescue_agent_tools():
         return [
             Agent.get_medical_resources,
@@ -66,7 +101,7 @@ class Agent(AbstractAgent):
             Agent.traffic_control_agent_tools()
         ]
 
-    def run(self, instruction: str, player_name_list=[], max_turn=10):
+    def run(self, instruction: str, player_name_list=[], max_turn=10, cancel_token=None):
         assert len(self.api_key_list) > 0, "Please set the api_key_list in Agent class."
         # dynamic api key
         action_list = []
@@ -78,7 +113,10 @@ class Agent(AbstractAgent):
             from langchain.chat_models import ChatOpenAI
             self.llm = ChatOpenAI(model=self.model, temperature=0, max_tokens=256, openai_api_key=random.choice(self.api_key_list), base_url=Agent.base_url)
 
+        callbacks = [CancelCallbackHandler(cancel_token)] if cancel_token is not None else None
         while max_turn > 0:
+            if cancel_token is not None:
+                cancel_token.check()
             try:
                 agent = initialize_agent(
                     tools=self.tools,
@@ -94,7 +132,7 @@ class Agent(AbstractAgent):
                 if player_name_list:
                     input_text = f"You should control {player_name_list} work together.\n{instruction}"
                 
-                response = agent({"input":input_text})
+                response = agent({"input":input_text}, callbacks=callbacks)
                 action_list = []
                 response = json.loads(dumps(response, pretty=True))
                 for step in response["intermediate_steps"]:
@@ -109,6 +147,8 @@ class Agent(AbstractAgent):
 
                         
             except Exception as e:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise
                 print(f"Error occurred: {e}")
                 print("Retrying...")
                 time.sleep(1)
@@ -517,8 +517,9 @@ class CityEmergencyEnv(MultiAgentEnvironment):
                 return Agent.get_status(agent_name)
         return {"message": f"agent {agent_name} not found", "status": False}
     
-    def step(self, agent_name: str, action: str, max_turn: int = 2):
+    def step(self, agent_name: str, action: str, max_turn: int = 2, cancel_token=None):
         '''
+        cancel_token: CancelToken of the step, the agent stops at its next llm call or tool once it is cancelled
         final_answer, {"input": response["input"], "action_list": action_list, "final_answer": final_answer}
         '''
         self.logger.debug("=" * 20 + " Env Step " + "=" * 20)
@@ -527,7 +528,7 @@ class CityEmergencyEnv(MultiAgentEnvironment):
         find_agent = False
         for agent in self.agent_pool:
             if agent.name == agent_name:
-                feedback, detail = agent.run(action, max_turn=max_turn)
+                feedback, detail = agent.run(action, max_turn=max_turn, cancel_token=cancel_token)
                 return feedback, detail
 
         if not find_agent:
@@ -2,6 +2,9 @@
 import sys
 import os
 import time
+import asyncio
+import threading
+import weakref
 import logging
 from typing import Dict, List, Tuple
 from random import random, randint, choice
@@ -12,6 +15,7 @@ sys.path.append(os.getcwd())
 # Project imports
 from CityPipe.utils import *
 from type_define.graph import Task
+from type_define.deadline_watchdog import CancelToken, StepCancelled
 from CityEnvironment.city_emergency_env import CityEmergencyEnv
 from CityPipe.data_manager import DataManager
 from LLM.openai_models import OpenAILanguageModel
@@ -47,6 +51,10 @@ class BaseAgent:
     '''
     
     _virtual_debug = False
+
+    env_concurrency = 16  # concurrent env steps per event loop
+    _env_semaphore = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+    _env_semaphore_lock = threading.Lock()
     
     def __init__(self, llm:OpenAILanguageModel , env:CityEmergencyEnv, data_manager:DataManager, 
                  name:str, logger:logging.Logger = None, silent = False, **kwargs):
@@ -74,13 +82,73 @@ class BaseAgent:
         status = {"message": str(status), "status": True}
         return status
 
-    def step(self, task:Task) -> (str, dict):
+    def step(self, task:Task, cancel_token:CancelToken = None) -> (str, dict):
         '''
         take an action and return the feedback and detail
+        cancel_token: checked between the env tries and passed to the env, raises StepCancelled once cancelled
         return: final_answer, {"input": response["input"], "action_list": action_list, "final_answer": final_answer}
         '''
         if BaseAgent._virtual_debug:
             return self.virtual_step(task)
+        task_str = self.step_prompt(task)
+        max_retry = 3
+        while max_retry > 0:
+            if cancel_token is not None:
+                cancel_token.check()
+            try:
+                feedback, detail = self.env.step(self.name, task_str, cancel_token=cancel_token)
+                break
+            except StepCancelled:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error: {e}")
+                max_retry -= 1
+                if cancel_token is not None:
+                    cancel_token.wait(3)
+                else:
+                    time.sleep(3)
+        self.step_feedback(task, detail)
+        return feedback, detail
+
+    async def astep(self, task:Task, cancel_token:CancelToken = None) -> (str, dict):
+        '''
+        coroutine version of step, at most env_concurrency env steps run at once in one event loop
+        the env runs the tools synchronously, so only the env step itself holds a thread
+        cancelling the coroutine cancels the token, the env step in its thread stops at its next checkpoint
+        '''
+        if BaseAgent._virtual_debug:
+            return self.virtual_step(task)
+        cancel_token = cancel_token or CancelToken()
+        try:
+            task_str = await asyncio.to_thread(self.step_prompt, task)
+            max_retry = 3
+            while max_retry > 0:
+                cancel_token.check()
+                try:
+                    async with self.env_semaphore():
+                        feedback, detail = await asyncio.to_thread(self.env.step, self.name, task_str, cancel_token=cancel_token)
+                    break
+                except StepCancelled:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"Error: {e}")
+                    max_retry -= 1
+                    await asyncio.sleep(3)
+        except asyncio.CancelledError:
+            cancel_token.cancel("step coroutine cancelled")
+            raise
+        await asyncio.to_thread(self.step_feedback, task, detail)
+        return feedback, detail
+
+    @classmethod
+    def env_semaphore(cls) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with cls._env_semaphore_lock:
+            if loop not in cls._env_semaphore:
+                cls._env_semaphore[loop] = asyncio.Semaphore(cls.env_concurrency)
+            return cls._env_semaphore[loop]
+
+    def step_prompt(self, task:Task) -> str:
         if len(task._agent) == 1:
             task_str = format_string(agent_prompt, {
                 "task_description": task.description, 
@@ -113,19 +181,12 @@ class BaseAgent:
         self.logger.info(f"{self.history_action_list}")
         self.logger.info(f"other agents: {self.other_agents()}")
         self.logger.info(f"{self.name} status:\n {self.data_manager.query_history(self.name)}")
-        max_retry = 3
-        while max_retry > 0:
-            try:
-                feedback, detail = self.env.step(self.name, task_str)
-                break
-            except Exception as e:
-                self.logger.error(f"Error: {e}")
-                max_retry -= 1
-                time.sleep(3)
+        return task_str
+
+    def step_feedback(self, task:Task, detail):
         status = self.get_status()
         self.data_manager.update_database(AgentFeedback(task, detail, status).to_json())
         # self.data_manager.save()
-        return feedback, detail
     
     def other_agents(self) -> [str]:
         '''
@@ -165,6 +226,24 @@ class BaseAgent:
                                    })
             response = self.llm.generate(reflect_system_prompt, prompt, cache_enabled=False, max_tokens=256, json_check=True)
         # print(response)
+        return self.reflect_result(task, response, action_history)
+
+    async def areflect(self, task: Task, detail) -> bool:
+        '''
+        coroutine version of reflect, the llm call goes through llm.agenerate
+        '''
+        action_history = detail["action_list"]
+        prompt = format_string(reflect_user_prompt,
+                               {
+                                   "task_description": task.description,
+                                   "milestone_description": task.milestones,
+                                   "state": await asyncio.to_thread(self.data_manager.query_history, self.name),
+                                   "action_history": action_history
+                               })
+        response = await self.llm.agenerate(reflect_system_prompt, prompt, cache_enabled=False, max_tokens=256, json_check=True)
+        return self.reflect_result(task, response, action_history)
+
+    def reflect_result(self, task: Task, response: str, action_history: list) -> bool:
         result = extract_info(response)[0]
         task.reflect = result
         task._summary.append(result["summary"])
@@ -1,14 +1,24 @@
 import sys
 import os
 import threading
+import queue
+import asyncio
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
 from LLM.init_model import init_language_model
 
 sys.path.append(os.getcwd())
 from type_define.graph import Task
+from type_define.task_duration import TaskDuration
+from type_define.ready_queue import ReadyQueue
+from type_define.assign_matcher import AssignMatcher
+from type_define.deadline_watchdog import DeadlineWatchdog, CancelToken, StepPool
+from type_define.snapshot_publisher import acquire_publisher, release_publisher
+from type_define.pool_autoscaler import PoolAutoscaler, PoolLimit
+from CityPipe.process_backend import ControllerServer, make_process_executor, run_step
+from CityPipe.remote_backend import RemoteWorkerPool
 from CityPipe.task_manager import TaskManager
 from CityPipe.data_manager import DataManager
 from CityPipe.agent import BaseAgent
@@ -28,11 +38,24 @@ class GlobalController:
     - data_manager: DataManager, data manager
     - env: CityEmergencyEnv, environment
     - silent: bool, whether to print logs
-    - max_workers: int, the maximum number of threads to use
+    - max_workers: int, the maximum number of threads to use, None sizes the pool from the parallelism of the task graph
+    - duration_path: str, json file of the measured task durations, shared across runs
+    - aging_interval: float, seconds a ready task waits to be ranked one priority class higher
+    - snapshot_address: (host, port), also publish logs/task_list.json on this local tcp socket, None does not
+    - backend: str, "thread" runs the agent steps of run() in a thread pool, "process" in worker processes
+      that call the env and the data manager of the controller, see CityPipe/process_backend.py, "remote" on the
+      worker hosts connected to remote_address, see CityPipe/remote_backend.py. arun only runs with the thread backend
+    - remote_address: (host, port) or unix socket path the remote workers connect to, default a free local port
+    - remote_authkey: bytes, key the remote workers authenticate with, None generates one (self.executor.authkey)
+    - autoscaler: PoolAutoscaler, sizes the thread pool from the ready queue, the steps in flight and the llm latency
+      and rate limits instead of max_workers and the task graph, its decisions are published to logs/autoscaler.json.
+      With the other backends it only publishes the size it would choose, for whoever scales the workers
     
     '''
     def __init__(self, llm_config: dict, task_manager: TaskManager, data_manager: DataManager, env: CityEmergencyEnv,
-                 silent: bool = False, max_workers=4):
+                 silent: bool = False, max_workers=None, duration_path: str = "logs/task_duration.json",
+                 aging_interval: float = 300.0, snapshot_address: tuple = None, backend: str = "thread",
+                 remote_address=("127.0.0.1", 0), remote_authkey: bytes = None, autoscaler: PoolAutoscaler = None):
         self.task_manager = task_manager
 
         tm_llm_config = llm_config.copy()
@@ -52,42 +75,99 @@ class GlobalController:
         self.agent_list = [BaseAgent(llm, env, data_manager, name=a.name, agent_type=a.name, silent=False) for a in env.agent_pool]
         self.task_manager.unit_describe = env.get_all_agent_description_tiny()
         self.task_manager.agent_list = self.agent_list
-        self.assignment = {}
+        self.assignment = {}  # agent name -> task id
         self.name_list = []
-        self.collab_list = []
         for agent in self.agent_list:
             self.name_list.append(agent.name)
         self.feedback = {}
 
+        # indexes of the completion path, every lookup is a dict access
+        self.agent_dict = {agent.name: agent for agent in self.agent_list}  # agent name -> agent
+        self.task_agent = {}  # task id -> names of the agents assigned to it
+        self.collab_dict = {}  # task id -> collab, the copies given to each agent of the task included
+        self._task_dict = {}  # task id -> Task of the graph
+        self._indexed_graph = None  # (graph, version) _task_dict was built from
+
         self.logger = init_logger("GlobalController", logging.DEBUG, dump=True, silent=silent)
         self.llm = llm
         self.llm.role_name = "GlobalController"
 
         self.task_list = [Task]  # task published by tm
         self.query_interval = 1  # time interval between two query
+        self.heartbeat_interval = 10  # the scheduling loop also wakes up after this long without any event
 
-        # init lock
-        self.task_list_lock = threading.Lock()
+        # init lock, only held to read or write running_step, never while waiting
         self.result_list_lock = threading.Lock()
 
-        self.task_queue = []
-        self.result_queue = []
+        # the threads block on the queues and the condition instead of polling
+        self.task_queue = queue.Queue()  # (agent, task) waiting to be submitted, None stops the worker
+        self.result_queue = queue.Queue()  # finished futures, None wakes up the result thread
+        self.running_step = {}  # future -> (agent, task, start time, cancel token)
+        self._state_changed = threading.Condition()
+        self._state_version = 0  # bumped whenever a step finishes or the controller stops
 
         # init thread pool
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)  # adjust max_workers to control the number of threads
+        if backend not in ["thread", "process", "remote"]:
+            raise ValueError(f"unknown backend {backend}, use thread, process or remote")
+        self.backend = backend
+        self.env = env
+        self.llm_config = llm_config
+        self.remote_address = remote_address
+        self.remote_authkey = remote_authkey
+        self._controller_server = ControllerServer(data_manager, env) if backend == "process" else None
+        self.max_workers = max_workers
+        self.autoscaler = autoscaler
+        # with the autoscaler the thread pool has its max_workers threads, step_limit lets pool_size steps run at once
+        self.step_limit = None
+        if autoscaler is not None and backend == "thread":
+            self.pool_size = autoscaler.min_workers
+            self.step_limit = PoolLimit(self.pool_size)
+        else:
+            self.pool_size = max_workers or len(self.agent_list)
+        self.executor = self.make_executor(self.pool_size)  # adjust max_workers to control the number of threads
+        self._executor_lock = threading.Lock()  # the pool is replaced by resize_executor
+        self._sized_graph = None  # (graph, version) the pool was last sized for
+        if backend == "remote":
+            self.logger.info(f"remote workers connect to {self.executor.address}")
+
+        # measured step durations, estimate the critical path and the makespan
+        self.task_duration = TaskDuration(duration_path)
+        # ready tasks ranked by priority class, waiting time and critical path slack
+        self.ready_queue = ReadyQueue(aging_interval)
+        # decides the assignment when the candidate lists leave one valid answer, the llm decides the rest
+        self.matcher = AssignMatcher()
+        self.assign_count = {"matcher": 0, "llm": 0}  # assignment rounds decided by each
+
+        # context of the assignment prompt, the queries run concurrently and are started before the prompt needs them
+        self.context_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="ControllerContext")
+        # collaborative tasks left out of the batched decomposition are decomposed one request each, concurrently
+        self.decompose_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ControllerDecompose")
+        self._context = {}  # part -> (key, future)
+        self._context_version = 0  # bumped whenever a step may have changed the data of the data manager
+        self._context_lock = threading.Lock()
+
+        # logs/task_list.json is written by a background thread, only when it changed
+        self.snapshot_publisher = acquire_publisher()
+        if snapshot_address is not None:
+            self.snapshot_publisher.listen(snapshot_address)
 
         # max task time for each task in seconds
         self.max_task_time = 60 * 30 # 30 minutes
+        # cancels a step at its deadline, the result thread then books the timeout
+        self.watchdog = DeadlineWatchdog("StepWatchdog")
 
         # task done signal
         self.one_task_done = True
 
         self.shutdown = False
+        self._closed = False  # set by close
 
     def validate_assignments(self, result: [dict]):
         validated_assignments = []
+        booked = set()  # agents given a task in this round, an agent named twice goes to the first task only
 
-        for assign in result:
+        # the more urgent task by the rank of the ready queue gets an agent asked for twice
+        for assign in sorted(result, key=self.assign_rank):
             task_id = assign["task_id"]
             agent_names = assign["agent"]
             if isinstance(agent_names, BaseAgent):
@@ -105,7 +185,7 @@ class GlobalController:
 
             # Check if agents exist and are valid for the task
             for agent_name in agent_names:
-                agent = next((a for a in self.agent_list if a.name == agent_name), None)
+                agent = self.agent_dict.get(agent_name)
                 if agent is None:
                     self.logger.warning(f"Agent {agent_name} does not exist!")
                     continue
@@ -114,6 +194,11 @@ class GlobalController:
                     self.logger.warning(f"Agent {agent_name} is not valid for the task!")
                     continue
 
+                if agent.name in booked:
+                    self.logger.warning(f"Agent {agent_name} is already assigned in this round!")
+                    continue
+
+                booked.add(agent.name)
                 agent_instances.append(agent)
 
             if agent_instances:
@@ -125,64 +210,169 @@ class GlobalController:
         return validated_assignments
 
 
+    def assign_rank(self, assign: dict) -> tuple:
+        # rank of the task of a task-assignment in the ready queue, then its index, not ready or unknown tasks last
+        task_id = assign.get("task_id")
+        task_rank = None
+        if isinstance(task_id, int) and 0 <= task_id < len(self.task_list):
+            task_rank = self.ready_queue.rank(self.task_list[task_id])
+        return (task_rank is None, task_rank or (), task_id if isinstance(task_id, int) else len(self.task_list))
+
     def execute_assignments(self, validated_assignments):
+        # the collaborative tasks of the round are decomposed together once every assignment is seen
+        collab_list = []
         for assignment in validated_assignments:
             task_instance = assignment["task_instance"]
             agent_instances = assignment["agent_instances"]
-            result = ""
             if len(agent_instances) > 1:
-                assign_name_list = []
-                for agent in agent_instances:
-                    assign_name_list.append(agent.name)
-                agent_state = self.data_manager.query_agent_list(assign_name_list)
-                result = self.generate_decompose_prompt_and_get_response(agent_state, assign_name_list, task_instance.description, task_instance.milestones)
-
-                self.logger.debug("-"*10 + "decompose feedback in controller" + "-"*10)
-                self.logger.debug("-"*40)
+                # held while the task waits for its decomposition, a generator of assignments sees them busy
+                self.hold_agents(task_instance, agent_instances)
+                collab_list.append(assignment)
+                continue
+            for agent, task in self.dispatch_assignment(task_instance, agent_instances, ""):
+                self.task_queue.put((agent, task))
+        for assignment, result in zip(collab_list, self.decompose_assignments(collab_list)):
+            if result is None:
+                self.free_held_agents(assignment["task_instance"], assignment["agent_instances"])
+                continue
+            for agent, task in self.dispatch_assignment(assignment["task_instance"], assignment["agent_instances"], result):
+                self.task_queue.put((agent, task))
+
+    def hold_agents(self, task_instance: Task, agent_instances):
+        for agent in agent_instances:
+            self.assignment[agent.name] = task_instance.id
+
+    def free_held_agents(self, task_instance: Task, agent_instances):
+        # the decomposition failed, the task and its agents are left for the next round
+        for agent in agent_instances:
+            if self.assignment.get(agent.name) == task_instance.id:
+                self.assignment.pop(agent.name)
+
+    def decompose_assignments(self, collab_list: [dict]) -> list:
+        '''
+        Decompose the collaborative tasks of one round with one llm request, its answer is routed to each task
+        by the task index. A task missing from the answer or with a wrong part is decomposed on its own, those
+        requests run concurrently.
+        return: the decomposition of each assignment, None for a task whose decomposition failed
+        '''
+        if not collab_list:
+            return []
+        agent_state = self.data_manager.query_agent_list(self.collab_name_list(collab_list))
+        result_list = [None] * len(collab_list)
+        if len(collab_list) > 1:
+            try:
+                batch_result = self.generate_batch_decompose_prompt_and_get_response(agent_state, collab_list)
+            except Exception as e:
+                self.logger.warning(f"batched decomposition of {len(collab_list)} tasks failed: {e}")
+                batch_result = {}
+            result_list = self.check_batch_decompose(batch_result, collab_list)
+        retry_idx = [idx for idx, result in enumerate(result_list) if result is None]
+        future_list = [self.decompose_executor.submit(self.decompose_assignment, agent_state, collab_list[idx]) for idx in retry_idx]
+        for idx, future in zip(retry_idx, future_list):
+            result_list[idx] = future.result()
+        return result_list
+
+    def decompose_assignment(self, agent_state, assignment: dict) -> [dict]:
+        task_instance = assignment["task_instance"]
+        agent_instances = assignment["agent_instances"]
+        try:
+            result = self.generate_decompose_prompt_and_get_response(agent_state, [agent.name for agent in agent_instances],
+                                                                     task_instance.description, task_instance.milestones)
+            if self.check_decompose(result, agent_instances):
+                return result
+        except Exception as e:
+            self.logger.warning(f"decomposition of task {task_instance.description} failed: {e}")
+        return None
+
+    def collab_name_list(self, collab_list: [dict]) -> [str]:
+        return list(dict.fromkeys(agent.name for assignment in collab_list for agent in assignment["agent_instances"]))
+
+    def check_batch_decompose(self, batch_result: dict, collab_list: [dict]) -> list:
+        # the part of each task, None when it does not cover the agents of the task, the llm may mix up the tasks
+        result_list = []
+        for idx, assignment in enumerate(collab_list):
+            result = batch_result.get(idx)
+            name_set = {agent.name for agent in assignment["agent_instances"]}
+            try:
+                if result is None or {assign["agent"] for assign in result} != name_set or \
+                        not self.check_decompose(result, assignment["agent_instances"]):
+                    result = None
+            except (KeyError, TypeError):
+                result = None
+            result_list.append(result)
+        return result_list
+
+    def check_decompose(self, result: [dict], agent_instances) -> bool:
+        self.logger.debug("-"*10 + "decompose feedback in controller" + "-"*10)
+        self.logger.debug("-"*40)
+        for assign in result:
+            self.logger.debug("|" + assign["agent"] + ": " + assign["description"])
+        self.logger.debug("-"*40)
+        self.logger.debug("-"*15 + "decompose feedback end" + "-"*15)
+
+        if len(result) != len(agent_instances):
+            self.logger.warning("decompose error!")
+            return False
+        return True
+
+    def dispatch_assignment(self, task_instance: Task, agent_instances, result) -> list:
+        '''
+        Book the agents for the task and return the (agent, task) steps to run,
+        a collaborative task gives every agent a copy with its part of the decomposition
+        '''
+        # registered before the first step is queued, a fast step may finish before the loop ends
+        tmp_collab = {"task": task_instance.id, "assign agent": len(agent_instances), "complete agent": 0,
+                      "part": [task_instance.id], "result": []}
+        self.collab_dict[task_instance.id] = tmp_collab
+        task_instance.status = Task.running
+        self.one_task_done = False
+        step_list = []
+        for agent in agent_instances:
+            self.assignment[agent.name] = task_instance.id
+            self.task_agent.setdefault(task_instance.id, []).append(agent.name)
+            task_instance._agent.append(agent.name)
+            # add task to agent's task list
+            if len(agent_instances) > 1:
+                tmp_task = task_instance.copy()
                 for assign in result:
-                    self.logger.debug("|" + assign["agent"] + ": " + assign["description"])
-                self.logger.debug("-"*40)
-                self.logger.debug("-"*15 + "decompose feedback end" + "-"*15)
+                    if assign["agent"] == agent.name:
+                        tmp_task.description = assign["description"]
+                        tmp_task.milestones = assign["milestones"]
+                        tmp_task.status = Task.running
+                        break
+                # the copy has its own id, its feedback is found through the collab of the task
+                tmp_collab["part"].append(tmp_task.id)
+                self.collab_dict[tmp_task.id] = tmp_collab
+                step_list.append((agent, tmp_task))
+            else:
+                step_list.append((agent, task_instance))
+
+        name_list = ", ".join([agent.name for agent in agent_instances])
+        self.logger.info(f"Agent(s) {name_list} are assigned to do task {task_instance.description}")
+        return step_list
+
+    def match_assignments(self) -> [dict]:
+        '''
+        Assign the available tasks without the llm when the candidate lists leave one valid answer
+        return: task-assignments in the format of the llm response, None if the llm has to choose
+        '''
+        task_id = {task: idx for idx, task in enumerate(self.task_list)}
+        free_agent_list = [name for name in self.name_list if self.assignment.get(name) is None]
+        matched = self.matcher.match([task for task in self.task_list if task.available], free_agent_list, self.ready_queue.rank)
+        if matched is None:
+            self.assign_count["llm"] += 1
+            return None
+        self.assign_count["matcher"] += 1
+        self.logger.info(f"{len(matched)} task(s) assigned without the llm")
+        return [{"task_id": task_id[task], "agent": name_list} for task, name_list in matched]
 
-                if len(result) != len(agent_instances):
-                    self.logger.warning("decompose error!")
-                    continue
-            tmp_collab = {"task": task_instance.id, "assign agent": 0, "complete agent": 0}
-            for agent in agent_instances:
-                self.assignment[agent.name] = task_instance.id
-                task_instance._agent.append(agent.name)
-                # add task to agent's task list
-                if len(agent_instances) > 1:
-                    tmp_task = task_instance.copy()
-                    for assign in result:
-                        if assign["agent"] == agent.name:
-                            tmp_task.description = assign["description"]
-                            tmp_task.milestones = assign["milestones"]
-                            tmp_task.status = Task.running
-                            break
-                    with self.task_list_lock:
-                        self.task_queue.append((agent, tmp_task))
-                        time.sleep(1)
-                else:
-                    with self.task_list_lock:
-                        task_instance.status = Task.running
-                        self.task_queue.append((agent, task_instance))
-                        time.sleep(1)
-                self.one_task_done = False
-                tmp_collab["assign agent"] += 1
-        
-            name_list = ", ".join([agent.name for agent in agent_instances])
-            self.logger.info(f"Agent(s) {name_list} are assigned to do task {task_instance.description}")
-            
-            self.collab_list.append(tmp_collab)
-            task_instance.status = Task.running
     # 生产者
     def assign_tasks_to_agents(self, result: [dict]):
         # self.logger.info("Start to assign tasks!")
         validated_assignments = self.validate_assignments(result)
         self.execute_assignments(validated_assignments)
 
-    def generate_prompt_and_get_response(self, env, experience, agent_state):
+    def assign_prompt(self, env, experience, agent_state) -> (str, str):
         controller_system_prompt = CONTROLLER_SYSTEM_PROMPT
         controller_user_prompt = format_string(CONTROLLER_USER_PROMPT, {
             "env": env[0],
@@ -191,6 +381,10 @@ class GlobalController:
             "free agent": smart_truncate([agent.to_json() for agent in self.agent_list if self.assignment.get(agent.name) is None], 2048),
             "tasks": smart_truncate([task.assign_json(idx) for idx, task in enumerate(self.task_list) if task.available], 2048)
         })
+        return controller_system_prompt, controller_user_prompt
+
+    def generate_prompt_and_get_response(self, env, experience, agent_state):
+        controller_system_prompt, controller_user_prompt = self.assign_prompt(env, experience, agent_state)
 
         # self.logger.debug("-"*10 + "assign prompt in controller" + "-"*10)
         # print(controller_user_prompt)
@@ -202,8 +396,13 @@ class GlobalController:
         # self.logger.debug("-"*15 + "response end" + "-"*15)
 
         return extract_info(response)
-    
-    def generate_decompose_prompt_and_get_response(self, agent_state, name_list, task_description, task_milestones):
+
+    async def agenerate_prompt_and_get_response(self, env, experience, agent_state):
+        controller_system_prompt, controller_user_prompt = self.assign_prompt(env, experience, agent_state)
+        response = await self.llm.agenerate(controller_system_prompt, controller_user_prompt, cache_enabled=True, json_check=True)
+        return extract_info(response)
+
+    def decompose_prompt(self, agent_state, name_list, task_description, task_milestones) -> (str, str):
         controller_system_prompt = CONTROLLER_DECOMPOSE_SYSTEM_PROMPT
         controller_user_prompt = format_string(CONTROLLER_DECOMPOSE_USER_PROMPT, {
             "agent state": agent_state,
@@ -211,6 +410,10 @@ class GlobalController:
             "task milestones": task_milestones,
             "agent name": name_list
         })
+        return controller_system_prompt, controller_user_prompt
+
+    def generate_decompose_prompt_and_get_response(self, agent_state, name_list, task_description, task_milestones):
+        controller_system_prompt, controller_user_prompt = self.decompose_prompt(agent_state, name_list, task_description, task_milestones)
 
         # self.logger.debug("-"*10 + "decompose prompt in controller" + "-"*10)
         # print(controller_user_prompt)
@@ -223,62 +426,259 @@ class GlobalController:
 
         return extract_info(response)
 
+    async def agenerate_decompose_prompt_and_get_response(self, agent_state, name_list, task_description, task_milestones):
+        controller_system_prompt, controller_user_prompt = self.decompose_prompt(agent_state, name_list, task_description, task_milestones)
+        response = await self.llm.agenerate(controller_system_prompt, controller_user_prompt, cache_enabled=True, json_check=True)
+        return extract_info(response)
+
+    def batch_decompose_prompt(self, agent_state, collab_list: [dict]) -> (str, str):
+        controller_system_prompt = CONTROLLER_DECOMPOSE_SYSTEM_PROMPT
+        controller_user_prompt = format_string(CONTROLLER_BATCH_DECOMPOSE_USER_PROMPT, {
+            "agent state": agent_state,
+            "task list": [{
+                "task": idx,
+                "description": assignment["task_instance"].description,
+                "milestones": assignment["task_instance"].milestones,
+                "agent": [agent.name for agent in assignment["agent_instances"]]
+            } for idx, assignment in enumerate(collab_list)]
+        })
+        return controller_system_prompt, controller_user_prompt
+
+    def route_batch_decompose(self, info_list: [dict], task_num: int) -> dict:
+        # task index -> decomposed assignments of the task, an assignment without a valid index is dropped
+        batch_result = {}
+        for info in info_list:
+            try:
+                idx = int(info.get("task"))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= idx < task_num:
+                batch_result.setdefault(idx, []).append(info)
+        return batch_result
+
+    def generate_batch_decompose_prompt_and_get_response(self, agent_state, collab_list: [dict]) -> dict:
+        controller_system_prompt, controller_user_prompt = self.batch_decompose_prompt(agent_state, collab_list)
+        response = self.llm.generate(controller_system_prompt, controller_user_prompt, cache_enabled=True, json_check=True)
+        return self.route_batch_decompose(extract_info(response), len(collab_list))
+
+    async def agenerate_batch_decompose_prompt_and_get_response(self, agent_state, collab_list: [dict]) -> dict:
+        controller_system_prompt, controller_user_prompt = self.batch_decompose_prompt(agent_state, collab_list)
+        response = await self.llm.agenerate(controller_system_prompt, controller_user_prompt, cache_enabled=True, json_check=True)
+        return self.route_batch_decompose(extract_info(response), len(collab_list))
+
     # worker
     def worker(self):
-        while True:
-            if self.shutdown:
+        while not self.shutdown:
+            agent_task = self.task_queue.get()
+            if agent_task is None:
                 break
-            with self.task_list_lock:
-                if not self.task_queue:
-                    time.sleep(self.query_interval)
-                    continue
-                while self.task_queue:
-                    agent_task = self.task_queue.pop(0)
-                    agent, task = agent_task
+            agent, task = agent_task
 
-                    future = self.executor.submit(agent.step, task)
-                    with self.result_list_lock:
-                        self.result_queue.append((future, agent, task, time.time()))
-                    time.sleep(self.query_interval)
+            cancel_token = CancelToken()
+            if self.step_limit is not None and not self.step_limit.acquire(cancel_token):
+                break
+            with self._executor_lock:
+                future = self.submit_step(agent, task, cancel_token)
+            start_time = time.time()
+            with self.result_list_lock:
+                self.running_step[future] = (agent, task, start_time, cancel_token)
+            self.watchdog.schedule(future, start_time + self.max_task_time, lambda future=future: self.cancel_step(future))
+            if self.step_limit is not None:
+                future.add_done_callback(lambda _, cancel_token=cancel_token: self.step_limit.release(cancel_token))
+            # the result thread is woken up as soon as the step finishes
+            future.add_done_callback(self.result_queue.put)
+
+    def cancel_step(self, future: Future):
+        # called by the watchdog at the deadline, the step stops at its next checkpoint and the result thread fails it
+        with self.result_list_lock:
+            step = self.running_step.get(future)
+        if step is None:
+            return
+        step[3].cancel(f"timeout after {self.max_task_time}s")
+        if self.backend == "remote":
+            self.executor.cancel(future, f"timeout after {self.max_task_time}s")
+        self.result_queue.put(future)
+
+    def make_executor(self, pool_size: int):
+        if self.backend == "process":
+            # BaseAgent and init_language_model are looked up here, so the workers build the same agents
+            return make_process_executor(pool_size, BaseAgent, init_language_model, self.llm_config, self.env,
+                                         self._controller_server, silent=False)
+        if self.backend == "remote":
+            # one pool for the whole run, its size is the slots of the workers connected
+            init = {"agent_class": BaseAgent, "llm_factory": init_language_model, "llm_config": self.llm_config,
+                    "env_class": type(self.env), "agent_pool": self.env.agent_pool, "silent": False}
+            return RemoteWorkerPool(self.remote_address, self.remote_authkey, init,
+                                    {"data_manager": self.data_manager, "env": self.env})
+        if self.step_limit is not None:
+            return StepPool(max_workers=self.autoscaler.max_workers)
+        return StepPool(max_workers=pool_size)
+
+    def submit_step(self, agent: BaseAgent, task: Task, cancel_token: CancelToken) -> Future:
+        if self.backend == "process":
+            # the worker asks the controller for the token at every checkpoint of the step
+            tokens = self._controller_server.tokens
+            token_id = tokens.add(cancel_token)
+            future = self.executor.submit(run_step, agent.name, agent.agent_type, list(agent.history_action_list), task,
+                                          token_id=token_id)
+            future.add_done_callback(lambda _: tokens.remove(token_id))
+            return future
+        if self.backend == "remote":
+            # the remote worker has a token of its own, cancel_step cancels it
+            return self.executor.submit(run_step, agent.name, agent.agent_type, list(agent.history_action_list), task)
+        return self.executor.submit(agent.step, task, cancel_token)
+
+    def renew_executor(self, pool_size: int):
+        # running steps finish on the old pool, new steps are submitted to the new one
+        with self._executor_lock:
+            old_executor = self.executor
+            self.pool_size = pool_size
+            self.executor = self.make_executor(pool_size)
+        old_executor.shutdown(wait=False)
+
+    def close_backend(self):
+        # the worker processes and the controller server live as long as run
+        # the server is closed once the workers are gone, a worker still starting connects to it
+        if self.backend == "process":
+            executor, server = self.executor, self._controller_server
+
+            def close():
+                executor.shutdown(wait=True, cancel_futures=True)
+                server.close()
+            threading.Thread(target=close, name="CloseBackend", daemon=True).start()
+        elif self.backend == "remote":
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            # the idle threads leave, a step past its deadline keeps its thread until it stops
+            self.executor.shutdown(wait=False)
+
+    def close(self):
+        # the backend, pools and background threads of the controller, once run or arun is over
+        if self._closed:
+            return
+        self._closed = True
+        self.close_backend()
+        self.watchdog.close()
+        self.context_executor.shutdown(wait=False, cancel_futures=True)
+        self.decompose_executor.shutdown(wait=False, cancel_futures=True)
+        release_publisher(self.snapshot_publisher)
+
+    def notify_state_changed(self):
+        with self._state_changed:
+            self._state_version += 1
+            self._state_changed.notify_all()
+
+    '''
+        prompt context
+    '''
+    def submit_context(self, part: str, key, query, *args) -> Future:
+        # the running or finished query of the same key is reused, a failed one is run again
+        cached = self._context.get(part)
+        if cached is not None and cached[0] == key:
+            future = cached[1]
+            if not future.done() or (not future.cancelled() and future.exception() is None):
+                return future
+        future = self.context_executor.submit(query, *args)
+        self._context[part] = (key, future)
+        return future
+
+    def prefetch_context(self, task_list: [Task] = None) -> [Future]:
+        '''
+        Start the stale queries of the assignment prompt context in the background and return their futures,
+        env and agent states are kept until a step finishes, the experience also until the task list changes.
+        task_list: tasks of the experience query, None leaves it out
+        '''
+        with self._context_lock:
+            version = self._context_version
+            future_list = [
+                self.submit_context("env", version, self.data_manager.query_env),
+                self.submit_context("agent_state", (version, tuple(self.name_list)), self.data_manager.query_agent_list, list(self.name_list)),
+            ]
+            if task_list is not None:
+                future_list.append(self.submit_context("experience", (version, tuple(task.id for task in task_list)),
+                                                       self.data_manager.query_task_list_experience, list(task_list)))
+        return future_list
+
+    def invalidate_context(self):
+        # a step changed the env and the agent states, query them again while the task manager handles the feedback
+        with self._context_lock:
+            self._context_version += 1
+        if not self.shutdown:
+            self.prefetch_context()
+
+    def query_context(self) -> (str, list, list):
+        # (env, agent_state, experience) of the current task list, waits only for the queries still running
+        env, agent_state, experience = [future.result() for future in self.prefetch_context(self.task_list)]
+        return env, agent_state, experience
+
+    async def aquery_context(self) -> (str, list, list):
+        env, agent_state, experience = await asyncio.gather(*[asyncio.wrap_future(future) for future in self.prefetch_context(self.task_list)])
+        return env, agent_state, experience
+
+    def wait_state_changed(self, version: int, timeout: float = None):
+        # wait until something happened after version was read
+        with self._state_changed:
+            self._state_changed.wait_for(lambda: self._state_version != version or self.shutdown, timeout)
+
+    def stop(self):
+        self.shutdown = True
+        self.task_queue.put(None)
+        self.result_queue.put(None)
+        self.watchdog.close()
+        if self.step_limit is not None:
+            self.step_limit.close()
+        self.notify_state_changed()
+        self.snapshot_publisher.flush(self.heartbeat_interval)
 
     def set_task_status(self, task_id, status, feedback):
-        for task in self.task_manager.graph.vertex:
-            if task.id == task_id:
-                if task.status == Task.success and status == Task.failure:
-                    if status == Task.failure:
-                        task.status = status
-                else:
-                    task.status = status
-
-                if type(feedback) == dict and type(task.reflect) == None:
-                    task.reflect = feedback
-                elif type(feedback) == str and type(task.reflect) == None:
-                    task.reflect = feedback
-                elif type(feedback) == dict and type(task.reflect) == dict:
-                    task.reflect = [task.reflect, feedback]
-                elif type(feedback) == str and type(task.reflect) == str:
-                    task.reflect = [task.reflect, feedback]
-                elif type(task.reflect) == list:
-                    task.reflect.append(feedback)
-                else:
-                    task.reflect = feedback
-                break
+        task = self.get_task_by_id(task_id)
+        if task is None:
+            return
+        if task.status == Task.success and status == Task.failure:
+            if status == Task.failure:
+                task.status = status
+        else:
+            task.status = status
+
+        if type(feedback) == dict and type(task.reflect) == None:
+            task.reflect = feedback
+        elif type(feedback) == str and type(task.reflect) == None:
+            task.reflect = feedback
+        elif type(feedback) == dict and type(task.reflect) == dict:
+            task.reflect = [task.reflect, feedback]
+        elif type(feedback) == str and type(task.reflect) == str:
+            task.reflect = [task.reflect, feedback]
+        elif type(task.reflect) == list:
+            task.reflect.append(feedback)
+        else:
+            task.reflect = feedback
+
     def get_task_by_id(self, task_id):
-        for task in self.task_manager.graph.vertex:
-            if task.id == task_id:
-                return task
-        return None
+        # the index is rebuilt when the task manager replaces or edits the graph
+        graph = self.task_manager.graph
+        if self._indexed_graph != (graph, getattr(graph, "_version", None)):
+            self._task_dict = {task.id: task for task in graph.vertex}
+            self._indexed_graph = (graph, getattr(graph, "_version", None))
+        return self._task_dict.get(task_id)
+
+    def release_agents(self, task_id):
+        for name in self.task_agent.pop(task_id, []):
+            if self.assignment.get(name) == task_id:
+                self.assignment.pop(name)
+
+    def remove_collab(self, collab: dict):
+        for task_id in collab["part"]:
+            self.collab_dict.pop(task_id, None)
     
-    def update_feedback(self, task, agent, detail):
-        
-        collab = next((c for c in self.collab_list if c["task"] == task.id), None)
+    def update_feedback(self, task, agent, detail, tag=None):
+        # tag: result of agent.reflect, reflected here when it is None
+        collab = self.collab_dict.get(task.id)
         if collab == None:
+            if tag is None:
+                tag = agent.reflect(task, detail)
             task.status = Task.success if tag else Task.failure
             self.set_task_status(task.id, task.status, detail)
-
-            for agent in self.agent_list:
-                if self.assignment.get(agent.name) == task.id:
-                    self.assignment.pop(agent.name)
+            self.release_agents(task.id)
 
             self.logger.info(
                 f"task {task.description} has been executed, the result is {task.status}")
@@ -287,32 +687,39 @@ class GlobalController:
 
             return
         else:
-            collab["complete agent"] += 1
-            tag = agent.reflect(task, detail)
+            if tag is None:
+                tag = agent.reflect(task, detail)
+            # task may be the copy of one agent, the task of the graph is collab["task"]
             task.status = Task.success if tag else Task.failure
-            self.set_task_status(task.id, Task.success if tag else Task.failure, task.reflect)
-
-            if collab["complete agent"] == collab["assign agent"]:
-                for agent in self.agent_list:
-                    if self.assignment.get(agent.name) == task.id:
-                        self.assignment.pop(agent.name)
+            if self.complete_part(collab, task.status, task.reflect):
+                self.release_agents(collab["task"])
+                graph_task = self.get_task_by_id(collab["task"])
 
                 self.logger.info(
-                    f"task {task.description} has been executed, the result is {task.status}")
-                self.task_manager.feedback_task(self.get_task_by_id(task.id))
+                    f"task {task.description} has been executed, the result is {graph_task.status if graph_task else task.status}")
+                self.task_manager.feedback_task(graph_task)
                 self.one_task_done = True
 
-                self.collab_list.remove(collab)
+                self.remove_collab(collab)
+
+    def complete_part(self, collab: dict, status: str, feedback) -> bool:
+        # True once every agent of the task has finished its part, the task of the graph only changes then,
+        # before that its successors would become ready while other agents are still working on it
+        collab["complete agent"] += 1
+        collab["result"].append((status, feedback))
+        if collab["complete agent"] < collab["assign agent"]:
+            return False
+        status = Task.success if all(part_status == Task.success for part_status, _ in collab["result"]) else Task.failure
+        for _, feedback in collab["result"]:
+            self.set_task_status(collab["task"], status, feedback)
+        return True
 
     def update_task_status(self, task, status, detail): 
-        collab = next((c for c in self.collab_list if c["task"] == task.id), None)
+        collab = self.collab_dict.get(task.id)
         if collab == None:
             task.status = status
             self.set_task_status(task.id, status, detail)
-
-            for agent in self.agent_list:
-                if self.assignment.get(agent.name) == task.id:
-                    self.assignment.pop(agent.name)
+            self.release_agents(task.id)
 
             self.logger.info(
                 f"task {task.description} has been executed, the result is {task.status}")
@@ -322,53 +729,131 @@ class GlobalController:
             return
         
         else:
-            collab["complete agent"] += 1
             task.status = status
-            self.set_task_status(task.id, status, detail)
-
-            if collab["complete agent"] == collab["assign agent"]:
-                for agent in self.agent_list:
-                    if self.assignment.get(agent.name) == task.id:
-                        self.assignment.pop(agent.name)
+            if self.complete_part(collab, status, detail):
+                self.release_agents(collab["task"])
+                graph_task = self.get_task_by_id(collab["task"])
 
                 self.logger.info(
-                    f"task {task.description} has been executed, the result is {task.status}")
-                self.task_manager.feedback_task(self.get_task_by_id(task.id))
+                    f"task {task.description} has been executed, the result is {graph_task.status if graph_task else task.status}")
+                self.task_manager.feedback_task(graph_task)
                 self.one_task_done = True
 
-                self.collab_list.remove(collab)
+                self.remove_collab(collab)
+
+    def timeout_step(self, agent: BaseAgent, task: Task, future: Future = None):
+        # the step is failed at once, its agent is free for new tasks
+        self.logger.warning(f"Task {task.description} timeout!")
+        # a step still waiting for a thread never starts, a running one keeps its thread until its next checkpoint,
+        # a new thread takes its place in the pool meanwhile
+        # a process or remote step stops at the next checkpoint it asks its token at, the pool is kept
+        if future is not None and not future.cancel() and not future.done() and self.backend == "thread":
+            self.executor.replace(future)
+        collab = self.collab_dict.get(task.id)
+        task_id = collab["task"] if collab is not None else task.id
+        self.update_task_status(task, Task.failure, f"Task {task.description} timeout!")
+        # the other agents of a collaborative task keep it until their parts finish
+        if self.assignment.get(agent.name) == task_id:
+            self.assignment.pop(agent.name)
 
     # 消费者
     def process_completed_tasks(self):
-        while True:
+        while not self.shutdown:
+            # sleep until a step finishes or the watchdog cancels one at its deadline
+            future = self.result_queue.get()
             if self.shutdown:
                 break
-            with self.result_list_lock:
-                result_list_copy = []
-                for future, agent, task, start_time in self.result_queue:
-                    # if future.done() and task.id in [t.id for t in self.task_list] and task.status == Task.running:
-                    if future.done():
-                        try:
-                            self.logger.info(f"Task {task.description} finished!")
-                            _, detail = future.result()
-                            self.update_feedback(task, agent, detail)
-
-                        except Exception as e: # 没有对于 collab 的处理 这个代码不正确
-                            traceback.print_exception(type(e), e, e.__traceback__)
-                            self.logger.error(f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
-                            self.logger.exception(e)
-                            self.update_task_status(task, Task.failure, f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")                            
-                    
-                    elif time.time() - start_time > self.max_task_time: # 没有对于 collab 的处理 这个代码不正确
-                        self.logger.warning(f"Task {task.description} timeout!")
-                        self.update_task_status(task, Task.failure, f"Task {task.description} timeout!")
-                    
-                    else:
-                        result_list_copy.append((future, agent, task, start_time))
-                    time.sleep(self.query_interval)
-                self.result_queue = result_list_copy
 
-                
+            if future is not None:
+                self.watchdog.cancel(future)
+                with self.result_list_lock:
+                    step = self.running_step.pop(future, None)
+                if step is not None:
+                    agent, task, start_time, cancel_token = step
+                    if cancel_token.cancelled and not (future.done() and not future.cancelled() and future.exception() is None):
+                        if self.step_limit is not None:
+                            self.step_limit.release(cancel_token)
+                        self.timeout_step(agent, task, future)
+                        self.invalidate_context()
+                        self.notify_state_changed()
+                        continue
+                    self.task_duration.add(task, time.time() - start_time)
+                    try:
+                        self.logger.info(f"Task {task.description} finished!")
+                        _, detail = future.result()
+                        self.update_feedback(task, agent, detail)
+
+                    except Exception as e: # 没有对于 collab 的处理 这个代码不正确
+                        traceback.print_exception(type(e), e, e.__traceback__)
+                        self.logger.error(f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
+                        self.logger.exception(e)
+                        self.update_task_status(task, Task.failure, f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
+
+            if future is not None:
+                self.invalidate_context()
+            self.notify_state_changed()
+
+    def prioritize_task_list(self, task_list: [Task]) -> [Task]:
+        # ready tasks first in the order of the ready queue, the head goes to a free agent first, then the other open tasks
+        ready_task_list = [task for task in task_list if task.status == Task.unknown and len(task.predecessor_task_list) == 0]
+        slack = self.task_manager.graph.get_slack(self.task_duration.remaining)
+        self.ready_queue.update(ready_task_list, slack)
+        ready_task_set = set(ready_task_list)
+        return self.ready_queue.order() + [task for task in task_list if task not in ready_task_set]
+
+    def resize_executor(self):
+        if self.autoscaler is not None:
+            # the autoscaler decides on its own timer, see schedule_autoscale
+            return
+        # size the pool to the parallelism the rest of the graph can use, no more threads than agents
+        # a process pool keeps its size, starting workers costs more than keeping idle ones
+        # the size of a remote pool is the slots of the workers connected
+        if self.max_workers is not None or self.backend != "thread":
+            return
+        graph = self.task_manager.graph
+        if self._sized_graph == (graph, getattr(graph, "_version", None)):
+            return
+        self._sized_graph = (graph, getattr(graph, "_version", None))
+        pool_size = graph.get_parallelism(self.task_duration.remaining, max_worker_num=len(self.agent_list))
+        if pool_size == self.pool_size:
+            return
+        critical_path, critical_length = graph.get_critical_path(self.task_duration.remaining)
+        self.logger.info(f"resize thread pool {self.pool_size} -> {pool_size}, "
+                         f"critical path {len(critical_path)} tasks, about {critical_length:.0f}s, "
+                         f"predicted makespan {graph.predict_makespan(pool_size, self.task_duration.remaining):.0f}s")
+        self.renew_executor(pool_size)
+
+    def schedule_autoscale(self):
+        # one decision every autoscaler.interval seconds on the watchdog thread, whether the scheduling loop is awake
+        # or not, until stop closes the watchdog
+        def tick():
+            if self.shutdown:
+                return
+            try:
+                self.autoscale()
+            finally:
+                self.schedule_autoscale()
+        self.watchdog.schedule("autoscale", time.time() + self.autoscaler.interval, tick)
+
+    def autoscale(self):
+        # ready: the steps waiting for a worker and the ready tasks as far as there are free agents for them
+        with self.result_list_lock:
+            in_flight = len(self.running_step)
+        ready = self.task_queue.qsize() + min(len(self.ready_queue), max(len(self.agent_list) - len(self.assignment), 0))
+        # the other backends keep their pool, the autoscaler goes on from the size it chose last
+        size = self.pool_size if self.backend == "thread" else self.autoscaler.size
+        decision = self.autoscaler.decide(size, ready, in_flight)
+        if decision is None:
+            return
+        self.snapshot_publisher.publish("logs/autoscaler.json", self.autoscaler.metrics())
+        if decision["to"] == size or self.backend != "thread":
+            return
+        self.logger.info(f"autoscale thread pool {self.pool_size} -> {decision['to']}, {decision['reason']}, "
+                         f"ready {ready}, in flight {in_flight}, llm p50 {decision['p50']} p95 {decision['p95']}, "
+                         f"rate limits {decision['rate_limit']}")
+        self.pool_size = decision["to"]
+        self.step_limit.resize(self.pool_size)
+
     def check_task_list_available(self):
         available_task_list = []
         for task in self.task_list:
@@ -379,8 +864,8 @@ class GlobalController:
                 task.available = False
                 continue
             free_candidate = 0
-            for agent in self.agent_list:
-                if agent.name in task.candidate_list and self.assignment.get(agent.name) is None:
+            for name in set(task.candidate_list):
+                if name in self.agent_dict and self.assignment.get(name) is None:
                     free_candidate += 1
             if free_candidate < task.number:
                 task.available = False
@@ -391,64 +876,77 @@ class GlobalController:
         
         return available_task_list
 
+    def write_task_list(self):
+        # write task list to file
+        agent_states = []
+        task_description = {task.id: task.description for task in self.task_list}
+        for agent in self.agent_list:
+            if self.assignment.get(agent.name) is None:
+                agent_states.append({"name": agent.name, "state": "free", "task": None})
+            else:
+                tmp_description = task_description.get(self.assignment.get(agent.name), "")
+                agent_states.append({"name": agent.name, "state": "busy", "task": tmp_description})
+
+        self.snapshot_publisher.publish("logs/task_list.json", {
+            "agent_states": agent_states,
+            "task_list": [task.assign_json(idx) for idx, task in enumerate(self.task_list)],
+        })
+
+    def all_agent_assignments(self):
+        # tasks that need every candidate go to all of them once they are all free
+        # a generator, each task is checked after the previous one is dispatched
+        for task in self.task_list:
+            if task.number == len(task.candidate_list) and task.available and \
+                all([self.assignment.get(name) is None for name in task.candidate_list if name in self.agent_dict]):
+
+                self.logger.info(f"Task {task.description} is assigned to all agents!")
+                yield {
+                    "task_instance": task,
+                    "agent_instances": [self.agent_dict[name] for name in dict.fromkeys(task.candidate_list) if name in self.agent_dict]
+                }
+
     def execute_tasks(self):
         try:
             while True:
                 if self.shutdown:
                     break
+                # anything that happens from here on wakes up the wait at the end of the loop
+                version = self._state_version
                 self.task_list = self.task_manager.query_subtask_list()
                 if self.task_list == []:
                     self.logger.info("all assigned tasks are finished ...")
-                    self.shutdown = True
+                    self.stop()
                     break
-                # write task list to file
-                agent_states = []
-                for agent in self.agent_list:
-                    if self.assignment.get(agent.name) is None:
-                        agent_states.append({"name": agent.name, "state": "free", "task": None})
-                    else:
-                        tmp_description = ""
-                        for task in self.task_list:
-                            if task.id == self.assignment.get(agent.name):
-                                tmp_description = task.description
-                                break
-                        agent_states.append({"name": agent.name, "state": "busy", "task": tmp_description})
-
-                with open("logs/task_list.json", "w") as f:
-                    json.dump({
-                        "agent_states": agent_states,
-                        "task_list": [task.assign_json(idx) for idx, task in enumerate(self.task_list)],
-                    }, f, indent=4)
+                self.task_list = self.prioritize_task_list(self.task_list)
+                self.resize_executor()
+                self.write_task_list()
                     
                 if self.check_task_list_available() == []:
                     # self.logger.info("no available task ...")
-                    # sleep
-                    time.sleep(self.query_interval)
+                    # wait for a step to finish
+                    self.wait_state_changed(version, self.heartbeat_interval)
                     continue
 
                 if self.one_task_done:
-                    for task in self.task_list:
-                        if task.number == len(task.candidate_list) and task.available and \
-                            all([self.assignment.get(agent.name) is None for agent in self.agent_list if agent.name in task.candidate_list]):
-
-                            self.logger.info(f"Task {task.description} is assigned to all agents!")
-                            self.execute_assignments([{
-                                "task_instance": task,
-                                "agent_instances": [agent for agent in self.agent_list if agent.name in task.candidate_list]
-                            }])
+                    # the context queries run while the all-agent tasks are decomposed and the matcher runs
+                    self.prefetch_context(self.task_list)
+                    self.execute_assignments(self.all_agent_assignments())
 
                     if self.check_task_list_available() != []:
-                        env = self.data_manager.query_env()
-                        agent_state = self.data_manager.query_agent_list(self.name_list)
-                        experience = self.data_manager.query_task_list_experience(self.task_list)
-
-                        result = self.generate_prompt_and_get_response(env, experience, agent_state)
+                        result = self.match_assignments()
+                        if result is None:
+                            env, agent_state, experience = self.query_context()
+                            result = self.generate_prompt_and_get_response(env, experience, agent_state)
                         self.assign_tasks_to_agents(result)
+
+                self.wait_state_changed(version, self.heartbeat_interval)
         except KeyboardInterrupt:
-            self.shutdown = True
+            self.stop()
             self.task_manager = None
             self.data_manager = None
             self.executor.shutdown(wait=False)
+            self.context_executor.shutdown(wait=False, cancel_futures=True)
+            self.decompose_executor.shutdown(wait=False, cancel_futures=True)
             raise Exception("Interrupted by user")
 
     def run(self):
@@ -461,16 +959,166 @@ class GlobalController:
             task_thread.start()
             worker_thread.start()
             result_thread.start()
+            if self.autoscaler is not None:
+                self.schedule_autoscale()
             # wait for threads to finish
             task_thread.join()
             worker_thread.join()
             result_thread.join()
+            self.close()
         except KeyboardInterrupt:
             # force to shutdown
-            self.shutdown = True
+            self.stop()
             self.task_manager = None
             self.data_manager = None
             # shutdown thread pool
             self.executor.shutdown(wait=False)
+            self.context_executor.shutdown(wait=False, cancel_futures=True)
+            self.decompose_executor.shutdown(wait=False, cancel_futures=True)
             # raise exception
-            raise Exception("Interrupted by user")
\ No newline at end of file
+            raise Exception("Interrupted by user")
+    '''
+        asyncio mode
+    '''
+    async def arun(self, step_concurrency: int = None):
+        '''
+        Run the controller as coroutines on the running event loop instead of the threads of run().
+        Every agent step is an asyncio task, at most step_concurrency steps run at once (default: the pool size),
+        llm calls are bounded by the semaphore of each model and env steps by BaseAgent.env_concurrency.
+        Leaving arun, by the end of the tasks, an error or cancellation, cancels the running steps first,
+        then closes the controller. Only the thread backend runs in this mode, the steps of the process and
+        remote backends are only run by run().
+
+        usage: asyncio.run(controller.arun())
+        '''
+        if self.backend != "thread":
+            raise ValueError(f"the asyncio mode runs the steps as coroutines, backend {self.backend} needs run()")
+        self.shutdown = False
+        self._step_semaphore = asyncio.Semaphore(step_concurrency or self.pool_size)
+        self._step_done = asyncio.Event()  # set whenever a step finishes
+        self._feedback_lock = asyncio.Lock()  # feedback is handled one step at a time, like the result thread
+        self._step_task = set()
+        try:
+            await self.aexecute_tasks()
+        finally:
+            self.shutdown = True
+            for step_task in self._step_task:
+                step_task.cancel()
+            await asyncio.gather(*self._step_task, return_exceptions=True)
+            await asyncio.to_thread(self.snapshot_publisher.flush, self.heartbeat_interval)
+            await asyncio.to_thread(self.close)
+
+    def run_async(self, step_concurrency: int = None):
+        # blocking entry of the asyncio mode
+        return asyncio.run(self.arun(step_concurrency))
+
+    async def aexecute_tasks(self):
+        while not self.shutdown:
+            # anything that happens from here on wakes up the wait at the end of the loop
+            self._step_done.clear()
+            self.task_list = await self.task_manager.aquery_subtask_list()
+            if self.task_list == []:
+                self.logger.info("all assigned tasks are finished ...")
+                break
+            self.task_list = self.prioritize_task_list(self.task_list)
+            self.write_task_list()
+
+            if self.check_task_list_available() != [] and self.one_task_done:
+                self.prefetch_context(self.task_list)
+                await self.aexecute_assignments(self.all_agent_assignments())
+
+                if self.check_task_list_available() != []:
+                    result = self.match_assignments()
+                    if result is None:
+                        env, agent_state, experience = await self.aquery_context()
+                        result = await self.agenerate_prompt_and_get_response(env, experience, agent_state)
+                    await self.aexecute_assignments(self.validate_assignments(result))
+
+            try:
+                await asyncio.wait_for(self._step_done.wait(), self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def aexecute_assignments(self, validated_assignments):
+        collab_list = []
+        for assignment in validated_assignments:
+            task_instance = assignment["task_instance"]
+            agent_instances = assignment["agent_instances"]
+            if len(agent_instances) > 1:
+                self.hold_agents(task_instance, agent_instances)
+                collab_list.append(assignment)
+                continue
+            self.start_step_task(self.dispatch_assignment(task_instance, agent_instances, ""))
+        for assignment, result in zip(collab_list, await self.adecompose_assignments(collab_list)):
+            if result is None:
+                self.free_held_agents(assignment["task_instance"], assignment["agent_instances"])
+                continue
+            self.start_step_task(self.dispatch_assignment(assignment["task_instance"], assignment["agent_instances"], result))
+
+    def start_step_task(self, step_list: list):
+        for agent, task in step_list:
+            step_task = asyncio.create_task(self.arun_step(agent, task))
+            self._step_task.add(step_task)
+            step_task.add_done_callback(self._step_task.discard)
+
+    async def adecompose_assignments(self, collab_list: [dict]) -> list:
+        # decompose_assignments on the event loop, the tasks decomposed on their own are gathered
+        if not collab_list:
+            return []
+        agent_state = await asyncio.to_thread(self.data_manager.query_agent_list, self.collab_name_list(collab_list))
+        result_list = [None] * len(collab_list)
+        if len(collab_list) > 1:
+            try:
+                batch_result = await self.agenerate_batch_decompose_prompt_and_get_response(agent_state, collab_list)
+            except Exception as e:
+                self.logger.warning(f"batched decomposition of {len(collab_list)} tasks failed: {e}")
+                batch_result = {}
+            result_list = self.check_batch_decompose(batch_result, collab_list)
+        retry_idx = [idx for idx, result in enumerate(result_list) if result is None]
+        retry_result = await asyncio.gather(*[self.adecompose_assignment(agent_state, collab_list[idx]) for idx in retry_idx])
+        for idx, result in zip(retry_idx, retry_result):
+            result_list[idx] = result
+        return result_list
+
+    async def adecompose_assignment(self, agent_state, assignment: dict) -> [dict]:
+        task_instance = assignment["task_instance"]
+        agent_instances = assignment["agent_instances"]
+        try:
+            result = await self.agenerate_decompose_prompt_and_get_response(agent_state, [agent.name for agent in agent_instances],
+                                                                            task_instance.description, task_instance.milestones)
+            if self.check_decompose(result, agent_instances):
+                return result
+        except Exception as e:
+            self.logger.warning(f"decomposition of task {task_instance.description} failed: {e}")
+        return None
+
+    async def arun_step(self, agent: BaseAgent, task: Task):
+        '''
+        One agent step and its feedback, the coroutine version of worker and process_completed_tasks.
+        A step running longer than max_task_time is cancelled and fails, the env step it waits for
+        is cancelled through its token and leaves its thread at the next checkpoint.
+        '''
+        try:
+            async with self._step_semaphore:
+                start_time = time.time()
+                try:
+                    _, detail = await asyncio.wait_for(agent.astep(task), self.max_task_time)
+                    tag = await agent.areflect(task, detail)
+                except asyncio.TimeoutError:
+                    async with self._feedback_lock:
+                        await asyncio.to_thread(self.timeout_step, agent, task)
+                    return
+                except Exception as e:
+                    self.task_duration.add(task, time.time() - start_time)
+                    self.logger.error(f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
+                    self.logger.exception(e)
+                    async with self._feedback_lock:
+                        await asyncio.to_thread(self.update_task_status, task, Task.failure, f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
+                    return
+            self.task_duration.add(task, time.time() - start_time)
+            self.logger.info(f"Task {task.description} finished!")
+            async with self._feedback_lock:
+                await asyncio.to_thread(self.update_feedback, task, agent, detail, tag)
+        finally:
+            self.invalidate_context()
+            self._step_done.set()
@@ -123,4 +123,60 @@ You will adjust the description of the task for each agent and return a list of
 - If the task description is already accurate and easy to understand, then you don't need to make any adjustments.
 - Ensure the description is adjusted for all agents. That means the length of the returned decomposed-assignment JSON list must be equal to the length of the agent name list.
 Respond with a list of task-assignment JSON objects.
+'''
+CONTROLLER_BATCH_DECOMPOSE_USER_PROMPT = '''
+--- Background Information ---
+Adjust the descriptions of several tasks that are assigned to agents. Each task is assigned to multiple agents, but the description of a task may be too general for some of them.
+
+You should adjust the description of each task for each of its agents to make it easier for them to understand. You have the task descriptions, the state of the agents, and the names of the agents of each task. Consider this information and adjust the description of each task for each of its agents separately. The tasks are independent of each other, an agent only works on the task it is listed for.
+
+The objective of adjusting the description is to eliminate ambiguity. For example:
+1. Task "move to (0, -60, 80) and (100, -60, 80)" is assigned to Alex, who is at (0, -60, 70), and Steve, who is at (100, -60, 70).
+   Adjust the task description to "move to (0, -60, 80)" for Alex and "move to (100, -60, 80)" for Steve. Since the task description requires going to two locations, each agent only needs to go to one location, the one closer to them.
+
+2. Task "open the chest and take out all of the dirt blocks" is assigned to Tom and Amy.
+   Adjust the task description to "open the chest and take out half of the dirt blocks" for both Tom and Amy. Since the task requires taking out all dirt blocks, both agents only need to take out half.
+
+RESOURCES:
+Current state of all agents:
+{{agent state}} 
+
+Task list, the index, description, milestones and name list of agents of each task:
+{{task list}}
+
+You will adjust the description of each task for each of its agents and return one list of decomposed-assignment JSON objects for all tasks, every object has the index of its task. For example, for task 0 "move to (0, -60, 80) and (100, -60, 80)" assigned to Alex and Steve, and task 1 "open the chest and take out all of the dirt blocks" assigned to Tom and Amy, you should return:
+[{
+    "reason": "The task description requires going to two locations. (0, -60, 80) is closer to Alex, so he should move there.",
+    "task": 0,
+    "description": "move to (0, -60, 80)",
+    "milestones": ["at (0, -60, 80)"],
+    "agent": "Alex"
+},
+{
+    "reason": "The task description requires going to two locations. (100, -60, 80) is closer to Steve, so he should move there.",
+    "task": 0,
+    "description": "move to (100, -60, 80)",
+    "milestones": ["at (100, -60, 80)"],
+    "agent": "Steve"
+},
+{
+    "reason": "The task requires taking out all dirt blocks, both agents only need to take out half.",
+    "task": 1,
+    "description": "open the chest and take out half of the dirt blocks",
+    "milestones": ["half of the dirt blocks taken out of the chest"],
+    "agent": "Tom"
+},
+{
+    "reason": "The task requires taking out all dirt blocks, both agents only need to take out half.",
+    "task": 1,
+    "description": "open the chest and take out half of the dirt blocks",
+    "milestones": ["half of the dirt blocks taken out of the chest"],
+    "agent": "Amy"
+}]
+
+*** Important Notice ***
+- Use natural language for reasoning and only provide the decomposed-assignment JSON once.
+- If the description of a task is already accurate and easy to understand, then you don't need to make any adjustments.
+- Ensure the description of every task is adjusted for all of its agents. That means the returned list must have exactly one decomposed-assignment JSON object for each agent of each task, with the index of that task.
+Respond with a list of decomposed-assignment JSON objects.
 '''
\ No newline at end of file
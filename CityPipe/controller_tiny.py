@@ -1,6 +1,7 @@
 import sys
 import os
 import threading
+import queue
 import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -9,6 +10,7 @@ from LLM.init_model import init_language_model
 
 sys.path.append(os.getcwd())
 from type_define.graph import Task
+from type_define.snapshot_publisher import acquire_publisher, release_publisher
 from CityPipe.task_manager import TaskManager
 from CityPipe.data_manager import DataManager
 from CityPipe.agent import BaseAgent
@@ -60,11 +62,10 @@ class GlobalController:
         self.task_list = [Task]  # task published by tm
         self.query_interval = 1  # time interval between two query
 
-        # init lock
-        self.task_list_lock = threading.Lock()
+        # init lock, never held while sleeping
         self.result_list_lock = threading.Lock()
 
-        self.task_queue = []
+        self.task_queue = queue.Queue()  # (agent, task) waiting to be submitted
         self.result_queue = []
 
         # init thread pool
@@ -125,10 +126,8 @@ class GlobalController:
                 self.assignment[agent.name] = task_instance.id
                 task_instance._agent.append(agent.name)
 
-            with self.task_list_lock:
-                task_instance.status = Task.running
-                self.task_queue.append((agent_instances[0], task_instance))
-                time.sleep(1)
+            task_instance.status = Task.running
+            self.task_queue.put((agent_instances[0], task_instance))
         
             name_list = ", ".join([agent.name for agent in agent_instances])
             self.logger.info(f"Agent(s) {name_list} assigned to do task {task_instance.description}")
@@ -137,21 +136,16 @@ class GlobalController:
 
     # worker
     def worker(self):
-        while True:
-            if self.shutdown:
-                break
-            with self.task_list_lock:
-                if not self.task_queue:
-                    time.sleep(self.query_interval)
-                    continue
-                while self.task_queue:
-                    agent_task = self.task_queue.pop(0)
-                    agent, task = agent_task
+        while not self.shutdown:
+            try:
+                agent_task = self.task_queue.get(timeout=self.query_interval)
+            except queue.Empty:
+                continue
+            agent, task = agent_task
 
-                    future = self.executor.submit(agent.step, task)
-                    with self.result_list_lock:
-                        self.result_queue.append((future, agent, task, time.time()))
-                    time.sleep(self.query_interval)
+            future = self.executor.submit(agent.step, task)
+            with self.result_list_lock:
+                self.result_queue.append((future, agent, task, time.time()))
 
     def set_task_status(self, task_id, status, feedback):
         for task in self.task_manager.graph.vertex:
@@ -216,30 +210,34 @@ class GlobalController:
         while True:
             if self.shutdown:
                 break
+            # take the submitted steps, the worker keeps appending while they are checked
             with self.result_list_lock:
-                result_list_copy = []
-                for future, agent, task, start_time in self.result_queue:
-                    # if future.done() and task.id in [t.id for t in self.task_list] and task.status == Task.running:
-                    if future.done():
-                        try:
-                            self.logger.info(f"Task {task.description} finished!")
-                            _, detail = future.result()
-                            self.update_feedback(task, agent, detail)
-
-                        except Exception as e: # 没有对于 collab 的处理 这个代码不正确
-                            traceback.print_exception(type(e), e, e.__traceback__)
-                            self.logger.error(f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
-                            self.logger.exception(e)
-                            self.update_task_status(task, Task.failure, f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")                            
-                    
-                    elif time.time() - start_time > self.max_task_time: # 没有对于 collab 的处理 这个代码不正确
-                        self.logger.warning(f"Task {task.description} timeout!")
-                        self.update_task_status(task, Task.failure, f"Task {task.description} timeout!")
-                    
-                    else:
-                        result_list_copy.append((future, agent, task, start_time))
-                    time.sleep(self.query_interval)
-                self.result_queue = result_list_copy
+                result_list = self.result_queue
+                self.result_queue = []
+            result_list_copy = []
+            for future, agent, task, start_time in result_list:
+                # if future.done() and task.id in [t.id for t in self.task_list] and task.status == Task.running:
+                if future.done():
+                    try:
+                        self.logger.info(f"Task {task.description} finished!")
+                        _, detail = future.result()
+                        self.update_feedback(task, agent, detail)
+
+                    except Exception as e: # 没有对于 collab 的处理 这个代码不正确
+                        traceback.print_exception(type(e), e, e.__traceback__)
+                        self.logger.error(f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")
+                        self.logger.exception(e)
+                        self.update_task_status(task, Task.failure, f"Task {task.description} failed with exception: {e}\n{e.__traceback__}")                            
+                
+                elif time.time() - start_time > self.max_task_time: # 没有对于 collab 的处理 这个代码不正确
+                    self.logger.warning(f"Task {task.description} timeout!")
+                    self.update_task_status(task, Task.failure, f"Task {task.description} timeout!")
+                
+                else:
+                    result_list_copy.append((future, agent, task, start_time))
+            with self.result_list_lock:
+                self.result_queue = result_list_copy + self.result_queue
+            time.sleep(self.query_interval)
 
                 
     def check_task_list_available(self):
@@ -265,6 +263,8 @@ class GlobalController:
         return available_task_list
     # 生产者
     def execute_tasks(self):
+        # the pending snapshots are written once the loop ends
+        publisher = acquire_publisher()
         try:
             while True:
                 if self.shutdown:
@@ -287,11 +287,10 @@ class GlobalController:
                                 break
                         agent_states.append({"name": agent.name, "state": "busy", "task": tmp_description})
 
-                with open("logs/task_list.json", "w") as f:
-                    json.dump({
-                        "agent_states": agent_states,
-                        "task_list": [task.assign_json(idx) for idx, task in enumerate(self.task_list)],
-                    }, f, indent=4)
+                publisher.publish("logs/task_list.json", {
+                    "agent_states": agent_states,
+                    "task_list": [task.assign_json(idx) for idx, task in enumerate(self.task_list)],
+                })
                     
                 if self.check_task_list_available() == []:
                     # self.logger.info("no available task ...")
@@ -317,6 +316,8 @@ class GlobalController:
             self.data_manager = None
             self.executor.shutdown(wait=False)
             raise Exception("Interrupted by user")
+        finally:
+            release_publisher(publisher)
 
     def run(self):
         try:
@@ -0,0 +1,265 @@
+import sys
+import os
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+import socket
+from multiprocessing.connection import Client, Connection, deliver_challenge, answer_challenge
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+from type_define.deadline_watchdog import CancelToken, StepCancelled
+
+'''
+Process backend of GlobalController, agent steps run in worker processes instead of threads.
+
+The env and the data manager stay in the controller process, workers call them through ControllerServer.
+A worker runs the step of the env itself, on agents of its own built from the agent pool of the env, so the llm
+calls and tools of a step run in the worker while every state they read or change is the one of the controller:
+any other env method or attribute is one round trip, see EnvClient. The agents of a worker are built on first
+use from the agent class and the llm factory of the controller, the action history of the controller agent is
+sent with every step since reflect runs in the controller. The CancelToken of a step stays in the controller
+too, the worker asks for it at every checkpoint, see WorkerCancelToken.
+Workers are forked from a forkserver: the controller has threads running, a plain fork could copy a lock
+held by one of them. The forkserver imports the main module and the agent module once for all workers.
+'''
+
+_worker = {}  # state of the worker process, set by setup_worker
+
+
+class CancelTokenTable:
+    '''
+    The CancelToken of the steps running in workers, by id, a worker asks for the reason of its step
+    '''
+    def __init__(self):
+        self._token = {}  # token id -> CancelToken
+        self._token_id = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, token: CancelToken) -> int:
+        with self._lock:
+            token_id = next(self._token_id)
+            self._token[token_id] = token
+        return token_id
+
+    def remove(self, token_id: int):
+        with self._lock:
+            self._token.pop(token_id, None)
+
+    def reason(self, token_id: int) -> str:
+        # None while the step is not cancelled
+        with self._lock:
+            token = self._token.get(token_id)
+        return token.reason if token is not None and token.cancelled else None
+
+
+class ControllerServer:
+    '''
+    Serves the env, the data manager and the cancel tokens of the controller to the worker processes over a
+    local socket. Each worker keeps one authenticated connection, served by a thread of its own. A request is
+    (target, name, args, kwargs), args None reads an attribute, and the answer (True, result) or (False, exception),
+    every public method and attribute of the targets can be reached.
+    '''
+    def __init__(self, data_manager, env, address: tuple = ("127.0.0.1", 0), backlog: int = 128):
+        self.tokens = CancelTokenTable()
+        self.target = {"data_manager": data_manager, "env": env, "token": self.tokens}
+        self.authkey = os.urandom(16)
+        self._server = socket.create_server(address, backlog=backlog)
+        self.address = self._server.getsockname()
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept, name="ControllerServer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed = True
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)  # close alone does not wake the accept thread on linux
+        except OSError:
+            pass
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            # the handshake runs in the thread of the connection, a silent client does not hold up the others
+            connection = Connection(client.detach())
+            threading.Thread(target=self._serve, args=(connection,), name="ControllerConnection", daemon=True).start()
+
+    def _serve(self, connection: Connection):
+        with connection:
+            try:
+                deliver_challenge(connection, self.authkey)
+                answer_challenge(connection, self.authkey)
+            except Exception:
+                return
+            while True:
+                try:
+                    target, name, args, kwargs = connection.recv()
+                except (EOFError, OSError):
+                    return
+                answer = call_method(self.target.get(target), name, args, kwargs)
+                try:
+                    connection.send(answer)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:  # the result or the exception can not be pickled
+                    connection.send((False, RuntimeError(f"{name} of the {target}: {e}")))
+
+
+def call_method(target, name: str, args: tuple, kwargs: dict) -> (bool, object):
+    # (True, result) or (False, exception) of a public method of target, args None reads the attribute
+    try:
+        if target is None or name.startswith("_"):
+            raise AttributeError(f"{name} is not public")
+        value = getattr(target, name)
+        return True, value if args is None else value(*args, **kwargs)
+    except Exception as e:
+        return False, e
+
+
+class ControllerClient:
+    '''
+    The connection of a worker process to ControllerServer, call is one round trip
+    '''
+    def __init__(self, address: tuple, authkey: bytes):
+        self._connection = Client(address, authkey=authkey)
+        self._lock = threading.Lock()  # one request at a time on the connection
+
+    def call(self, target: str, name: str, args: tuple, kwargs: dict):
+        with self._lock:
+            self._connection.send((target, name, args, kwargs))
+            ok, result = self._connection.recv()
+        if not ok:
+            raise result
+        return result
+
+
+class RemoteObject:
+    '''
+    An object of the controller as seen from a worker, a method call is one round trip.
+    call: call(target, name, args, kwargs) of ControllerClient or of a remote worker
+    '''
+    def __init__(self, call, target: str):
+        self._call = call
+        self._target = target
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._call(self._target, name, args, kwargs)
+        return call
+
+
+class EnvClient:
+    '''
+    The env of the controller as seen from a worker.
+    step runs here, the step method of the env class with this client as the env, on the agent pool of the
+    worker: the agents and their tools reach the env through it. Any other method call or attribute read is one
+    round trip to the env of the controller, an attribute read gets a copy of the value, changing the copy
+    changes nothing, the tools change the env through its methods.
+    '''
+    def __init__(self, call, env_class, agent_pool: list):
+        self._call = call
+        self._env_class = env_class
+        self.agent_pool = agent_pool
+        self.logger = logging.getLogger("Env")  # the logger of MultiAgentEnvironment.init_logger
+        # the agents of the env reach it through their class, e.g. Agent.env of Agent/emergency_agents.py
+        for agent in agent_pool:
+            type(agent).env = self
+
+    def step(self, *args, **kwargs):
+        return self._env_class.step(self, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if callable(getattr(self._env_class, name, None)):
+            def call(*args, **kwargs):
+                return self._call("env", name, args, kwargs)
+            return call
+        return self._call("env", name, None, None)
+
+
+class WorkerCancelToken(CancelToken):
+    '''
+    CancelToken of a step in a worker process, asks the CancelTokenTable of the controller at every checkpoint
+    whether the step was cancelled. wait() asks every poll_interval seconds.
+    '''
+    poll_interval = 1.0
+
+    def __init__(self, call, token_id: int):
+        super().__init__()
+        self._call = call
+        self._token_id = token_id
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set():
+            reason = self._call("token", "reason", (self._token_id,), {})
+            if reason is not None:
+                self.cancel(reason)
+        return self._event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise StepCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while not self.cancelled:
+            remain = deadline - time.time()
+            if remain <= 0:
+                return False
+            self._event.wait(min(remain, self.poll_interval))
+        return True
+
+
+def init_worker(agent_class, llm_factory, llm_config: dict, env_class, agent_pool: list, address: tuple,
+                authkey: bytes, silent: bool):
+    # initializer of the worker processes
+    setup_worker(agent_class, llm_factory, llm_config, env_class, agent_pool, ControllerClient(address, authkey).call, silent)
+
+
+def setup_worker(agent_class, llm_factory, llm_config: dict, env_class, agent_pool: list, call, silent: bool):
+    # the worker processes of the pool and the remote workers, see CityPipe/remote_backend.py
+    # call: call(target, name, args, kwargs) on the env, the data manager and the cancel tokens of the controller
+    _worker["call"] = call
+    _worker["data_manager"] = RemoteObject(call, "data_manager")
+    _worker["agent_class"] = agent_class
+    _worker["llm"] = llm_factory(llm_config)
+    _worker["env"] = EnvClient(call, env_class, agent_pool)
+    _worker["silent"] = silent
+    _worker["agent"] = {}  # agent name -> agent
+
+
+def run_step(name: str, agent_type: str, history_action_list: list, task: Task, cancel_token=None,
+             token_id: int = None) -> (str, dict):
+    # cancel_token: CancelToken of a remote worker, token_id: id of the token in the CancelTokenTable of the controller
+    if token_id is not None:
+        cancel_token = WorkerCancelToken(_worker["call"], token_id)
+    agent = _worker["agent"].get(name)
+    if agent is None:
+        agent = _worker["agent_class"](_worker["llm"], _worker["env"], _worker["data_manager"],
+                                       name=name, agent_type=agent_type, silent=_worker["silent"])
+        _worker["agent"][name] = agent
+    agent.history_action_list = history_action_list
+    return agent.step(task, cancel_token)
+
+
+def make_process_executor(max_workers: int, agent_class, llm_factory, llm_config: dict, env,
+                          server: ControllerServer, silent: bool) -> ProcessPoolExecutor:
+    # the workers get the class and the agent pool of the env, the env itself stays with the server
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", "CityPipe.agent"])
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=init_worker,
+                               initargs=(agent_class, llm_factory, llm_config, type(env), env.agent_pool,
+                                         server.address, server.authkey, silent))
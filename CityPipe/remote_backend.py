@@ -0,0 +1,502 @@
+import sys
+import os
+import time
+import socket
+import argparse
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from multiprocessing.connection import Client, Connection, deliver_challenge, answer_challenge
+sys.path.append(os.getcwd())
+from type_define.deadline_watchdog import DeadlineWatchdog, CancelToken
+from CityPipe.process_backend import setup_worker, call_method
+
+logger = logging.getLogger(__name__)
+
+'''
+Remote backend of GlobalController, agent steps run on worker hosts that connect to the controller.
+
+The controller listens with a RemoteWorkerPool, a worker host runs
+    CITYPIPE_AUTHKEY=<authkey of the pool in hex> python CityPipe/remote_backend.py <host:port or unix socket path> --slots 8
+from the root of the repository. Workers can join and leave at any time, steps wait in the pool until a worker
+has a free slot.
+
+Protocol: one connection per worker over tcp or a unix socket, every message is a length-prefixed pickle
+(multiprocessing.connection), the connection is authenticated first by an hmac challenge on the shared authkey.
+Pickles run code when loaded, so the authkey must stay between the controller and its workers.
+    worker -> pool  ("hello", {"slots", "host", "pid"})             first message of the worker
+    pool -> worker  ("init", kwargs of setup_worker)                 agent class, llm factory and config, env class and agents
+    pool -> worker  ("lease", lease id, fn, args, kwargs)            run fn(*args, cancel_token=token, **kwargs)
+    pool -> worker  ("cancel", lease id, reason)                     cancel the token of a leased step
+    worker -> pool  ("result", lease id, ok, result or exception)    sent as soon as the step finishes
+    worker -> pool  ("call", call id, target, name, args, kwargs)    env or data manager call of a step, see ControllerServer
+    pool -> worker  ("answer", call id, ok, result or exception)
+    worker -> pool  ("heartbeat", running step number)               every heartbeat_interval seconds
+    pool -> worker  ("close",)                                        the pool shuts down
+The env and the data manager stay in the controller, a step calls them over the connection of its worker like the
+steps of the process backend call them through ControllerServer, see CityPipe/process_backend.py.
+A lease lasts lease_timeout seconds from the last message of its worker. A worker that disconnects or stops sending
+is lost, its steps are leased to the other workers, a step lost max_attempts times fails with WorkerLost.
+'''
+
+
+class WorkerLost(Exception):
+    '''
+    Raised by the future of a step whose worker was lost on every attempt, see RemoteWorkerPool.max_attempts
+    '''
+    pass
+
+
+class Lease:
+    '''
+    A step submitted to RemoteWorkerPool, held by at most one worker at a time
+    '''
+    def __init__(self, lease_id: int, fn, args: tuple, kwargs: dict, future: Future):
+        self.id = lease_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.worker = None  # WorkerConnection holding the lease
+        self.attempt = 0  # workers the step was leased to
+
+
+class WorkerConnection:
+    '''
+    The pool side of one connected worker
+    '''
+    def __init__(self, worker_id: int, connection: Connection, hello: dict, family: int):
+        self.id = worker_id
+        self.connection = connection
+        self.family = family  # socket family of the connection, AF_INET or AF_UNIX
+        self.slots = max(int(hello.get("slots", 1)), 1)
+        self.host = hello.get("host")
+        self.pid = hello.get("pid")
+        self.lease = {}  # lease id -> Lease
+        self.last_seen = time.time()
+        self._send_lock = threading.Lock()
+
+    @property
+    def free(self) -> int:
+        return self.slots - len(self.lease)
+
+    def send(self, message) -> bool:
+        # False if the connection is gone, a message that can not be pickled raises
+        try:
+            with self._send_lock:
+                self.connection.send(message)
+            return True
+        except (EOFError, OSError):
+            return False
+
+    def close(self):
+        # shut the socket down first, closing it alone does not wake up the thread blocked reading it
+        try:
+            with socket.fromfd(self.connection.fileno(), self.family, socket.SOCK_STREAM) as sock:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class RemoteWorkerPool(Executor):
+    '''
+    Executor whose steps run on the remote workers connected to it, see the protocol above.
+    submit() queues the step and returns its future at once, a step is leased to the worker with the most free
+    slots, its result resolves the future as soon as the worker sends it.
+
+    Args:
+    - address: (host, port) or unix socket path the workers connect to, port 0 picks a free port, see self.address
+    - authkey: bytes shared with the workers, None generates one, see self.authkey
+    - init: dict, keyword arguments of setup_worker sent to every worker as it joins, but the call
+    - target: dict, name -> object, the workers call the public methods and read the attributes of these,
+      the env and the data manager of their steps
+    - lease_timeout: float, seconds without a message from a worker before it is lost
+    - max_attempts: int, workers a step is leased to before its future fails with WorkerLost
+    '''
+    def __init__(self, address=("127.0.0.1", 0), authkey: bytes = None, init: dict = None, target: dict = None,
+                 lease_timeout: float = 10.0, max_attempts: int = 2):
+        self.authkey = authkey or os.urandom(16)
+        self.init = init or {}
+        self.target = target or {}
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(address)
+            self._server.listen(128)
+        else:
+            self._server = socket.create_server(address, backlog=128)
+        self.address = self._server.getsockname()
+        self._condition = threading.Condition()
+        self._pending = deque()  # Lease waiting for a free slot
+        self._lease = {}  # Future -> Lease, every step not finished yet
+        self._worker = {}  # worker id -> WorkerConnection
+        self._lease_id = itertools.count()
+        self._worker_id = itertools.count()
+        self._shutdown = False
+        self._closed = False
+        self.lost_worker_num = 0
+        self.moved_lease_num = 0  # leases given to another worker after their worker was lost
+        self._watchdog = DeadlineWatchdog("RemoteWorkerPoolWatchdog")  # lease_timeout of every worker
+        self._call_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="RemoteWorkerCall")
+        threading.Thread(target=self._accept, name="RemoteWorkerPool", daemon=True).start()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        # fn must be importable on the workers and take a cancel_token keyword argument
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new steps after shutdown")
+            lease = Lease(next(self._lease_id), fn, args, kwargs, future)
+            self._lease[future] = lease
+            self._pending.append(lease)
+        future.add_done_callback(self._forget)
+        self._dispatch()
+        return future
+
+    def cancel(self, future: Future, reason: str = "cancelled") -> bool:
+        # a waiting step is cancelled at once, a leased one by the token of its worker at its next checkpoint
+        if future.cancel():
+            return True
+        with self._condition:
+            lease = self._lease.get(future)
+            worker = lease.worker if lease is not None else None
+        return worker is not None and worker.send(("cancel", lease.id, reason))
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        # the workers are sent away once every step leased or waiting has finished
+        with self._condition:
+            self._shutdown = True
+            pending = list(self._pending) if cancel_futures else []
+        for lease in pending:
+            lease.future.cancel()
+        if wait:
+            self._close()
+        else:
+            threading.Thread(target=self._close, name="RemoteWorkerPoolShutdown", daemon=True).start()
+
+    def wait_for_workers(self, worker_num: int, timeout: float = None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._worker) >= worker_num, timeout)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "worker": len(self._worker),
+                "slot": sum(worker.slots for worker in self._worker.values()),
+                "leased": sum(len(worker.lease) for worker in self._worker.values()),
+                "pending": len(self._pending),
+                "lost_worker": self.lost_worker_num,
+                "moved_lease": self.moved_lease_num,
+            }
+
+    def _close(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._lease)
+            if self._closed:
+                return
+            self._closed = True
+            worker_list = list(self._worker.values())
+            self._worker = {}
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)  # close alone does not wake the accept thread on linux
+        except OSError:
+            pass
+        self._server.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        for worker in worker_list:
+            worker.send(("close",))
+            worker.close()
+        self._watchdog.close()
+        self._call_executor.shutdown(wait=False)
+
+    def _forget(self, future: Future):
+        with self._condition:
+            self._lease.pop(future, None)
+            self._condition.notify_all()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            # the handshake runs in the thread of the connection, a silent client does not hold up the others
+            connection = Connection(client.detach())
+            threading.Thread(target=self._serve, args=(connection,), name="RemoteWorkerConnection", daemon=True).start()
+
+    def _serve(self, connection: Connection):
+        try:
+            deliver_challenge(connection, self.authkey)
+            answer_challenge(connection, self.authkey)
+            kind, hello = connection.recv()
+            if kind != "hello":
+                raise ValueError(f"expected hello, got {kind}")
+        except Exception:
+            connection.close()
+            return
+        worker = WorkerConnection(next(self._worker_id), connection, hello, self._server.family)
+        try:
+            sent = worker.send(("init", self.init))
+        except Exception as e:
+            logger.error(f"RemoteWorkerPool can not send the setup to the workers: {e}")
+            sent = False
+        with self._condition:
+            joined = sent and not self._closed
+            if joined:
+                self._worker[worker.id] = worker
+                self._condition.notify_all()
+        if not joined:
+            worker.close()
+            return
+        self._renew(worker)
+        self._dispatch()
+        reason = "connection closed"
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            except Exception as e:  # a result the controller can not unpickle, its lease would never end
+                reason = f"unreadable message: {e}"
+                break
+            self._renew(worker)
+            if message[0] == "result":
+                self._finish(worker, *message[1:])
+            elif message[0] == "call":
+                try:
+                    self._call_executor.submit(self._call, worker, *message[1:])
+                except RuntimeError:  # closed
+                    break
+        self._lose(worker, reason)
+
+    def _renew(self, worker: WorkerConnection):
+        # every message of a worker renews its leases, heartbeats keep them while its steps run
+        worker.last_seen = time.time()
+        self._watchdog.schedule(worker.id, worker.last_seen + self.lease_timeout,
+                                lambda: self._lose(worker, f"no message for {self.lease_timeout}s"))
+
+    def _lose(self, worker: WorkerConnection, reason: str):
+        with self._condition:
+            if self._worker.pop(worker.id, None) is None:
+                worker.close()
+                return
+            self.lost_worker_num += 1
+            failed = []
+            for lease in worker.lease.values():
+                lease.worker = None
+                if lease.attempt >= self.max_attempts:
+                    failed.append(lease)
+                else:
+                    self._pending.appendleft(lease)
+                    self.moved_lease_num += 1
+            moved_num = len(worker.lease) - len(failed)
+            worker.lease = {}
+        self._watchdog.cancel(worker.id)
+        worker.close()
+        logger.warning(f"RemoteWorkerPool lost worker {worker.id} ({worker.host}, pid {worker.pid}): {reason}, "
+                       f"{moved_num} steps leased again, {len(failed)} failed")
+        for lease in failed:
+            lease.future.set_exception(WorkerLost(f"step lost by {lease.attempt} workers, the last one: {reason}"))
+        self._dispatch()
+
+    def _dispatch(self):
+        # lease the waiting steps to the workers with free slots, the least busy first
+        leased = []
+        with self._condition:
+            while self._pending:
+                worker = max(self._worker.values(), key=lambda worker: worker.free, default=None)
+                if worker is None or worker.free <= 0:
+                    break
+                lease = self._pending.popleft()
+                if lease.attempt == 0 and not lease.future.set_running_or_notify_cancel():
+                    continue
+                lease.attempt += 1
+                lease.worker = worker
+                worker.lease[lease.id] = lease
+                leased.append(lease)
+        for lease in leased:
+            worker = lease.worker
+            if worker is None:  # lost meanwhile, the lease is waiting again
+                continue
+            try:
+                sent = worker.send(("lease", lease.id, lease.fn, lease.args, lease.kwargs))
+            except Exception as e:  # the step can not be pickled
+                self._finish(worker, lease.id, False, e)
+                continue
+            if not sent:
+                self._lose(worker, "connection closed")
+
+    def _finish(self, worker: WorkerConnection, lease_id: int, ok: bool, result):
+        with self._condition:
+            lease = worker.lease.pop(lease_id, None)
+            if lease is not None:
+                lease.worker = None
+        if lease is None:  # the worker was lost, the step is leased again
+            return
+        if ok:
+            lease.future.set_result(result)
+        else:
+            lease.future.set_exception(result)
+        self._dispatch()
+
+    def _call(self, worker: WorkerConnection, call_id: int, target: str, name: str, args: tuple, kwargs: dict):
+        answer = call_method(self.target.get(target), name, args, kwargs)
+        try:
+            worker.send(("answer", call_id) + answer)
+        except Exception as e:  # the result or the exception can not be pickled
+            worker.send(("answer", call_id, False, RuntimeError(f"{name} of the {target}: {e}")))
+
+
+class RemoteWorker:
+    '''
+    A worker host of RemoteWorkerPool.
+    Connects to the pool, sets up the agents with the init the pool sends and runs up to slots leased steps at once,
+    each in a thread with its CancelToken. A finished step is sent back at once, the env and data manager calls of
+    the steps go over the same connection. The heartbeats keep the leases while long steps run.
+    run() returns when the pool sends the worker away or the connection is lost.
+
+    Args:
+    - address: (host, port) or unix socket path of the pool
+    - authkey: bytes, authkey of the pool
+    - slots: int, steps run at once
+    - heartbeat_interval: float, seconds between two heartbeats, well below lease_timeout of the pool
+    '''
+    def __init__(self, address, authkey: bytes, slots: int = 4, heartbeat_interval: float = 2.0):
+        self.address = address
+        self.authkey = authkey
+        self.slots = slots
+        self.heartbeat_interval = heartbeat_interval
+        self._connection = None
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()  # held to read or write _call and _stopped
+        self._token = {}  # lease id -> CancelToken of the running step
+        self._call = {}  # call id -> [Event, answer], env and data manager calls waiting for their answer
+        self._call_id = itertools.count()
+        self._stopped = threading.Event()
+
+    def run(self):
+        self._connection = Client(self.address, authkey=self.authkey)
+        executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="RemoteWorkerStep")
+        try:
+            self.send(("hello", {"slots": self.slots, "host": socket.gethostname(), "pid": os.getpid()}))
+            _, init = self._connection.recv()
+            setup_worker(call=self.call, **init)
+            threading.Thread(target=self._heartbeat, name="RemoteWorkerHeartbeat", daemon=True).start()
+            while True:
+                try:
+                    message = self._connection.recv()
+                except (EOFError, OSError):
+                    break
+                except Exception as e:  # a step this host can not unpickle, the pool leases it to another worker
+                    logger.error(f"RemoteWorker can not read a message of the pool: {e}")
+                    break
+                if message[0] == "lease":
+                    self._start(executor, *message[1:])
+                elif message[0] == "cancel":
+                    token = self._token.get(message[1])
+                    if token is not None:
+                        token.cancel(message[2])
+                elif message[0] == "answer":
+                    self._answer(*message[1:])
+                elif message[0] == "close":
+                    break
+        finally:
+            with self._lock:
+                self._stopped.set()
+                waiting = list(self._call.values())
+                self._call = {}
+            for waiter in waiting:
+                waiter[1] = (False, ConnectionError("the pool is gone"))
+                waiter[0].set()
+            for token in list(self._token.values()):
+                token.cancel("the pool is gone")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._connection.close()
+
+    def send(self, message) -> bool:
+        # False if the connection is gone, a message that can not be pickled raises
+        try:
+            with self._send_lock:
+                self._connection.send(message)
+            return True
+        except (EOFError, OSError):
+            return False
+
+    def call(self, target: str, name: str, args: tuple, kwargs: dict):
+        # an env or data manager call of a step, waits for the answer of the pool, args None reads an attribute
+        call_id = next(self._call_id)
+        waiter = [threading.Event(), None]
+        with self._lock:
+            if self._stopped.is_set():
+                raise ConnectionError("the pool is gone")
+            self._call[call_id] = waiter
+        if not self.send(("call", call_id, target, name, args, kwargs)):
+            with self._lock:
+                self._call.pop(call_id, None)
+            raise ConnectionError("the pool is gone")
+        waiter[0].wait()
+        ok, result = waiter[1]
+        if not ok:
+            raise result
+        return result
+
+    def _answer(self, call_id: int, ok: bool, result):
+        with self._lock:
+            waiter = self._call.pop(call_id, None)
+        if waiter is not None:
+            waiter[1] = (ok, result)
+            waiter[0].set()
+
+    def _start(self, executor: ThreadPoolExecutor, lease_id: int, fn, args: tuple, kwargs: dict):
+        token = CancelToken()
+        self._token[lease_id] = token
+        future = executor.submit(fn, *args, cancel_token=token, **kwargs)
+        future.add_done_callback(lambda future, lease_id=lease_id: self._finish(lease_id, future))
+
+    def _finish(self, lease_id: int, future: Future):
+        self._token.pop(lease_id, None)
+        if future.cancelled():  # the pool is gone
+            return
+        error = future.exception()
+        try:
+            self.send(("result", lease_id, True, future.result()) if error is None else ("result", lease_id, False, error))
+        except Exception as e:  # the result or the exception can not be pickled
+            self.send(("result", lease_id, False, RuntimeError(f"result of the step can not be sent: {e}")))
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            if not self.send(("heartbeat", len(self._token))):
+                return
+
+
+def run_worker(address, authkey: bytes, slots: int = 4, heartbeat_interval: float = 2.0):
+    # entry of a worker process, see RemoteWorker
+    RemoteWorker(address, authkey, slots, heartbeat_interval).run()
+
+
+def parse_address(address: str):
+    # "host:port" -> (host, port), anything else is a unix socket path
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="remote worker of GlobalController(backend=\"remote\"), "
+                                                 "the authkey of the pool is read from CITYPIPE_AUTHKEY in hex")
+    parser.add_argument("address", help="host:port or unix socket path of the pool")
+    parser.add_argument("--slots", type=int, default=4, help="steps run at once")
+    parser.add_argument("--heartbeat", type=float, default=2.0, help="seconds between two heartbeats")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    run_worker(parse_address(args.address), bytes.fromhex(os.environ["CITYPIPE_AUTHKEY"]), args.slots, args.heartbeat)
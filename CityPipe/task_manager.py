@@ -2,6 +2,8 @@ import sys
 import os
 sys.path.append(os.getcwd())
 from type_define.graph import Graph, Task
+from type_define.csr_graph import CSRGraph
+from type_define.graph_log import GraphMutationLog
 from CityPipe.task_prompt import *
 from CityPipe.data_manager import DataManager
 from CityPipe.retriever import Retriever
@@ -11,9 +13,12 @@ from typing import Union
 import json
 import time
 import logging
+import threading
+import asyncio
 
-TASK_MANAGER_WAIT_TIME = 1
 PARTIAL_GRAPH_TASK_NUM = 5
+# priority class of a subtask without a known response category, 1 is the most urgent
+PRIORITY_LEVEL = {"critical": 1, "high": 2, "medium": 3, "low": 4}
 
 class TaskManager:
     '''
@@ -30,11 +35,19 @@ class TaskManager:
     update_task: str = "update"
     merge_task: str = "merge"
 
-    def __init__(self, silent:bool = False, method:str = "update"):
+    object_graph: str = "object"
+    csr_graph: str = "csr"
+
+    def __init__(self, silent:bool = False, method:str = "update", graph_backend:str = "object", graph_log_path:str = None):
         self.llm = None
         self.dm:DataManager = None
-        self.graph:Graph = None
+        self.graph:Union[Graph, CSRGraph] = None
+        self.graph_backend = graph_backend # object: Graph, csr: CSRGraph for very large task graphs
+        # append-only delta log of every graph mutation, e.g. logs/graph_log.jsonl
+        self.mutation_log = GraphMutationLog(graph_log_path) if graph_log_path is not None else None
         self.logger = init_logger("TaskManager", level= logging.WARNING ,dump=True, silent=silent)
+        self._status_changed = threading.Condition()  # notified when the task manager becomes idle
+        self._idle_waiter = []  # (event loop, future) of the coroutines in await_idle
         self.status = TaskManager.idle
         self.unit_describe = None
         self.retriever = Retriever()
@@ -43,6 +56,7 @@ class TaskManager:
         self.method = method
         
         self.task_description = None
+        self.response_priorities = {}  # response category -> priority class, from the task document
 
         self.task_trace = []
         self.task_trace_description = []
@@ -128,25 +142,72 @@ class TaskManager:
                 data_list.append(data)
         return data_list
 
-    def query_graph(self, task_list:list[Task] = None) -> Graph:
+    @property
+    def status(self) -> str:
+        return self._status
+
+    @status.setter
+    def status(self, status: str):
+        with self._status_changed:
+            self._status = status
+            self._status_changed.notify_all()
+            if status != TaskManager.running:
+                # wake up the coroutines waiting in await_idle, each on its own event loop
+                for loop, future in self._idle_waiter:
+                    loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(True))
+                self._idle_waiter = []
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        # block until the graph is not being updated
+        with self._status_changed:
+            return self._status_changed.wait_for(lambda: self._status != TaskManager.running, timeout)
+
+    async def await_idle(self):
+        # coroutine version of wait_idle, does not hold a thread while the graph is updated
+        with self._status_changed:
+            if self._status != TaskManager.running:
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._idle_waiter.append((loop, future))
+        await future
+
+    def query_graph(self, task_list:list[Task] = None, drop_cycles:bool = False) -> Graph:
         '''
         Generate the graph of the task list. Transfer the task list to a graph
         - task_list: list of Task
+        - drop_cycles: break the dependency cycles instead of rejecting the plan, see Graph.from_dependency
+        Dangling and self dependencies are dropped, a plan with a dependency cycle is rejected with ValueError
         '''
-        graph = Graph()
-
-        for task in task_list:
-            graph.add_node(task)
-        for t_id, task in enumerate(task_list):
-            for idx in task._pre_idxs:
-                if idx > 0 and idx < len(task_list):
-                    graph.add_edge(task_list[idx-1], task)
-            if len(task._pre_idxs) == 0 and t_id > 0:
-                nodes = graph.get_node_to(task_list[t_id-1])
-                for node in nodes:
-                    graph.add_edge(node, task)
+        graph, diagnostics = Graph.from_dependency(task_list, drop_cycles=drop_cycles)
+        if not diagnostics.valid:
+            self.logger.warning(f"plan diagnostics: {diagnostics}")
+        if diagnostics.cycle and not drop_cycles:
+            raise ValueError(f"plan rejected, subtasks {diagnostics.cycle} depend on each other in a cycle")
         return graph
 
+    def set_graph(self, graph:Graph):
+        '''
+        Store the task graph in the configured backend
+        '''
+        if self.mutation_log is not None and isinstance(graph, Graph):
+            graph.attach_log(self.mutation_log)
+        if self.graph_backend == TaskManager.csr_graph and isinstance(graph, Graph):
+            graph = CSRGraph.from_graph(graph)
+        self.graph = graph
+
+    def get_editable_graph(self) -> Graph:
+        '''
+        CSRGraph is immutable, edit a Graph copy that shares the same Task objects and store it back with set_graph
+        '''
+        if isinstance(self.graph, CSRGraph):
+            graph = self.graph.to_graph()
+            if self.mutation_log is not None:
+                # same content as the last logged version
+                graph.attach_log(self.mutation_log, snapshot=False)
+            return graph
+        return self.graph
+
     '''
         Public API
     '''
@@ -155,74 +216,84 @@ class TaskManager:
         # query state
         # query experience
         self.status = TaskManager.running
-        if isinstance(self.llm, OpenAILanguageModel):
-            # print(self.llm.api_base)
-            pass
-        self.logger.debug("="*20 + " Task Manager Init Task " + "="*20)
+        try:
+            if isinstance(self.llm, OpenAILanguageModel):
+                # print(self.llm.api_base)
+                pass
+            self.logger.debug("="*20 + " Task Manager Init Task " + "="*20)
         
-        self.task_document = document
-        self.task_description = description
-        # experience = self.dm.query_task_experience(task=Task(name=description, content=document))
-        # env_description = self.dm.query_env()[0]
-        env_description = self.dm.query_env_with_task(description) 
-        # self.logger.debug(f"dm env_description: {env_description}")
-        content = document
-
-        # decompose the task to subtask DAG list
-        if self.manage_method == "update":
-            system_prompt = PART_DECOMPOSE_SYSTEM_PROMPT
-            user_prompt = format_string(PART_DECOMPOSE_USER_PROMPT, {"task": {"description": description, 
-                                                                     "meta-data": content},
-                                                            "unit_ability": self.unit_describe,
-                                                            "env": env_description,
-                                                            "num": len(self.agent_list)})
-        elif self.manage_method == "merge":
-            system_prompt = DECOMPOSE_SYSTEM_PROMPT
-            user_prompt = format_string(DECOMPOSE_USER_PROMPT, {"task": {"description": description, 
-                                                                        "meta-data": content},
-                                                                "unit_ability": self.unit_describe,
-                                                                "env": env_description})
-        else:
-            self.logger.error("Task Manager Method Error.")
-            assert False, "task manager method error"
-        # self.logger.warning("TM DEBUG:")
-        # self.logger.warning(system_prompt)
-        self.logger.warning(user_prompt)
-        response = self.llm.generate(system_prompt, user_prompt, cache_enabled=True, json_check=True,
-                                                       check_tags=["description", "milestones", "assigned_units"])
-        result = extract_info(response, guard_keys=["description", "milestones"])
-        omit_keys = [("assigned_unit", "list"), ("required_subtasks", "list"), ("retrieval_paths", "list")]
-        result = self.fill_keys_omit(result, omit_keys) # fill the result with empty data
-        self.logger.warning(response)
-        subtask_list = []
-        for subtask_data in result:
-            sub_content = self.get_relevant_content_by_path({"description": description, 
-                                                                     "meta-data": content}, query=subtask_data["retrieval_paths"])
-            subtask = Task(name=subtask_data["description"], content=sub_content) 
-            subtask.description = subtask_data["description"]
-            subtask.parent_task_list = [Task(name=description, content=document)]
-            subtask.goal = "omit"
-            subtask.criticism = "omit"
-            subtask.milestones = subtask_data["milestones"]
+            self.task_document = document
+            self.task_description = description
+            self.response_priorities = document.get("response_priorities", {}) if isinstance(document, dict) else {}
+            # experience = self.dm.query_task_experience(task=Task(name=description, content=document))
+            # env_description = self.dm.query_env()[0]
+            env_description = self.dm.query_env_with_task(description) 
+            # self.logger.debug(f"dm env_description: {env_description}")
+            content = document
+
+            # decompose the task to subtask DAG list
             if self.manage_method == "update":
-                subtask.candidate_list = subtask_data["assigned_units"]
-                subtask.number = len(subtask_data["assigned_units"])
+                system_prompt = PART_DECOMPOSE_SYSTEM_PROMPT
+                user_prompt = format_string(PART_DECOMPOSE_USER_PROMPT, {"task": {"description": description, 
+                                                                         "meta-data": content},
+                                                                "unit_ability": self.unit_describe,
+                                                                "env": env_description,
+                                                                "num": len(self.agent_list)})
+            elif self.manage_method == "merge":
+                system_prompt = DECOMPOSE_SYSTEM_PROMPT
+                user_prompt = format_string(DECOMPOSE_USER_PROMPT, {"task": {"description": description, 
+                                                                            "meta-data": content},
+                                                                    "unit_ability": self.unit_describe,
+                                                                    "env": env_description})
             else:
-                subtask.candidate_list = subtask_data["candidate_list"]
-                subtask.number = int(subtask_data["minimum_required_units"])
-            subtask._pre_idxs = [int(idx) for idx in subtask_data["required_subtasks"]]
-            subtask_list.append(subtask)
+                self.logger.error("Task Manager Method Error.")
+                assert False, "task manager method error"
+            # self.logger.warning("TM DEBUG:")
+            # self.logger.warning(system_prompt)
+            self.logger.warning(user_prompt)
+            response = self.llm.generate(system_prompt, user_prompt, cache_enabled=True, json_check=True,
+                                                           check_tags=["description", "milestones", "assigned_units"])
+            result = extract_info(response, guard_keys=["description", "milestones"])
+            omit_keys = [("assigned_unit", "list"), ("required_subtasks", "list"), ("retrieval_paths", "list")]
+            result = self.fill_keys_omit(result, omit_keys) # fill the result with empty data
+            self.logger.warning(response)
+            subtask_list = []
+            for subtask_data in result:
+                sub_content = self.get_relevant_content_by_path({"description": description, 
+                                                                         "meta-data": content}, query=subtask_data["retrieval_paths"])
+                subtask = Task(name=subtask_data["description"], content=sub_content) 
+                subtask.description = subtask_data["description"]
+                subtask.parent_task_list = [Task(name=description, content=document)]
+                subtask.goal = "omit"
+                subtask.criticism = "omit"
+                subtask.milestones = subtask_data["milestones"]
+                if self.manage_method == "update":
+                    subtask.candidate_list = subtask_data["assigned_units"]
+                    subtask.number = len(subtask_data["assigned_units"])
+                else:
+                    subtask.candidate_list = subtask_data["candidate_list"]
+                    subtask.number = int(subtask_data["minimum_required_units"])
+                subtask.priority = self.get_priority(subtask_data)
+                subtask._pre_idxs = [int(idx) for idx in subtask_data["required_subtasks"]]
+                subtask_list.append(subtask)
 
-        self.graph = self.query_graph(subtask_list)
-        self.logger.warning(self.graph)
+            try:
+                # the first plan has no graph to fall back to, its cycles are broken instead
+                self.set_graph(self.query_graph(subtask_list, drop_cycles=self.graph is None))
+            except ValueError as e:
+                # keep the current graph instead of dispatching a plan that can never finish
+                self.logger.error(e)
+                return
+            self.logger.warning(self.graph)
 
-        time_str = time.strftime("%Y_%m_%d_%H_%M_%S_graph", time.localtime())
+            time_str = time.strftime("%Y_%m_%d_%H_%M_%S_graph", time.localtime())
         
-        # self.graph.write_graph_to_md("img/" + time_str + ".md")
-        # # input("press any key to continue")
-        # self.graph.write_graph_to_json("logs/")
-
-        self.status = TaskManager.idle
+            # self.graph.write_graph_to_md("img/" + time_str + ".md")
+            # # input("press any key to continue")
+            # self.graph.write_graph_to_json("logs/")
+        finally:
+            # idle even if the decomposition failed, wait_idle and await_idle would block forever
+            self.status = TaskManager.idle
 
 
     def query_subtask_list(self) -> [Task]:
@@ -234,12 +305,18 @@ class TaskManager:
         '''
 
         # self.logger.debug("="*20 + " Task Manager Support Open Task " + "="*20)
-        while self.status == TaskManager.running:
-            time.sleep(TASK_MANAGER_WAIT_TIME)
+        self.wait_idle()
 
 
         return self.graph.get_open_task_list()  
 
+    async def aquery_subtask_list(self) -> [Task]:
+        '''
+        Coroutine version of query_subtask_list
+        '''
+        await self.await_idle()
+        return self.graph.get_open_task_list()
+
 
     def get_graph_strategy(self, task:Task) -> {str: Union[str, int, list]}:
         '''
@@ -280,6 +357,19 @@ class TaskManager:
 
         return result
     
+    def get_priority(self, subtask_data: dict) -> int:
+        '''
+        Priority class of a subtask, 1 is the most urgent
+        the class of its response category in the response_priorities of the task document, else its priority level
+        '''
+        category = subtask_data.get("response_category")
+        if isinstance(category, str) and category in self.response_priorities:
+            return int(self.response_priorities[category])
+        level = subtask_data.get("priority_level")
+        if isinstance(level, str):
+            return PRIORITY_LEVEL.get(level.lower())
+        return None
+
     def fill_keys_omit(self, result:[dict], keys:list):
         for res in result:
             for key in keys:
@@ -302,49 +392,49 @@ class TaskManager:
         # self.logger.warning("open task list:")
         # self.logger.warning("=" * 40)
         self.status = TaskManager.running
-
-        if type(task) != Task:
-            self.logger.error("Task type error.")
-            self.status = TaskManager.idle
-            return
+        try:
+            if type(task) != Task:
+                self.logger.error("Task type error.")
+                return
         
-        # update the task status
-        self.add_task_to_trace()
+            # update the task status
+            self.add_task_to_trace()
 
-        # update the task status according to the feedback
-        if self.graph.check_graph_completion() == False:
-            self.status = TaskManager.idle
-            return
+            # update the task status according to the feedback
+            if self.graph.check_graph_completion() == False:
+                return
         
-        elif task.status == Task.unknown or task.status == Task.running:
-            self.logger.error("Should not feedback unknown or running task.")
-            self.status = TaskManager.idle
-            return
+            elif task.status == Task.unknown or task.status == Task.running:
+                self.logger.error("Should not feedback unknown or running task.")
+                return
         
-        if self.manage_method == "update":
-            self.update_task(task)
-        elif self.manage_method == "merge":
-            self.merge_task(task)
-        else:
-            self.logger.error("Task Manager Method Error.")
-            assert False, "task manager method error"
-        self.status = TaskManager.idle
+            if self.manage_method == "update":
+                self.update_task(task)
+            elif self.manage_method == "merge":
+                self.merge_task(task)
+            else:
+                self.logger.error("Task Manager Method Error.")
+                assert False, "task manager method error"
+        finally:
+            # idle even if the update raised, the controller waits for it in wait_idle
+            self.status = TaskManager.idle
 
     def merge_task(self, task:Task):
 
         result = self.get_graph_strategy(task)
         strategy = result["strategy"]
+        graph = self.get_editable_graph()
 
         if strategy == "replan":
             # 1. replan task
-            origin_task = self.graph.get_graph_list()[int(result["origin-id"])-1]
+            origin_task = self.graph.get_node_by_order(int(result["origin-id"]))
             replan_task = Task(name=result["description"], content=origin_task.content)
             replan_task.milestones = result["milestones"]
-            self.graph.replace_node(origin_task, replan_task)
+            graph.replace_node(origin_task, replan_task)
 
         elif strategy == "decompose":
             # 2. decompose
-            origin_task = self.graph.get_graph_list()[int(result["origin-id"])-1]
+            origin_task = self.graph.get_node_by_order(int(result["origin-id"]))
             subtasks = result["subtasks"]
 
             subtask_list = []
@@ -358,28 +448,35 @@ class TaskManager:
                 subtask.milestones = subtask_data["milestones"]
                 subtask.candidate_list = subtask_data["candidate_list"]
                 subtask.number = int(subtask_data["minimum_required_units"])
+                subtask.priority = self.get_priority(subtask_data)
                 subtask._pre_idxs = [int(idx) for idx in subtask_data["required_subtasks"]]
                 subtask_list.append(subtask)
-            sub_graph = self.query_graph(subtask_list)
-            self.graph.merge_at(sub_graph, origin_task)
+            try:
+                sub_graph = self.query_graph(subtask_list)
+            except ValueError as e:
+                # keep the current graph instead of merging a plan that can never finish
+                self.logger.error(e)
+                return
+            graph.merge_at(sub_graph, origin_task)
 
         elif strategy == "move":
             # 3. move task to a new position
-            origin_task = self.graph.get_graph_list()[int(result["origin-id"])-1]
-            predecessor = self.graph.get_graph_list()[int(result["new-id"])-1]
-            self.graph.remove_node_merge_edge(task)
-            self.graph.insert_node_merge_edge(task, predecessor)
+            origin_task = self.graph.get_node_by_order(int(result["origin-id"]))
+            predecessor = self.graph.get_node_by_order(int(result["new-id"]))
+            graph.remove_node_merge_edge(task)
+            graph.insert_node_merge_edge(task, predecessor)
         elif strategy == "insert":
             # 4. insert a new task after a task
             new_task = Task(name=result["description"], content=task.content)
             new_task.milestones = result["milestones"]
-            predecessor = self.graph.get_graph_list()[int(result["insert-id"])-1]
-            self.graph.insert_node_merge_edge(new_task, predecessor)
+            predecessor = self.graph.get_node_by_order(int(result["insert-id"]))
+            graph.insert_node_merge_edge(new_task, predecessor)
         elif strategy == "delete":
             # 5. delete task
-            self.graph.remove_node_merge_edge(task)
+            graph.remove_node_merge_edge(task)
         else:
             self.logger.error("Task status error.")
+        self.set_graph(graph)
         
         time_str = time.strftime("%Y_%m_%d_%H_%M_%S_graph", time.localtime())
         
@@ -481,13 +578,19 @@ class TaskManager:
             else:
                 subtask.candidate_list = subtask_data["candidate_list"]
                 subtask.number = int(subtask_data["minimum_required_units"])
+            subtask.priority = self.get_priority(subtask_data)
             _pre_idxs = [int(idx) for idx in subtask_data["required_subtasks"]]
             for idx in _pre_idxs:
                 if idx > 0 and idx < len(subtask_list):
                     subtask._pre_idxs.append(idx)
             subtask_list.append(subtask)
 
-        self.graph = self.query_graph(subtask_list)
+        try:
+            self.set_graph(self.query_graph(subtask_list))
+        except ValueError as e:
+            # keep the current graph instead of dispatching a plan that can never finish
+            self.logger.error(e)
+            return
 
         time_str = time.strftime("%Y_%m_%d_%H_%M_%S_graph", time.localtime())
         
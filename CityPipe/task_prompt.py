@@ -10,6 +10,7 @@ A subtask-structure has the following json component:
     "description": string, # Detailed description of the response action, including location, resources needed, and specific procedures
     "milestones": list[string], # Specific, measurable objectives for this subtask
     "priority_level": string, # "critical", "high", "medium", or "low"
+    "response_category": string, # the response priority category of the subtask in the task meta-data, e.g. "life_threatening"
     "estimated_duration": int, # Estimated time in minutes to complete the subtask
     "required_resources": dict, # Required resources like {"ambulances": 2, "paramedics": 4}
     "required_subtasks": list[int], # IDs of subtasks that must be completed before this one
@@ -137,6 +138,7 @@ A subtask-structure has the following json component:
     "description": string, # Detailed description of the response action, including location, resources needed, and specific procedures
     "milestones": list[string], # Specific, measurable objectives for this subtask
     "priority_level": string, # "critical", "high", "medium", or "low"
+    "response_category": string, # the response priority category of the subtask in the task meta-data, e.g. "life_threatening"
     "estimated_duration": int, # Estimated time in minutes to complete the subtask
     "required_resources": dict, # Required resources like {"ambulances": 2, "paramedics": 4}
     "required_subtasks": list[int], # IDs of subtasks that must be completed before this one
@@ -179,6 +181,7 @@ A subtask-structure has the following json component:
     "description": string, # Detailed description of the response action, including location, resources needed, and specific procedures
     "milestones": list[string], # Specific, measurable objectives for this subtask
     "priority_level": string, # "critical", "high", "medium", or "low"
+    "response_category": string, # the response priority category of the subtask in the task meta-data, e.g. "life_threatening"
     "estimated_duration": int, # Estimated time in minutes to complete the subtask
     "required_resources": dict, # Required resources like {"ambulances": 2, "paramedics": 4}
     "required_subtasks": list[int], # IDs of subtasks that must be completed before this one
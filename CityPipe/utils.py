@@ -248,6 +248,9 @@ def init_logger(name: str, level=logging.ERROR, dump=False, silent=False):
             def critical(self, *args, **kwargs):
                 pass
 
+            def exception(self, *args, **kwargs):
+                pass
+
         return empty_logger()
     # 创建一个logger
     logger = logging.getLogger(name)
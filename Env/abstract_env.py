@@ -72,7 +72,7 @@ class MultiAgentEnvironment(ABC):
         self.reset()
 
     @abstractmethod
-    def step(self, agent_name: str, action: str, max_turn: int = 2):
+    def step(self, agent_name: str, action: str, max_turn: int = 2, cancel_token=None):
         pass
 
     @abstractmethod
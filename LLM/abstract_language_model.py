@@ -1,7 +1,17 @@
+import time
+import asyncio
+import threading
+import weakref
 from abc import ABC, abstractmethod
+from LLM.call_stats import get_call_stats
+
+
+_semaphore_lock = threading.Lock()
 
 
 class AbstractLanguageModel(ABC):
+    max_concurrency = 8  # concurrent agenerate calls per model, the rate limit of the endpoint
+
     @abstractmethod
     def generate_thoughts(self, state, k):
         pass
@@ -15,7 +25,27 @@ class AbstractLanguageModel(ABC):
                                    temperature: float, k: int, stop, cache_enabled: bool, api_model: str,
                                    check_tags: list, json_check: bool, stream: bool):
         pass
-    
+
+    def semaphore(self) -> asyncio.Semaphore:
+        # one semaphore per model and event loop, a semaphore can not be shared across loops
+        loop = asyncio.get_running_loop()
+        with _semaphore_lock:
+            semaphore_dict = self.__dict__.setdefault("_semaphore", weakref.WeakKeyDictionary())
+            if loop not in semaphore_dict:
+                semaphore_dict[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore_dict[loop]
+
+    async def agenerate(self, system_prompt: str, example_prompt: [str] or str = [], **kwargs):
+        '''
+        Coroutine version of generate, at most max_concurrency calls of this model run at once.
+        Models without an async client run generate in a thread, its time is their llm latency.
+        '''
+        async with self.semaphore():
+            start_time = time.time()
+            result = await asyncio.to_thread(self.generate, system_prompt, example_prompt, **kwargs)
+            get_call_stats().add_latency(time.time() - start_time)
+            return result
+
     # @abstractmethod
     # def batch_generate(self, system_prompt: str, user_prompts: [str] or str, example_prompts: [str] or str, max_tokens: int, temperature: float,
     #                     k: int, stop, cache_enabled: bool, api_model: str, check_tags: list, json_check: bool):
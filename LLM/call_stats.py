@@ -0,0 +1,68 @@
+import time
+import math
+import threading
+from collections import deque
+
+
+class LLMCallStats:
+    '''
+    Latencies and rate limits (429) of the llm calls of the process, the autoscaler of the controller reads them.
+    Only the latest max_sample calls and rate limits are kept, summary() looks at a time window of them.
+    '''
+    def __init__(self, max_sample: int = 1024):
+        self._latency = deque(maxlen=max_sample)  # (end time, seconds)
+        self._rate_limit = deque(maxlen=max_sample)  # time of each 429
+        self._lock = threading.Lock()
+
+    def add_latency(self, seconds: float, now: float = None):
+        with self._lock:
+            self._latency.append((time.time() if now is None else now, seconds))
+
+    def add_rate_limit(self, now: float = None):
+        with self._lock:
+            self._rate_limit.append(time.time() if now is None else now)
+
+    def summary(self, window: float, now: float = None, since: float = None) -> dict:
+        # calls, p50 and p95 latency in seconds (None without calls) and rate limits of the last window seconds
+        # since: rate limits before this time are not counted
+        now = time.time() if now is None else now
+        since = now - window if since is None else max(since, now - window)
+        with self._lock:
+            latency = sorted(seconds for end_time, seconds in self._latency if now - end_time <= window)
+            rate_limit = sum(1 for limit_time in self._rate_limit if limit_time >= since)
+        return {
+            "calls": len(latency),
+            "p50": percentile(latency, 0.5),
+            "p95": percentile(latency, 0.95),
+            "rate_limit": rate_limit,
+        }
+
+
+def percentile(sorted_value: list, fraction: float) -> float:
+    # nearest rank
+    if not sorted_value:
+        return None
+    return sorted_value[min(len(sorted_value) - 1, max(math.ceil(fraction * len(sorted_value)) - 1, 0))]
+
+
+_call_stats = None
+_call_stats_lock = threading.Lock()
+
+
+def get_call_stats() -> LLMCallStats:
+    # the stats shared by every model of the process
+    global _call_stats
+    with _call_stats_lock:
+        if _call_stats is None:
+            _call_stats = LLMCallStats()
+        return _call_stats
+
+
+def record_response(response):
+    # response hook of the httpx client of a model, the openai client retries a 429 itself and the caller never sees it
+    if response.status_code == 429:
+        get_call_stats().add_rate_limit()
+
+
+async def arecord_response(response):
+    record_response(response)
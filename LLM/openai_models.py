@@ -1,9 +1,10 @@
+import asyncio
 import concurrent.futures
 import logging
 import os
 import time
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import tiktoken
 from LLM.abstract_language_model import AbstractLanguageModel
 import json
@@ -12,6 +13,7 @@ import random
 import httpx
 
 from LLM.utils import extract_info
+from LLM.call_stats import get_call_stats, record_response, arecord_response
 
 logging.basicConfig(
     level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -72,11 +74,14 @@ class OpenAILanguageModel(AbstractLanguageModel):
         self.strategy = strategy
         self.evaluation_strategy = evaluation_strategy
 
+        # every response passes the hook, the 429s the client retries are counted for the autoscaler of the controller
+        self.http_client = getattr(openai, "DefaultHttpxClient", httpx.Client)(event_hooks={"response": [record_response]})
         self.client = OpenAI(
             # This is the default and can be omitted
             api_key=random.choice(self.api_key_list) if len(self.api_key_list) > 0 else self.api_key,
             base_url=self.api_base,
             max_retries=5,
+            http_client=self.http_client,
         )
 
         if not os.path.exists("data"):
@@ -216,6 +221,7 @@ class OpenAILanguageModel(AbstractLanguageModel):
         start_time = time.time()
         completion = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature)
         # logger.warning(completion.choices[0].message.content)
+        get_call_stats().add_latency(time.time() - start_time)
         logger.debug(f"Time taken: {time.time() - start_time}")
         return completion
     
@@ -239,9 +245,117 @@ class OpenAILanguageModel(AbstractLanguageModel):
             if chunk.choices[0].delta.content is not None:
                 # print(chunk.choices[0].delta.content, end="")
                 content += chunk.choices[0].delta.content
+        get_call_stats().add_latency(time.time() - start_time)
         logger.debug(f"Time taken: {time.time() - start_time}")
         return content
 
+    def build_messages(self, system_prompt: str, example_prompt: [str], api_model: str, max_tokens: int) -> list:
+        messages = [{"role": "system", "content": "You are a helpful assistant."}]
+        messages = [{"role": "user", "content": system_prompt}]
+        for i in range(len(example_prompt)):
+            if i % 2 == 0:
+                messages.append({"role": "user", "content": example_prompt[i]})
+            else:
+                messages.append({"role": "assistant", "content": example_prompt[i]})
+
+        # dynamic change timeout by token number
+        return self.guard_token_number(messages, api_model, max_tokens)
+
+    def finish_generate(self, prompt: str, messages: list, content: str, start_time: float,
+                        cache_enabled: bool, check_tags: list, json_check: bool) -> str:
+        # check the answer, then write the cache and the logs
+        for tag in check_tags:
+            if tag not in content:
+                raise Exception(f"tag {tag} not in content {content}")
+        if json_check:
+            if len(extract_info(content)) == 0:
+                raise Exception(f"content {content} is not json")
+        if cache_enabled:
+            self.save_cache(prompt, content)
+        with open("data/openai.logs", "a") as log_file:
+            log_file.write(
+                "\n" + "-----------" + "\n" + "Prompt : " + str(messages) + "\n"
+            )
+
+        # logger.info(f"LLM API Time taken: {time.time() - start_time}")
+        if os.path.exists("data/llm_inference.json"):
+            with open("data/llm_inference.json", "r") as log_file:
+                log = json.load(log_file)
+            log["time"] += time.time() - start_time
+            with open("data/llm_inference.json", "w") as log_file:
+                json.dump(log, log_file)
+        return content
+
+    async def agpt_api_stream(self, client: AsyncOpenAI, messages: list, model: str, temperature: float) -> str:
+        """gpt_api_stream 的协程版本
+
+        Args:
+            messages (list): 完整的对话消息
+        """
+        start_time = time.time()
+        content = ""
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            temperature=temperature,
+        )
+        async for chunk in stream:
+            if chunk.choices[0].delta.content is not None:
+                content += chunk.choices[0].delta.content
+        get_call_stats().add_latency(time.time() - start_time)
+        logger.debug(f"Time taken: {time.time() - start_time}")
+        return content
+
+    async def agenerate(self, system_prompt: str = "", example_prompt: [str] or str = [], max_tokens=1024,
+                        temperature=0.0, k=1, stop=None, cache_enabled=True, api_model="", check_tags=[],
+                        json_check=False, stream=True):
+        '''
+        Coroutine version of generate on the async client, the request does not hold a thread.
+        Cache, token counting and log files are still read and written in a thread.
+        '''
+        if api_model == "":
+            api_model = self.api_model
+        elif api_model not in OpenAILanguageModel._supported_models:
+            raise Exception(f"only support {OpenAILanguageModel._supported_models}, but got {api_model}")
+        if type(example_prompt) == str:
+            example_prompt = [example_prompt]
+        assert self.use_chat_api == True, "few shot generation only support chat api"
+        assert len(example_prompt) % 2 == 1 or len(example_prompt) == 0, "example prompt should be odd number or empty"
+
+        prompt = str(system_prompt) + "\n" + "\n".join(example_prompt)
+        if cache_enabled:
+            content = await asyncio.to_thread(self.cache_api_call_handler, prompt, max_tokens, temperature, k, stop)
+            if content is not None:
+                return content
+        start_time = time.time()
+        messages = await asyncio.to_thread(self.build_messages, system_prompt, example_prompt, api_model, max_tokens)
+        async with self.semaphore():
+            client = AsyncOpenAI(
+                api_key=random.choice(self.api_key_list) if len(self.api_key_list) > 0 else self.api_key,
+                base_url=self.api_base,
+                max_retries=5,
+                http_client=getattr(openai, "DefaultAsyncHttpxClient", httpx.AsyncClient)(event_hooks={"response": [arecord_response]}),
+            )
+            try:
+                if stream:
+                    content = await self.agpt_api_stream(client, messages, api_model, temperature)
+                    prompt_tokens = None
+                else:
+                    call_time = time.time()
+                    response = await client.chat.completions.create(model=api_model, messages=messages, temperature=temperature)
+                    get_call_stats().add_latency(time.time() - call_time)
+                    prompt_tokens, completion_tokens = response.usage.prompt_tokens, response.usage.completion_tokens
+                    content = response.choices[0].message.content
+            finally:
+                await client.close()
+        if prompt_tokens is None:
+            prompt_tokens = await asyncio.to_thread(self.num_tokens_from_string, prompt, api_model)
+            completion_tokens = await asyncio.to_thread(self.num_tokens_from_string, content, api_model)
+        await asyncio.to_thread(self.update_token_usage, prompt_tokens, completion_tokens)
+        return await asyncio.to_thread(self.finish_generate, prompt, messages, content, start_time,
+                                       cache_enabled, check_tags, json_check)
+
     # @retry(tries=10, delay=5, backoff=2, max_delay=60)
     def generate(self, system_prompt: str = "", example_prompt: [str] or str = [], max_tokens=1024,
                                    temperature=0.0, k=1, stop=None, cache_enabled=True, api_model="", check_tags=[],
@@ -251,6 +365,7 @@ class OpenAILanguageModel(AbstractLanguageModel):
             api_key=random.choice(self.api_key_list) if len(self.api_key_list) > 0 else self.api_key,
             base_url=self.api_base,
             max_retries=5,
+            http_client=self.http_client,
         )
         if api_model == "":
             api_model = self.api_model
@@ -272,16 +387,7 @@ class OpenAILanguageModel(AbstractLanguageModel):
         start_time = time.time()
         while True:
             # try:
-            messages = [{"role": "system", "content": "You are a helpful assistant."}]
-            messages = [{"role": "user", "content": system_prompt}]
-            for i in range(len(example_prompt)):
-                if i % 2 == 0:
-                    messages.append({"role": "user", "content": example_prompt[i]})
-                else:
-                    messages.append({"role": "assistant", "content": example_prompt[i]})
-
-            # dynamic change timeout by token number
-            messages = self.guard_token_number(messages, api_model, max_tokens)
+            messages = self.build_messages(system_prompt, example_prompt, api_model, max_tokens)
 
             if stream:
                 content = self.gpt_api_stream(messages, api_model, temperature)
@@ -295,27 +401,7 @@ class OpenAILanguageModel(AbstractLanguageModel):
 
                 content = response.choices[0].message.content
 
-            for tag in check_tags:
-                if tag not in content:
-                    raise Exception(f"tag {tag} not in content {content}")
-            if json_check:
-                if len(extract_info(content)) == 0:
-                    raise Exception(f"content {content} is not json")
-            if cache_enabled:
-                self.save_cache(prompt, content)
-            with open("data/openai.logs", "a") as log_file:
-                log_file.write(
-                    "\n" + "-----------" + "\n" + "Prompt : " + str(messages) + "\n"
-                )
-
-            # logger.info(f"LLM API Time taken: {time.time() - start_time}")
-            if os.path.exists("data/llm_inference.json"):
-                with open("data/llm_inference.json", "r") as log_file:
-                    log = json.load(log_file)
-                log["time"] += time.time() - start_time
-                with open("data/llm_inference.json", "w") as log_file:
-                    json.dump(log, log_file)
-            return content
+            return self.finish_generate(prompt, messages, content, start_time, cache_enabled, check_tags, json_check)
             
             # except openai.APIConnectionError as e:
             #     logger.warning("[Proxy] The server could not be reached")
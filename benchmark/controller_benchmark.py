@@ -0,0 +1,676 @@
+import sys
+import os
+import time
+import json
+import signal
+import asyncio
+import threading
+import multiprocessing
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+import CityPipe.controller as controller_module
+from CityPipe.controller import GlobalController
+from CityPipe.agent import BaseAgent
+from type_define.deadline_watchdog import CancelToken
+from CityPipe.remote_backend import run_worker
+from type_define.pool_autoscaler import PoolAutoscaler
+from LLM.call_stats import LLMCallStats
+
+'''
+Benchmark of GlobalController scheduling without LLM calls.
+Agents, task manager, data manager and the assignment LLM are replaced by fakes, so only
+the controller threads are measured:
+- assignment latency: time from the end of a step to the start of the step that depends on it
+- idle cpu: cpu time used by the process while every agent is busy on a long step
+- asyncio mode: many agents stepping at once on one event loop, wall time and peak thread count
+- throughput: tasks dispatched per second with 50 agents and instant steps
+- collaborative dispatch: time until every agent of a 5-agent task has started its part
+- priority: execution order of a few life-threatening tasks listed after many ready property-damage tasks
+- feedback: time to book and complete one task as the graph and the agent pool grow
+- llm rounds: assignment rounds decided by the matcher and by the llm, agents finishing at different times,
+  tasks of distinct priority classes and of one class
+- prompt context: time to gather env, agent states and experience before the assignment prompt,
+  one query after another, concurrently, and prefetched while the task manager handles the feedback
+- batched decomposition: collaborative tasks of one round decomposed by one request each, one after another, against
+  one batched request, with a task missing from the batched answer and with the batched request failing
+- timeout: a step hanging past max_task_time on the only agent, delay until it is failed, until its
+  thread leaves the step and until the next task starts, then a step that never reaches a checkpoint: the next task
+  starts on a thread that replaces the stuck one, the pool is kept
+- status snapshot: time write_task_list takes in the scheduling loop, the synchronous json.dump it replaced,
+  an unchanged snapshot and a changed one
+- backend: throughput of cpu-bound steps (json round trips, like prompt assembly and parsing) and one data
+  manager call per step, thread pool against worker processes, 5, 20 and 100 agents
+- remote workers, loopback: worker processes connected to the controller over tcp and over a unix socket,
+  throughput of short steps against the thread pool, then one worker frozen while it holds steps: delay until
+  its steps are leased to the other worker and until every task is done
+- autoscaler: steps that each make one call to a fake llm endpoint, a slow endpoint with a fixed pool of 4 threads
+  against the autoscaled pool, then an endpoint answering 429 past a few concurrent calls with a pool of one thread
+  per agent against the autoscaled pool, throughput, 429s and the decisions of the autoscaler
+
+usage: python benchmark/controller_benchmark.py
+'''
+
+CHAIN_LENGTH = 10
+FAST_STEP_TIME = 0.05
+IDLE_STEP_TIME = 5.0
+IDLE_WINDOW = 3.0
+STAGGER_STEP_TIME = lambda task: 0.01 + 0.003 * (int(task.description.split()[-1]) % 7)
+ASYNC_AGENT_NUM = 200
+ASYNC_STEP_TIME = 0.5
+THROUGHPUT_AGENT_NUM = 50
+THROUGHPUT_TASK_NUM = 1000
+COLLAB_AGENT_NUM = 5
+PRIORITY_TASK_NUM = 40
+URGENT_TASK_NUM = 4
+FEEDBACK_SIZE_LIST = [(100, 10), (1000, 100), (10000, 1000)]  # (tasks, agents)
+MATCH_AGENT_NUM = 10
+MATCH_TASK_NUM = 100
+CONTEXT_QUERY_TIME = 0.2
+TIMEOUT_TASK_TIME = 0.3  # max_task_time of the timeout benchmark
+HANG_STEP_TIME = 10.0
+SNAPSHOT_TASK_NUM = 1000
+SNAPSHOT_AGENT_NUM = 50
+SNAPSHOT_ROUND = 100
+BACKEND_AGENT_LIST = [5, 20, 100]
+BACKEND_TASK_PER_AGENT = 4
+CPU_STEP_ROUND = 20  # json round trips per step
+REMOTE_WORKER_NUM = 4
+REMOTE_SLOT_NUM = 5  # steps a worker runs at once
+REMOTE_TASK_NUM = 200
+REMOTE_STEP_TIME = 0.02
+LOST_TASK_NUM = 8
+LOST_STEP_TIME = 0.5
+LOST_LEASE_TIMEOUT = 1.0
+SCALE_AGENT_NUM = 20
+SCALE_TASK_NUM = 120
+SLOW_LLM_LATENCY = 0.2
+THROTTLE_LLM_LATENCY = 0.05
+THROTTLE_CAPACITY = 4  # concurrent calls the endpoint serves, the others get a 429
+DECOMPOSE_TASK_NUM = 8
+DECOMPOSE_AGENT_NUM = 2  # agents of each collaborative task
+DECOMPOSE_LLM_TIME = 0.3
+
+
+class FakeLLM:
+    role_name = None
+
+
+def fake_language_model(config: dict) -> FakeLLM:
+    # module level, the process backend sends it to the workers
+    return FakeLLM()
+
+
+def cpu_work(rounds: int):
+    data = {"action_list": [{"action": f"step {idx}", "feedback": "x" * 64} for idx in range(50)]}
+    for _ in range(rounds):
+        data = json.loads(json.dumps(data))
+
+
+class FakeEnv:
+    class AgentInfo:
+        def __init__(self, name: str):
+            self.name = name
+
+    def __init__(self, agent_num: int):
+        self.agent_pool = [FakeEnv.AgentInfo(f"agent_{idx}") for idx in range(agent_num)]
+
+    def get_all_agent_description_tiny(self) -> dict:
+        return {agent.name: "fake agent" for agent in self.agent_pool}
+
+
+class FakeEndpoint:
+    '''
+    llm endpoint with a fixed latency, a call past capacity concurrent calls gets a 429 and is retried after
+    retry_delay, the first backoff of the openai client
+    '''
+    def __init__(self, latency: float, capacity: int = None, retry_delay: float = 0.5):
+        self.latency = latency
+        self.capacity = capacity
+        self.retry_delay = retry_delay
+        self.stats = LLMCallStats()
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def call(self):
+        while True:
+            with self.lock:
+                if self.capacity is None or self.active < self.capacity:
+                    self.active += 1
+                    break
+            self.stats.add_rate_limit()
+            time.sleep(self.retry_delay)
+        start_time = time.time()
+        time.sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        self.stats.add_latency(time.time() - start_time)
+
+
+class FakeAgent(BaseAgent):
+    step_time = FAST_STEP_TIME  # seconds, or callable task -> seconds
+    step_log = []  # (task description, start time, end time)
+    endpoint = None  # FakeEndpoint called by the steps of tasks with "llm" in their content
+    peak_thread = 0
+    log_lock = threading.Lock()
+
+    def __init__(self, llm, env, data_manager, name: str, **kwargs):
+        self.name = name
+        self.agent_type = kwargs.get("agent_type", "general")
+        self.history_action_list = ["No action yet"]
+        self.llm = llm
+        self.env = env
+        self.data_manager = data_manager
+
+    def step(self, task: Task, cancel_token: CancelToken = None) -> (str, dict):
+        start_time = time.perf_counter()
+        if task.content.get("cpu"):
+            cpu_work(task.content["cpu"])
+            self.data_manager.query_agent_list([self.name])
+        if task.content.get("llm"):
+            FakeAgent.endpoint.call()
+        # a worker process imports this module again, the step time of its steps comes with the task
+        step_time = task.content.get("step_time", FakeAgent.step_time)
+        step_time = step_time(task) if callable(step_time) else step_time
+        try:
+            if cancel_token is not None and not task.content.get("no_checkpoint"):
+                # the llm calls and tools of a real step are its checkpoints
+                cancel_token.wait(step_time)
+                cancel_token.check()
+            else:
+                time.sleep(step_time)
+        finally:
+            with FakeAgent.log_lock:
+                FakeAgent.step_log.append((task.description, start_time, time.perf_counter()))
+        return "done", {"action_list": []}
+
+    async def astep(self, task: Task) -> (str, dict):
+        start_time = time.perf_counter()
+        await asyncio.sleep(FakeAgent.step_time)
+        with FakeAgent.log_lock:
+            FakeAgent.step_log.append((task.description, start_time, time.perf_counter()))
+            FakeAgent.peak_thread = max(FakeAgent.peak_thread, threading.active_count())
+        return "done", {"action_list": []}
+
+    def reflect(self, task: Task, detail) -> bool:
+        return True
+
+    async def areflect(self, task: Task, detail) -> bool:
+        return True
+
+
+class FakeDataManager:
+    query_time = 0.0  # seconds of each query, the minecraft data manager calls the llm in some of them
+
+    def query_env(self):
+        time.sleep(FakeDataManager.query_time)
+        return [""]
+
+    def query_agent_list(self, name_list):
+        time.sleep(FakeDataManager.query_time)
+        return ""
+
+    def query_task_list_experience(self, task_list):
+        time.sleep(FakeDataManager.query_time)
+        return ""
+
+
+class FakeTaskManager:
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.llm = None
+        self.dm = None
+        self.unit_describe = None
+        self.agent_list = []
+
+    def query_subtask_list(self) -> [Task]:
+        return self.graph.get_open_task_list()
+
+    async def aquery_subtask_list(self) -> [Task]:
+        return self.graph.get_open_task_list()
+
+    def feedback_task(self, task: Task):
+        pass
+
+
+class BenchController(GlobalController):
+    def generate_prompt_and_get_response(self, env, experience, agent_state):
+        # give every available task to its first free candidate, as the assignment LLM would
+        result = []
+        busy = set(self.assignment.keys())
+        for idx, task in enumerate(self.task_list):
+            if not task.available:
+                continue
+            for name in task.candidate_list:
+                if name not in busy:
+                    busy.add(name)
+                    result.append({"task_id": idx, "agent": name})
+                    break
+        return result
+
+    async def agenerate_prompt_and_get_response(self, env, experience, agent_state):
+        return self.generate_prompt_and_get_response(env, experience, agent_state)
+
+    decompose_time = 0.0  # seconds of each decomposition request
+    batch_drop = ()  # task indexes missing from the batched answer, None fails the whole request
+    decompose_call = 0
+
+    def generate_decompose_prompt_and_get_response(self, agent_state, name_list, task_description, task_milestones):
+        self.call_decompose_llm()
+        return [{"agent": name, "description": f"{task_description} part {idx}", "milestones": []}
+                for idx, name in enumerate(name_list)]
+
+    def generate_batch_decompose_prompt_and_get_response(self, agent_state, collab_list: [dict]) -> dict:
+        self.call_decompose_llm()
+        if self.batch_drop is None:
+            raise ValueError("no json in the response")
+        info_list = [{"task": idx, "agent": agent.name, "description": f"{assignment['task_instance'].description} part {part}",
+                      "milestones": []}
+                     for idx, assignment in enumerate(collab_list) if idx not in self.batch_drop
+                     for part, agent in enumerate(assignment["agent_instances"])]
+        return self.route_batch_decompose(info_list, len(collab_list))
+
+    async def agenerate_decompose_prompt_and_get_response(self, agent_state, name_list, task_description, task_milestones):
+        return await asyncio.to_thread(self.generate_decompose_prompt_and_get_response, agent_state, name_list, task_description, task_milestones)
+
+    async def agenerate_batch_decompose_prompt_and_get_response(self, agent_state, collab_list: [dict]) -> dict:
+        return await asyncio.to_thread(self.generate_batch_decompose_prompt_and_get_response, agent_state, collab_list)
+
+    def call_decompose_llm(self):
+        with FakeAgent.log_lock:
+            self.decompose_call += 1
+        time.sleep(self.decompose_time)
+
+
+def make_controller(graph: Graph, agent_num: int, backend: str = "thread", **kwargs) -> GlobalController:
+    controller_module.init_language_model = fake_language_model
+    controller_module.BaseAgent = FakeAgent
+    controller = BenchController({}, FakeTaskManager(graph), FakeDataManager(), FakeEnv(agent_num),
+                                 silent=True, duration_path=None, backend=backend, **kwargs)
+    return controller
+
+
+def chain_graph(length: int) -> Graph:
+    task_list = [Task(f"task {idx}", {}) for idx in range(length)]
+    for idx, task in enumerate(task_list):
+        task._pre_idxs = [idx] if idx > 0 else []
+    graph, _ = Graph.from_dependency(task_list)
+    return graph
+
+
+def independent_graph(length: int) -> Graph:
+    graph, _ = Graph.from_dependency([Task(f"task {idx}", {}) for idx in range(length)])
+    return graph
+
+
+def bench_latency() -> (float, float):
+    FakeAgent.step_time = FAST_STEP_TIME
+    FakeAgent.step_log = []
+    controller = make_controller(chain_graph(CHAIN_LENGTH), 1)
+    start_time = time.perf_counter()
+    controller.run()
+    total = time.perf_counter() - start_time
+    step_log = sorted(FakeAgent.step_log, key=lambda step: step[1])
+    latency = [step_log[idx + 1][1] - step_log[idx][2] for idx in range(len(step_log) - 1)]
+    return sum(latency) / max(len(latency), 1), total
+
+
+def bench_idle_cpu() -> float:
+    FakeAgent.step_time = IDLE_STEP_TIME
+    FakeAgent.step_log = []
+    controller = make_controller(chain_graph(1), 1)
+    thread = threading.Thread(target=controller.run)
+    thread.start()
+    time.sleep(1.0)  # let the step start
+    cpu_time = time.process_time()
+    time.sleep(IDLE_WINDOW)
+    cpu_time = time.process_time() - cpu_time
+    thread.join()
+    return cpu_time / IDLE_WINDOW
+
+
+def bench_async() -> (float, int):
+    FakeAgent.step_time = ASYNC_STEP_TIME
+    FakeAgent.step_log = []
+    FakeAgent.peak_thread = 0
+    controller = make_controller(independent_graph(ASYNC_AGENT_NUM), ASYNC_AGENT_NUM)
+    start_time = time.perf_counter()
+    controller.run_async()
+    return time.perf_counter() - start_time, FakeAgent.peak_thread
+
+
+def bench_throughput() -> float:
+    FakeAgent.step_time = 0.0
+    FakeAgent.step_log = []
+    controller = make_controller(independent_graph(THROUGHPUT_TASK_NUM), THROUGHPUT_AGENT_NUM)
+    start_time = time.perf_counter()
+    controller.run()
+    return len(FakeAgent.step_log) / (time.perf_counter() - start_time)
+
+
+def bench_collab_dispatch() -> float:
+    FakeAgent.step_time = 0.0
+    FakeAgent.step_log = []
+    graph = independent_graph(1)
+    task = graph.vertex[0]
+    task.number = COLLAB_AGENT_NUM
+    task.candidate_list = [f"agent_{idx}" for idx in range(COLLAB_AGENT_NUM)]
+    controller = make_controller(graph, COLLAB_AGENT_NUM)
+    thread = threading.Thread(target=controller.run)
+    start_time = time.perf_counter()
+    thread.start()
+    # only the dispatch is measured, the controller is stopped once every part has started
+    while len(FakeAgent.step_log) < COLLAB_AGENT_NUM and time.perf_counter() - start_time < 60:
+        time.sleep(0.001)
+    controller.stop()
+    thread.join()
+    return max(step[1] for step in FakeAgent.step_log) - start_time
+
+
+def bench_priority() -> [int]:
+    FakeAgent.step_time = 0.0
+    FakeAgent.step_log = []
+    graph = independent_graph(PRIORITY_TASK_NUM)
+    for idx, task in enumerate(graph.vertex):
+        # response_priorities of run_city.py: life_threatening 1, property_damage 2
+        task.priority = 1 if idx >= PRIORITY_TASK_NUM - URGENT_TASK_NUM else 2
+    urgent = {task.description for task in graph.vertex if task.priority == 1}
+    controller = make_controller(graph, 1)
+    controller.run()
+    step_log = sorted(FakeAgent.step_log, key=lambda step: step[1])
+    return [idx for idx, step in enumerate(step_log) if step[0] in urgent]
+
+
+def bench_feedback(task_num: int, agent_num: int) -> float:
+    # dispatch_assignment and update_feedback without threads, the task manager feedback is a no-op
+    controller = make_controller(independent_graph(task_num), agent_num)
+    task_list = controller.task_manager.graph.vertex
+    start_time = time.perf_counter()
+    for idx, task in enumerate(task_list):
+        agent = controller.agent_list[idx % agent_num]
+        controller.dispatch_assignment(task, [agent], "")
+        controller.update_feedback(task, agent, {"action_list": []}, True)
+    return (time.perf_counter() - start_time) / task_num
+
+
+def bench_llm_rounds(distinct_rank: bool) -> dict:
+    # agents finish at different times, so most rounds have one free agent and many ready tasks
+    FakeAgent.step_time = STAGGER_STEP_TIME
+    FakeAgent.step_log = []
+    graph = independent_graph(MATCH_TASK_NUM)
+    for idx, task in enumerate(graph.vertex):
+        task.priority = idx if distinct_rank else 1
+    controller = make_controller(graph, MATCH_AGENT_NUM)
+    controller.run()
+    return controller.assign_count
+
+
+def bench_context() -> (float, float, float):
+    FakeDataManager.query_time = CONTEXT_QUERY_TIME
+    try:
+        controller = make_controller(independent_graph(10), 5)
+        data_manager = controller.data_manager
+        controller.task_list = controller.task_manager.query_subtask_list()
+        start_time = time.perf_counter()
+        data_manager.query_env()
+        data_manager.query_agent_list(controller.name_list)
+        data_manager.query_task_list_experience(controller.task_list)
+        sequential = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        controller.query_context()
+        concurrent = time.perf_counter() - start_time
+        # a step finishes, the task manager takes a while to update the task list
+        controller.invalidate_context()
+        controller.prefetch_context(controller.task_list)
+        time.sleep(CONTEXT_QUERY_TIME * 2)
+        start_time = time.perf_counter()
+        controller.query_context()
+        prefetched = time.perf_counter() - start_time
+        return sequential, concurrent, prefetched
+    finally:
+        FakeDataManager.query_time = 0.0
+
+
+def bench_decompose(batch_drop=(), sequential: bool = False) -> (float, int):
+    # time until every collaborative task of one round is dispatched, and the decomposition requests it took
+    agent_num = DECOMPOSE_TASK_NUM * DECOMPOSE_AGENT_NUM
+    controller = make_controller(independent_graph(DECOMPOSE_TASK_NUM), agent_num)
+    controller.decompose_time = DECOMPOSE_LLM_TIME
+    controller.batch_drop = batch_drop
+    controller.task_list = controller.task_manager.query_subtask_list()
+    assignment_list = [{
+        "task_instance": task,
+        "agent_instances": controller.agent_list[idx * DECOMPOSE_AGENT_NUM:(idx + 1) * DECOMPOSE_AGENT_NUM]
+    } for idx, task in enumerate(controller.task_list)]
+    start_time = time.perf_counter()
+    if sequential:
+        # one request after another, as each task was decomposed before the batching
+        for assignment in assignment_list:
+            controller.dispatch_assignment(assignment["task_instance"], assignment["agent_instances"],
+                                           controller.decompose_assignment("", assignment))
+    else:
+        controller.execute_assignments(assignment_list)
+    total = time.perf_counter() - start_time
+    controller.close()
+    return total, controller.decompose_call
+
+
+def bench_timeout(checkpoint: bool = True) -> (float, float, float, bool, int):
+    # without checkpoint the step sleeps through its cancellation, as a step stuck in a call that does not return
+    FakeAgent.step_time = lambda task: HANG_STEP_TIME if task.description == "task 0" else FAST_STEP_TIME
+    FakeAgent.step_log = []
+    graph = independent_graph(2)
+    hang_task = graph.vertex[0]
+    hang_task.priority = 1  # runs first
+    hang_task.content["no_checkpoint"] = not checkpoint
+    controller = make_controller(graph, 1)
+    controller.max_task_time = TIMEOUT_TASK_TIME
+    failed_time = []
+    update_task_status = controller.update_task_status
+
+    def record_failure(task, status, detail):
+        if task is hang_task:
+            failed_time.append(time.perf_counter())
+        update_task_status(task, status, detail)
+    controller.update_task_status = record_failure
+    executor = controller.executor
+    controller.run()
+    step_log = {step[0]: step for step in FakeAgent.step_log}
+    if checkpoint:
+        deadline = step_log["task 0"][1] + TIMEOUT_TASK_TIME
+        left = step_log["task 0"][2] - deadline
+    else:
+        # the hanging step is still in its thread, the next task started on the thread that replaced it
+        deadline = failed_time[0]
+        left = None
+    return (failed_time[0] - deadline, left, step_log["task 1"][1] - deadline,
+            controller.executor is executor, executor.replace_count)
+
+
+def bench_snapshot() -> (float, float, float):
+    controller = make_controller(independent_graph(SNAPSHOT_TASK_NUM), SNAPSHOT_AGENT_NUM)
+    controller.task_list = controller.task_manager.graph.vertex
+    task = controller.task_list[0]
+    start_time = time.perf_counter()
+    for _ in range(SNAPSHOT_ROUND):
+        with open("logs/task_list.json", "w") as f:
+            json.dump({
+                "agent_states": [{"name": agent.name, "state": "free", "task": None} for agent in controller.agent_list],
+                "task_list": [task.assign_json(idx) for idx, task in enumerate(controller.task_list)],
+            }, f, indent=4)
+    synchronous = (time.perf_counter() - start_time) / SNAPSHOT_ROUND
+    controller.write_task_list()
+    controller.snapshot_publisher.flush()
+    start_time = time.perf_counter()
+    for _ in range(SNAPSHOT_ROUND):
+        controller.write_task_list()
+    unchanged = (time.perf_counter() - start_time) / SNAPSHOT_ROUND
+    start_time = time.perf_counter()
+    for idx in range(SNAPSHOT_ROUND):
+        task.priority = idx
+        controller.write_task_list()
+    changed = (time.perf_counter() - start_time) / SNAPSHOT_ROUND
+    controller.close()
+    return synchronous, unchanged, changed
+
+
+def bench_backend(agent_num: int, backend: str) -> float:
+    FakeAgent.step_time = 0.0
+    FakeAgent.step_log = []
+    task_num = agent_num * BACKEND_TASK_PER_AGENT
+    graph, _ = Graph.from_dependency([Task(f"task {idx}", {"cpu": CPU_STEP_ROUND, "step_time": 0.0}) for idx in range(task_num)])
+    controller = make_controller(graph, agent_num, backend)
+    start_time = time.perf_counter()
+    controller.run()
+    return task_num / (time.perf_counter() - start_time)
+
+
+def start_remote_worker(controller: GlobalController, slots: int, heartbeat_interval: float = 2.0):
+    # a worker process of the loopback harness, on another host it is python CityPipe/remote_backend.py
+    context = multiprocessing.get_context("forkserver")
+    process = context.Process(target=run_worker, daemon=True,
+                              args=(controller.executor.address, controller.executor.authkey, slots, heartbeat_interval))
+    process.start()
+    return process
+
+
+def bench_remote(address) -> (float, float):
+    # tasks per second on the thread pool and on REMOTE_WORKER_NUM remote workers, same agents and steps
+    throughput = []
+    for backend in ["thread", "remote"]:
+        graph, _ = Graph.from_dependency([Task(f"task {idx}", {"step_time": REMOTE_STEP_TIME})
+                                          for idx in range(REMOTE_TASK_NUM)])
+        worker_list = []
+        if backend == "remote":
+            controller = make_controller(graph, REMOTE_WORKER_NUM * REMOTE_SLOT_NUM, backend, remote_address=address)
+            worker_list = [start_remote_worker(controller, REMOTE_SLOT_NUM) for _ in range(REMOTE_WORKER_NUM)]
+            controller.executor.wait_for_workers(REMOTE_WORKER_NUM)
+        else:
+            controller = make_controller(graph, REMOTE_WORKER_NUM * REMOTE_SLOT_NUM, backend)
+        start_time = time.perf_counter()
+        controller.run()
+        throughput.append(REMOTE_TASK_NUM / (time.perf_counter() - start_time))
+        for worker in worker_list:
+            worker.join()
+    return tuple(throughput)
+
+
+def bench_remote_lost() -> (float, float, int, int):
+    # 2 workers of 2 slots, the first one is frozen (SIGSTOP) while it holds steps, like a host that hangs
+    graph, _ = Graph.from_dependency([Task(f"task {idx}", {"step_time": LOST_STEP_TIME}) for idx in range(LOST_TASK_NUM)])
+    controller = make_controller(graph, 4, "remote")
+    controller.executor.lease_timeout = LOST_LEASE_TIMEOUT
+    worker_list = []
+    for worker_num in [1, 2]:
+        worker_list.append(start_remote_worker(controller, 2, LOST_LEASE_TIMEOUT / 5))
+        controller.executor.wait_for_workers(worker_num)
+    thread = threading.Thread(target=controller.run)
+    thread.start()
+    while controller.executor.stats()["leased"] < 4:
+        time.sleep(0.01)
+    os.kill(worker_list[0].pid, signal.SIGSTOP)
+    frozen_time = time.perf_counter()
+    while controller.executor.stats()["moved_lease"] == 0:
+        time.sleep(0.01)
+    moved_time = time.perf_counter()
+    thread.join()
+    done_time = time.perf_counter()
+    worker_list[0].kill()
+    worker_list[1].join()
+    success_num = sum(task.status == Task.success for task in graph.vertex)
+    return moved_time - frozen_time, done_time - frozen_time, controller.executor.stats()["moved_lease"], success_num
+
+
+def bench_autoscale(endpoint: FakeEndpoint, max_workers: int = None) -> (float, int, dict):
+    # tasks per second and 429s with a fixed pool of max_workers threads, or the autoscaled pool when None
+    FakeAgent.step_time = 0.0
+    FakeAgent.endpoint = endpoint
+    graph, _ = Graph.from_dependency([Task(f"task {idx}", {"llm": True}) for idx in range(SCALE_TASK_NUM)])
+    autoscaler = None
+    if max_workers is None:
+        autoscaler = PoolAutoscaler(min_workers=2, max_workers=SCALE_AGENT_NUM, interval=0.05, window=0.5,
+                                    cooldown=0.5, scale_down_delay=0.5, llm_stats=endpoint.stats)
+    controller = make_controller(graph, SCALE_AGENT_NUM, max_workers=max_workers, autoscaler=autoscaler)
+    start_time = time.perf_counter()
+    controller.run()
+    total = time.perf_counter() - start_time
+    rate_limit = endpoint.stats.summary(float("inf"))["rate_limit"]
+    return SCALE_TASK_NUM / total, rate_limit, autoscaler.metrics() if autoscaler is not None else None
+
+
+def main():
+    os.makedirs("logs", exist_ok=True)
+    latency, total = bench_latency()
+    print(f"chain of {CHAIN_LENGTH} tasks, {FAST_STEP_TIME * 1000:.0f} ms per step")
+    print(f"  assignment latency per task: {latency * 1000:.1f} ms")
+    print(f"  total time: {total:.2f} s")
+    idle_cpu = bench_idle_cpu()
+    print(f"idle cpu while every agent is busy: {idle_cpu * 100:.2f} %")
+    throughput = bench_throughput()
+    print(f"{THROUGHPUT_AGENT_NUM} agents, {THROUGHPUT_TASK_NUM} tasks, instant steps")
+    print(f"  throughput: {throughput:.0f} tasks/s")
+    collab_time = bench_collab_dispatch()
+    print(f"collaborative task of {COLLAB_AGENT_NUM} agents, every part started after {collab_time * 1000:.1f} ms")
+    position = bench_priority()
+    print(f"{URGENT_TASK_NUM} life-threatening tasks listed after {PRIORITY_TASK_NUM - URGENT_TASK_NUM} ready tasks, one agent")
+    print(f"  executed at positions {position}")
+    for task_num, agent_num in FEEDBACK_SIZE_LIST:
+        print(f"feedback of one task, {task_num} tasks, {agent_num} agents: {bench_feedback(task_num, agent_num) * 1e6:.1f} us")
+    for distinct_rank in [True, False]:
+        assign_count = bench_llm_rounds(distinct_rank)
+        print(f"{MATCH_TASK_NUM} tasks, {MATCH_AGENT_NUM} agents, {'distinct priorities' if distinct_rank else 'one priority'}: "
+              f"{assign_count['matcher']} rounds by the matcher, {assign_count['llm']} by the llm")
+    sequential, concurrent, prefetched = bench_context()
+    print(f"prompt context, {CONTEXT_QUERY_TIME * 1000:.0f} ms per query")
+    print(f"  one after another: {sequential * 1000:.0f} ms, concurrent: {concurrent * 1000:.0f} ms, prefetched: {prefetched * 1000:.1f} ms")
+    print(f"{DECOMPOSE_TASK_NUM} collaborative tasks of {DECOMPOSE_AGENT_NUM} agents in one round, "
+          f"{DECOMPOSE_LLM_TIME * 1000:.0f} ms per decomposition request")
+    for label, kwargs in [("one request per task", {"sequential": True}), ("batched", {}),
+                          ("batched, 1 task missing from the answer", {"batch_drop": (0,)}),
+                          ("batched request failed", {"batch_drop": None})]:
+        total, call_num = bench_decompose(**kwargs)
+        print(f"  {label}: every task dispatched after {total * 1000:.0f} ms, {call_num} requests")
+    failed, left, next_start, kept, replaced = bench_timeout()
+    print(f"step hanging past max_task_time of {TIMEOUT_TASK_TIME * 1000:.0f} ms, one agent")
+    print(f"  after the deadline: failed in {failed * 1000:.1f} ms, thread left the step in {left * 1000:.1f} ms, "
+          f"next task started in {next_start * 1000:.1f} ms")
+    print(f"  step pool kept: {kept}, threads replaced: {replaced}")
+    _, _, next_start, kept, replaced = bench_timeout(checkpoint=False)
+    print(f"  a step without checkpoint: next task started {next_start * 1000:.1f} ms after the failure, "
+          f"step pool kept: {kept}, threads replaced: {replaced}")
+    synchronous, unchanged, changed = bench_snapshot()
+    print(f"status snapshot, {SNAPSHOT_TASK_NUM} tasks, {SNAPSHOT_AGENT_NUM} agents, time in the scheduling loop")
+    print(f"  synchronous json.dump: {synchronous * 1000:.1f} ms, unchanged: {unchanged * 1000:.2f} ms, changed: {changed * 1000:.2f} ms")
+    start_time = time.perf_counter()
+    cpu_work(CPU_STEP_ROUND)
+    print(f"backend, cpu-bound steps of {(time.perf_counter() - start_time) * 1000:.1f} ms, "
+          f"{BACKEND_TASK_PER_AGENT} tasks per agent, {os.cpu_count()} cpus")
+    for agent_num in BACKEND_AGENT_LIST:
+        thread = bench_backend(agent_num, "thread")
+        process = bench_backend(agent_num, "process")
+        print(f"  {agent_num} agents: thread {thread:.0f} tasks/s, process {process:.0f} tasks/s")
+    for name, address in [("tcp", ("127.0.0.1", 0)), ("unix socket", os.path.abspath("logs/remote_workers.sock"))]:
+        thread, remote = bench_remote(address)
+        print(f"remote workers over {name}, {REMOTE_WORKER_NUM} workers of {REMOTE_SLOT_NUM} slots, "
+              f"{REMOTE_TASK_NUM} steps of {REMOTE_STEP_TIME * 1000:.0f} ms")
+        print(f"  thread pool: {thread:.0f} tasks/s, remote workers: {remote:.0f} tasks/s")
+    moved, done, moved_num, success_num = bench_remote_lost()
+    print(f"remote worker frozen holding 2 steps of {LOST_STEP_TIME * 1000:.0f} ms, lease timeout {LOST_LEASE_TIMEOUT * 1000:.0f} ms")
+    print(f"  {moved_num} steps leased again after {moved * 1000:.0f} ms, every task done after {done * 1000:.0f} ms, "
+          f"{success_num} of {LOST_TASK_NUM} succeeded")
+    print(f"autoscaler, {SCALE_AGENT_NUM} agents, {SCALE_TASK_NUM} steps of one llm call")
+    fixed, _, _ = bench_autoscale(FakeEndpoint(SLOW_LLM_LATENCY), 4)
+    scaled, _, metrics = bench_autoscale(FakeEndpoint(SLOW_LLM_LATENCY))
+    print(f"  slow llm, {SLOW_LLM_LATENCY * 1000:.0f} ms per call: fixed pool of 4 {fixed:.0f} tasks/s, "
+          f"autoscaled {scaled:.0f} tasks/s, peak size {max(decision['to'] for decision in metrics['history'])}, "
+          f"decisions {metrics['reason_count']}")
+    fixed, fixed_limit, _ = bench_autoscale(FakeEndpoint(THROTTLE_LLM_LATENCY, THROTTLE_CAPACITY), SCALE_AGENT_NUM)
+    scaled, scaled_limit, metrics = bench_autoscale(FakeEndpoint(THROTTLE_LLM_LATENCY, THROTTLE_CAPACITY))
+    print(f"  llm serving {THROTTLE_CAPACITY} calls at once: fixed pool of {SCALE_AGENT_NUM} {fixed:.0f} tasks/s, "
+          f"{fixed_limit} 429s, autoscaled {scaled:.0f} tasks/s, {scaled_limit} 429s, decisions {metrics['reason_count']}")
+    total, peak_thread = bench_async()
+    print(f"asyncio mode, {ASYNC_AGENT_NUM} agents, {ASYNC_STEP_TIME * 1000:.0f} ms per step")
+    print(f"  total time: {total:.2f} s, steps: {len(FakeAgent.step_log)}, peak threads: {peak_thread}")
+
+
+if __name__ == "__main__":
+    main()
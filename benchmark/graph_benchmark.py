@@ -0,0 +1,101 @@
+import sys
+import os
+import time
+import random
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+
+'''
+Benchmark of the adjacency indexed Graph against the previous edge-list storage.
+
+usage: python benchmark/graph_benchmark.py
+'''
+
+SIZES = [100, 1000, 10000]
+EDGE_PER_NODE = 2
+SAMPLE_NUM = 200  # the edge-list graph is too slow to query every node at 10k
+
+
+class EdgeListGraph:
+    # the previous storage of Graph, every lookup scans the whole edge list
+    def __init__(self):
+        self.vertex = []
+        self.edge = []
+
+    def add_node(self, node: Task):
+        if node not in self.vertex:
+            self.vertex.append(node)
+
+    def add_edge(self, start_node: Task, end_node: Task):
+        if (start_node, end_node) not in self.edge:
+            self.edge.append((start_node, end_node))
+
+    def get_node_from(self, node: Task):
+        return [edge[1] for edge in self.edge if edge[0] == node]
+
+    def get_node_to(self, node: Task):
+        return [edge[0] for edge in self.edge if edge[1] == node]
+
+
+def random_dag(node_num: int, seed: int = 0):
+    rng = random.Random(seed)
+    node_list = [Task(f"task {i}", {}) for i in range(node_num)]
+    edge_list = []
+    for i in range(1, node_num):
+        for _ in range(EDGE_PER_NODE):
+            edge_list.append((node_list[rng.randrange(i)], node_list[i]))
+    return node_list, edge_list
+
+
+def per_op(func, args_list) -> float:
+    start_time = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - start_time) / max(len(args_list), 1)
+
+
+def bench(graph_class, node_list, edge_list, sample_node, sample_edge) -> dict:
+    graph = graph_class()
+    for node in node_list:
+        graph.add_node(node)
+    if graph_class is EdgeListGraph:
+        # skip the quadratic duplicate check while building, it is sampled below
+        graph.edge = list(edge_list)
+    else:
+        for edge in edge_list:
+            graph.add_edge(*edge)
+
+    return {
+        "add_edge": per_op(graph.add_edge, sample_edge),
+        "get_node_from": per_op(graph.get_node_from, [(node,) for node in sample_node]),
+        "get_node_to": per_op(graph.get_node_to, [(node,) for node in sample_node]),
+        # entry detection calls get_node_to for every vertex
+        "get_entry_node": per_op(graph.get_node_to, [(node,) for node in sample_node]) * len(node_list),
+    }
+
+
+def main():
+    print(f"{'nodes':>7} {'operation':>15} {'edge list (us)':>15} {'indexed (us)':>13} {'speedup':>9}")
+    for node_num in SIZES:
+        node_list, edge_list = random_dag(node_num)
+        rng = random.Random(node_num)
+        sample_node = rng.sample(node_list, min(SAMPLE_NUM, node_num))
+        sample_edge = [(rng.choice(node_list), rng.choice(node_list)) for _ in range(SAMPLE_NUM)]
+
+        legacy = bench(EdgeListGraph, node_list, edge_list, sample_node, sample_edge)
+        indexed = bench(Graph, node_list, edge_list, sample_node, sample_edge)
+        # measure the real entry detection of the indexed graph instead of the estimate
+        graph = Graph()
+        for node in node_list:
+            graph.add_node(node)
+        for edge in edge_list:
+            graph.add_edge(*edge)
+        indexed["get_entry_node"] = per_op(graph.get_entry_node, [()])
+
+        for op in legacy.keys():
+            print(f"{node_num:>7} {op:>15} {legacy[op] * 1e6:>15.2f} {indexed[op] * 1e6:>13.2f} "
+                  f"{legacy[op] / max(indexed[op], 1e-9):>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sys
+import os
+import time
+import uuid
+import weakref
+import tracemalloc
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+
+'''
+Benchmark of the slotted Task against the previous __dict__ Task with uuid4 ids and string status.
+
+usage: python benchmark/task_benchmark.py
+'''
+
+TASK_NUM = 100000
+
+
+class DictTask:
+    # the previous Task, copy aliases the lists of the original
+    def __init__(self, name: str, content: dict):
+        self._graphs = weakref.WeakSet()
+        self.id = str(uuid.uuid4())
+        self.content = content
+        self.parent_task_list = []
+        self.predecessor_task_list = []
+        self.description = name
+        self.goal = None
+        self.criticism = None
+        self.milestones = []
+        self.status = "unknown"
+        self.candidate_list = []
+        self.number = 1
+        self.available = True
+        self.reflect = None
+
+        self._pre_idxs = []
+        self._agent = []
+        self._summary = ["running"]
+        self._direct_pre_task_list = []
+
+    @property
+    def status(self) -> str:
+        return self._status
+
+    @status.setter
+    def status(self, status: str):
+        old_status = getattr(self, "_status", None)
+        self._status = status
+        if old_status is not None and old_status != status:
+            for graph in list(self._graphs):
+                graph._on_status_change(self, old_status, status)
+
+    def copy(self):
+        new_task = DictTask(self.description, self.content)
+        new_task.parent_task_list = self.parent_task_list
+        new_task.predecessor_task_list = self.predecessor_task_list
+        new_task.goal = self.goal
+        new_task.criticism = self.criticism
+        new_task.milestones = self.milestones
+        new_task.status = self.status
+        new_task.candidate_list = self.candidate_list
+        new_task.number = self.number
+        new_task.available = self.available
+        new_task.reflect = self.reflect
+        return new_task
+
+
+def make_task_list(task_class) -> list:
+    task_list = []
+    for idx in range(TASK_NUM):
+        task = task_class(f"task {idx}", {})
+        task.milestones = ["reach the site", "report"]
+        task.candidate_list = ["emergency_rescue_agent", "medical_rescue_agent"]
+        task_list.append(task)
+    return task_list
+
+
+def bench(task_class) -> dict:
+    result = {}
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    task_list = make_task_list(task_class)
+    result["create (us)"] = (time.perf_counter() - start_time) / TASK_NUM * 1e6
+    result["memory (byte)"] = tracemalloc.get_traced_memory()[0] / TASK_NUM
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    copy_list = [task.copy() for task in task_list]
+    result["copy (us)"] = (time.perf_counter() - start_time) / TASK_NUM * 1e6
+
+    start_time = time.perf_counter()
+    for task in copy_list:
+        task.status = "running"
+        task.status = "success"
+    result["set status (us)"] = (time.perf_counter() - start_time) / TASK_NUM / 2 * 1e6
+
+    start_time = time.perf_counter()
+    for task in copy_list:
+        task.status == "success"
+    result["read status (us)"] = (time.perf_counter() - start_time) / TASK_NUM * 1e6
+
+    # a collaborative copy rewriting its milestones must leave the original alone
+    original = task_list[0]
+    copy_task = original.copy()
+    copy_task.milestones.append("decomposed for one agent")
+    # and a list the caller still holds must not reach a later copy through that reference
+    milestones = original.milestones
+    copy_task = original.copy()
+    milestones.append("changed after the copy")
+    result["copy isolated"] = len(copy_task.milestones) == 2 and len(original.milestones) == 3
+    return result
+
+
+def main():
+    legacy = bench(DictTask)
+    slotted = bench(Task)
+    print(f"{TASK_NUM} tasks")
+    print(f"{'metric':>18} {'dict task':>12} {'slotted task':>13}")
+    for key in legacy.keys():
+        print(f"{key:>18} {str(round(legacy[key], 3)):>12} {str(round(slotted[key], 3)):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import sys
+import os
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+from type_define.assign_matcher import AssignMatcher
+
+
+def make_task(name: str, candidate_list: [str], number: int = 1) -> Task:
+    task = Task(name, {})
+    task.candidate_list = candidate_list
+    task.number = number
+    return task
+
+
+class AssignMatcherTest(unittest.TestCase):
+    '''
+    The matcher answers only when the candidate lists leave one valid assignment, otherwise the llm chooses
+    '''
+    def setUp(self):
+        self.matcher = AssignMatcher()
+
+    def test_single_candidates(self):
+        first, second = make_task("first", ["a"]), make_task("second", ["b"])
+        self.assertEqual(self.matcher.match([first, second], ["a", "b"]), [(first, ["a"]), (second, ["b"])])
+
+    def test_nothing_assignable(self):
+        task = make_task("task", ["a", "b"], number=2)
+        self.assertEqual(self.matcher.match([task], ["a"]), [])
+        self.assertEqual(self.matcher.match([make_task("none", [], number=0)], ["a"]), [])
+
+    def test_choice_of_agent_is_ambiguous(self):
+        self.assertIsNone(self.matcher.match([make_task("task", ["a", "b"])], ["a", "b"]))
+
+    def test_all_or_none(self):
+        # the pair needs both agents, taking one of them would leave it half staffed
+        pair = make_task("pair", ["a", "b"], number=2)
+        solo = make_task("solo", ["b"])
+        self.assertEqual(self.matcher.match([pair, solo], ["a", "b"]), [(pair, ["a", "b"])])
+
+    def test_augmenting_path_moves_earlier_task(self):
+        # first takes a, second only fits a, so first moves to b and both are served
+        first = make_task("first", ["a", "b"])
+        second = make_task("second", ["a"])
+        self.assertEqual(self.matcher.match([first, second], ["a", "b"]), [(first, ["b"]), (second, ["a"])])
+
+    def test_alternating_cycle_is_ambiguous(self):
+        first = make_task("first", ["a", "b"])
+        second = make_task("second", ["a", "b"])
+        self.assertIsNone(self.matcher.match([first, second], ["a", "b"]))
+
+    def test_duplicate_candidates(self):
+        task = make_task("task", ["a", "a"])
+        self.assertEqual(self.matcher.match([task], ["a"]), [(task, ["a"])])
+
+    def test_left_out_task_of_same_rank(self):
+        first, second = make_task("first", ["a"]), make_task("second", ["a"])
+        self.assertIsNone(self.matcher.match([first, second], ["a"], rank=lambda task: 0))
+        rank = {first: 0, second: 1}
+        self.assertEqual(self.matcher.match([first, second], ["a"], rank=rank.get), [(first, ["a"])])
+
+
+if __name__ == "__main__":
+    unittest.main()
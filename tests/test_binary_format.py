@@ -0,0 +1,88 @@
+import sys
+import os
+import io
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+from type_define.binary_format import BinaryWriter, BinaryReader, dump_graph, load_graph, iter_graph, GRAPH
+from type_define.task_summary_tree import TaskSummaryTree
+
+
+def plan_graph() -> Graph:
+    # a diamond with a parent task outside the graph and values of every tag
+    parent = Task("rescue the district", {})
+    task_list = [Task(f"task {idx}", {}) for idx in range(4)]
+    for idx, task in enumerate(task_list):
+        task.parent_task_list = [parent]
+        task.number = idx + 1
+        task.candidate_list = ["firefighter", "medic"][:idx % 2 + 1]
+        task.milestones = [f"milestone {idx}", "report"]
+        task.reflect = {"score": 0.5 * idx, "done": idx % 2 == 0, "note": None}
+    task_list[0].status = Task.success
+    task_list[1].status = Task.running
+    task_list[2].status = Task.failure
+    task_list[3].predecessor_task_list = [task_list[1], task_list[2]]
+    graph = Graph()
+    for task in task_list:
+        graph.add_node(task)
+    for start, end in [(0, 1), (0, 2), (1, 3), (2, 3)]:
+        graph.add_edge(task_list[start], task_list[end])
+    return graph
+
+
+class BinaryFormatTest(unittest.TestCase):
+    def test_value_round_trip(self):
+        value = [None, True, False, 0, 300, -7, 2 ** 70, 1.25, "", "é", "é", [[]], {"key": ["key", 1]}]
+        stream = io.BytesIO()
+        writer = BinaryWriter(stream, GRAPH)
+        writer.write_record(1, value)
+        writer.close()
+        stream.seek(0)
+        reader = BinaryReader(stream, GRAPH)
+        self.assertEqual(reader.read_record(), (1, value))
+        self.assertIsNone(reader.read_record()[1])
+
+    def test_graph_round_trip(self):
+        graph = plan_graph()
+        stream = io.BytesIO()
+        dump_graph(graph, stream)
+        stream.seek(0)
+        loaded = load_graph(stream)
+        self.assertEqual([node.to_json() for node in loaded.vertex], [node.to_json() for node in graph.vertex])
+        self.assertEqual([node.id for node in loaded.vertex], [node.id for node in graph.vertex])
+        self.assertEqual([(start.id, end.id) for start, end in loaded.edge],
+                         [(start.id, end.id) for start, end in graph.edge])
+        # the predecessors are the loaded tasks, the parent outside the graph is one shared stub
+        node_list = loaded.vertex
+        self.assertEqual(node_list[3].predecessor_task_list, [node_list[1], node_list[2]])
+        self.assertEqual(len({id(node.parent_task_list[0]) for node in node_list}), 1)
+
+    def test_streamed_records(self):
+        stream = io.BytesIO()
+        dump_graph(plan_graph(), stream)
+        stream.seek(0)
+        kind_list = [kind for kind, _ in iter_graph(stream)]
+        self.assertEqual(kind_list, ["node"] * 4 + ["edge"] * 4)
+
+    def test_wrong_kind(self):
+        stream = io.BytesIO()
+        dump_graph(plan_graph(), stream)
+        stream.seek(0)
+        with self.assertRaises(ValueError):
+            TaskSummaryTree().load_from_binary(stream)
+
+    def test_summary_tree_round_trip(self):
+        tree = TaskSummaryTree()
+        tree.insert_action_list(["move", "extinguish"], "put out the fire", True)
+        tree.insert_action_list(["move", "treat"], "treat the injured", False)
+        stream = io.BytesIO()
+        tree.to_binary(stream)
+        stream.seek(0)
+        loaded = TaskSummaryTree()
+        loaded.load_from_binary(stream)
+        self.assertEqual(loaded.to_json(), tree.to_json())
+        self.assertEqual(loaded.get_action_list("treat the injured"), (["move", "treat"], False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import sys
+import os
+import random
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+from type_define.csr_graph import CSRGraph
+
+
+def random_graph(node_num: int, seed: int) -> Graph:
+    # a random DAG whose tasks have random statuses, edges added in a shuffled order
+    rng = random.Random(seed)
+    graph = Graph()
+    task_list = [Task(f"task {idx}", {}) for idx in range(node_num)]
+    for task in task_list:
+        graph.add_node(task)
+    edge_list = [(rng.randrange(end), end) for end in range(1, node_num) for _ in range(rng.randrange(3))]
+    rng.shuffle(edge_list)
+    for start, end in edge_list:
+        graph.add_edge(task_list[start], task_list[end])
+    for task in task_list:
+        task.status = rng.choice([Task.unknown, Task.unknown, Task.running, Task.success, Task.failure])
+    return graph
+
+
+class CSRGraphParityTest(unittest.TestCase):
+    '''
+    CSRGraph is a drop-in backend of TaskManager, it must answer like Graph on the same tasks
+    '''
+    def test_topological_order(self):
+        for seed in range(20):
+            graph = random_graph(60, seed)
+            self.assertEqual(CSRGraph.from_graph(graph).get_topological_order(), graph.get_topological_order())
+
+    def test_open_task_list(self):
+        for seed in range(20):
+            graph = random_graph(60, seed)
+            expected = [(task, list(task.predecessor_task_list)) for task in graph.get_open_task_list()]
+            # small blocks, the ancestors of a task come from several of them
+            csr_graph = CSRGraph.from_graph(graph)
+            node, ancestor = csr_graph.get_open_ancestor(block_size=8)
+            self.assertEqual(sorted(zip(node.tolist(), ancestor.tolist())), list(zip(node.tolist(), ancestor.tolist())))
+            actual = [(task, list(task.predecessor_task_list)) for task in csr_graph.get_open_task_list()]
+            self.assertEqual(actual, expected)
+
+    def test_ready_and_completion(self):
+        for seed in range(20):
+            graph = random_graph(60, seed)
+            csr_graph = CSRGraph.from_graph(graph)
+            self.assertEqual(csr_graph._to_task(csr_graph.get_ready_id()), graph.get_ready_node())
+            self.assertEqual(csr_graph.check_graph_completion(), graph.check_graph_completion())
+
+    def test_completion_after_success(self):
+        graph = random_graph(30, 0)
+        for task in graph.vertex:
+            task.status = Task.success
+        self.assertTrue(CSRGraph.from_graph(graph).check_graph_completion())
+        self.assertTrue(graph.check_graph_completion())
+
+    def test_graph_round_trip(self):
+        graph = random_graph(40, 1)
+        copy = CSRGraph.from_graph(graph).to_graph()
+        self.assertEqual(copy.vertex, graph.vertex)
+        self.assertEqual(set(copy.edge), set(graph.edge))
+
+
+if __name__ == "__main__":
+    unittest.main()
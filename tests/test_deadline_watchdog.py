@@ -0,0 +1,102 @@
+import sys
+import os
+import time
+import threading
+import unittest
+sys.path.append(os.getcwd())
+from type_define.deadline_watchdog import DeadlineWatchdog, CancelToken, StepCancelled, StepPool
+
+
+class DeadlineWatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = DeadlineWatchdog("TestWatchdog")
+
+    def tearDown(self):
+        self.watchdog.close()
+
+    def test_fires_in_deadline_order(self):
+        fired = []
+        done = threading.Event()
+        now = time.time()
+        self.watchdog.schedule("late", now + 0.1, lambda: (fired.append("late"), done.set()))
+        self.watchdog.schedule("early", now + 0.05, lambda: fired.append("early"))
+        self.assertTrue(done.wait(2.0))
+        self.assertEqual(fired, ["early", "late"])
+        self.assertEqual(len(self.watchdog), 0)
+
+    def test_cancel_and_reschedule(self):
+        fired = []
+        done = threading.Event()
+        now = time.time()
+        self.watchdog.schedule("cancelled", now + 0.05, lambda: fired.append("cancelled"))
+        self.assertTrue(self.watchdog.cancel("cancelled"))
+        self.assertFalse(self.watchdog.cancel("cancelled"))
+        # only the new deadline of a key scheduled again counts
+        self.watchdog.schedule("moved", now + 0.05, lambda: fired.append("first"))
+        self.watchdog.schedule("moved", now + 0.1, lambda: (fired.append("second"), done.set()))
+        self.assertTrue(done.wait(2.0))
+        self.assertEqual(fired, ["second"])
+
+    def test_failing_callback_keeps_the_thread(self):
+        done = threading.Event()
+        with self.assertLogs("type_define.deadline_watchdog", level="ERROR"):
+            now = time.time()
+            self.watchdog.schedule("failing", now, lambda: 1 / 0)
+            self.watchdog.schedule("next", now + 0.05, done.set)
+            self.assertTrue(done.wait(2.0))
+
+
+class CancelTokenTest(unittest.TestCase):
+    def test_cancelled_step_stops_at_checkpoint(self):
+        token = CancelToken()
+        token.check()
+        threading.Timer(0.05, token.cancel, args=("timeout",)).start()
+        start_time = time.time()
+        self.assertTrue(token.wait(5.0))
+        self.assertLess(time.time() - start_time, 2.0)
+        with self.assertRaises(StepCancelled):
+            token.check()
+        token.cancel("again")
+        self.assertEqual(token.reason, "timeout")
+
+
+class StepPoolTest(unittest.TestCase):
+    def test_stuck_thread_replaced(self):
+        pool = StepPool(1)
+        release = threading.Event()
+        stuck = pool.submit(release.wait)
+        while not stuck.running():
+            time.sleep(0.01)
+        self.assertTrue(pool.replace(stuck))
+        self.assertFalse(pool.replace(stuck))
+        # the next step runs on the new thread while the stuck one still holds its thread
+        self.assertEqual(pool.submit(lambda: "next").result(timeout=2.0), "next")
+        self.assertFalse(stuck.done())
+        release.set()
+        self.assertTrue(stuck.result(timeout=2.0))
+        self.assertEqual(pool.replace_count, 1)
+        pool.shutdown(wait=True)
+
+    def test_threads_on_demand_and_exceptions(self):
+        pool = StepPool(2)
+        self.assertEqual([pool.submit(pow, 2, idx).result(timeout=2.0) for idx in range(4)], [1, 2, 4, 8])
+        self.assertLessEqual(len(pool._thread), 2)
+        with self.assertRaises(ZeroDivisionError):
+            pool.submit(lambda: 1 / 0).result(timeout=2.0)
+        pool.shutdown(wait=True)
+        with self.assertRaises(RuntimeError):
+            pool.submit(pow, 2, 2)
+
+    def test_shutdown_cancels_queued_steps(self):
+        pool = StepPool(1)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(pow, 2, 2)
+        threading.Timer(0.05, release.set).start()
+        pool.shutdown(wait=True, cancel_futures=True)
+        self.assertTrue(running.result())
+        self.assertTrue(queued.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
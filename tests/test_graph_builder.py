@@ -0,0 +1,60 @@
+import sys
+import os
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+
+
+def plan(pre_idxs_list: [[int]]) -> [Task]:
+    task_list = [Task(f"task {idx}", {}) for idx in range(len(pre_idxs_list))]
+    for task, pre_idxs in zip(task_list, pre_idxs_list):
+        task._pre_idxs = pre_idxs
+    return task_list
+
+
+def edge_index(graph: Graph, task_list: [Task]) -> set:
+    index = {task: idx + 1 for idx, task in enumerate(task_list)}
+    return {(index[start], index[end]) for start, end in graph.edge}
+
+
+class FromDependencyTest(unittest.TestCase):
+    '''
+    Graph.from_dependency builds the plan graph in one pass and reports what is wrong with the plan
+    '''
+    def test_valid_plan(self):
+        task_list = plan([[], [1], [], [2, 3]])
+        graph, diagnostics = Graph.from_dependency(task_list)
+        self.assertTrue(diagnostics.valid)
+        # a task without dependency runs in parallel with the previous task
+        self.assertEqual(edge_index(graph, task_list), {(1, 2), (1, 3), (2, 4), (3, 4)})
+        self.assertEqual(graph.get_topological_order(), task_list)
+
+    def test_bad_indexes(self):
+        task_list = plan([[], [1, 1, 2, 7, 0, "1"]])
+        graph, diagnostics = Graph.from_dependency(task_list)
+        self.assertEqual(diagnostics.duplicate, [(2, 1)])
+        self.assertEqual(diagnostics.self_loop, [2])
+        self.assertEqual(diagnostics.dangling, [(2, 7), (2, 0), (2, "1")])
+        self.assertFalse(diagnostics.valid)
+        self.assertEqual(edge_index(graph, task_list), {(1, 2)})
+
+    def test_cycle_reported(self):
+        task_list = plan([[], [1, 4], [2], [3], [4]])
+        graph, diagnostics = Graph.from_dependency(task_list)
+        self.assertEqual(sorted(diagnostics.cycle), [2, 3, 4])
+        self.assertEqual(diagnostics.dropped, [])
+        self.assertFalse(diagnostics.valid)
+        # the cycle stays and the tasks on or behind it are left out of the order
+        self.assertEqual(graph.get_topological_order(), task_list[:1])
+
+    def test_cycles_dropped(self):
+        task_list = plan([[3], [1], [2], [5], [4]])
+        graph, diagnostics = Graph.from_dependency(task_list, drop_cycles=True)
+        # each cycle loses the dependency on the latest task of the plan order
+        self.assertEqual(sorted(diagnostics.dropped), [(1, 3), (4, 5)])
+        self.assertEqual(edge_index(graph, task_list), {(1, 2), (2, 3), (4, 5)})
+        self.assertEqual(len(graph.get_topological_order()), len(task_list))
+
+
+if __name__ == "__main__":
+    unittest.main()
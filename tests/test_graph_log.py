@@ -0,0 +1,76 @@
+import sys
+import os
+import tempfile
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+from type_define.graph_log import GraphMutationLog, GraphDelta
+
+
+def chain_graph(node_num: int, mutation_log: GraphMutationLog) -> (Graph, [Task]):
+    graph = Graph()
+    graph.attach_log(mutation_log)
+    task_list = [Task(f"task {idx}", {}) for idx in range(node_num)]
+    for task in task_list:
+        graph.add_node(task)
+    for start, end in zip(task_list, task_list[1:]):
+        graph.add_edge(start, end)
+    return graph, task_list
+
+
+def same_graph(graph: Graph, other: Graph) -> bool:
+    edge = {(start.id, end.id) for start, end in graph.edge}
+    other_edge = {(start.id, end.id) for start, end in other.edge}
+    status = {node.id: node.status for node in graph.vertex}
+    other_status = {node.id: node.status for node in other.vertex}
+    return edge == other_edge and status == other_status
+
+
+class GraphMutationLogTest(unittest.TestCase):
+    def test_memory_keeps_deltas_since_snapshot(self):
+        mutation_log = GraphMutationLog(snapshot_interval=10)
+        graph, task_list = chain_graph(30, mutation_log)
+        self.assertEqual(mutation_log.deltas[0].op, GraphDelta.snapshot)
+        self.assertLessEqual(len(mutation_log.deltas), 10)
+        self.assertTrue(same_graph(mutation_log.rebuild(), graph))
+        with self.assertRaises(ValueError):
+            mutation_log.rebuild(1)
+
+    def test_buffered_until_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph_log.jsonl")
+            mutation_log = GraphMutationLog(path, snapshot_interval=50)
+            graph, task_list = chain_graph(5, mutation_log)
+            with open(path) as f:
+                line_num = len(f.readlines())
+            self.assertEqual(line_num, 1)  # the snapshot of attach_log only
+            mutation_log.close()
+            loaded = GraphMutationLog.load(path)
+            self.assertEqual(loaded.version, mutation_log.version)
+            self.assertTrue(same_graph(loaded.rebuild(), graph))
+
+    def test_old_version_read_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "graph_log.jsonl")
+            mutation_log = GraphMutationLog(path, snapshot_interval=10)
+            graph, task_list = chain_graph(4, mutation_log)
+            version = mutation_log.version
+            expected = mutation_log.rebuild()
+            for task in task_list + [Task("task 4", {}) for _ in range(20)]:
+                if not graph.has_node(task):
+                    graph.add_node(task)
+                task.status = Task.success
+            self.assertTrue(same_graph(mutation_log.rebuild(version), expected))
+            mutation_log.close()
+
+    def test_graphs_sharing_a_log(self):
+        mutation_log = GraphMutationLog(snapshot_interval=10)
+        graph, _ = chain_graph(3, mutation_log)
+        other, _ = chain_graph(25, mutation_log)
+        self.assertEqual({delta.graph_id for delta in mutation_log.deltas}, {graph.id, other.id})
+        self.assertTrue(same_graph(mutation_log.rebuild(graph_id=graph.id), graph))
+        self.assertTrue(same_graph(mutation_log.rebuild(), other))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import sys
+import os
+import threading
+import unittest
+sys.path.append(os.getcwd())
+from LLM.call_stats import LLMCallStats
+from type_define.pool_autoscaler import PoolAutoscaler, PoolLimit
+
+
+class PoolAutoscalerTest(unittest.TestCase):
+    def setUp(self):
+        self.llm_stats = LLMCallStats()
+        self.autoscaler = PoolAutoscaler(min_workers=2, max_workers=16, interval=1.0, window=10.0, cooldown=5.0,
+                                         scale_down_delay=3.0, llm_stats=self.llm_stats)
+
+    def test_interval_between_decisions(self):
+        self.assertIsNotNone(self.autoscaler.decide(2, 0, 0, now=100.0))
+        self.assertIsNone(self.autoscaler.decide(2, 0, 0, now=100.5))
+        self.assertIsNotNone(self.autoscaler.decide(2, 0, 0, now=101.0))
+
+    def test_grows_to_the_demand(self):
+        decision = self.autoscaler.decide(2, 10, 2, now=100.0)
+        self.assertEqual((decision["to"], decision["reason"]), (3, "queue"))
+        decision = self.autoscaler.decide(3, 10, 3, now=101.0)
+        self.assertEqual(decision["to"], 5)
+        decision = self.autoscaler.decide(12, 40, 12, now=102.0)
+        self.assertEqual(decision["to"], 16)  # bounded by max_workers
+
+    def test_rate_limit_backs_off_then_grows_slowly(self):
+        self.llm_stats.add_rate_limit(now=99.0)
+        decision = self.autoscaler.decide(8, 20, 8, now=100.0)
+        self.assertEqual((decision["to"], decision["reason"]), (4, "rate limited"))
+        # the same 429 is not counted again, no growth during the cooldown
+        decision = self.autoscaler.decide(4, 20, 4, now=101.0)
+        self.assertEqual((decision["to"], decision["reason"]), (4, "rate limit cooldown"))
+        decision = self.autoscaler.decide(4, 20, 4, now=106.0)
+        self.assertEqual((decision["to"], decision["reason"]), (5, "queue"))
+
+    def test_saturated_llm_keeps_the_size(self):
+        for now in range(90, 100):
+            self.llm_stats.add_latency(1.0, now=now)
+        self.autoscaler.decide(4, 4, 0, now=100.0)
+        for now in range(101, 111):
+            self.llm_stats.add_latency(5.0, now=now)
+        decision = self.autoscaler.decide(4, 20, 4, now=111.0)
+        self.assertEqual((decision["to"], decision["reason"]), (4, "llm saturated"))
+
+    def test_shrinks_after_delay(self):
+        decision = self.autoscaler.decide(8, 1, 2, now=100.0)
+        self.assertEqual((decision["to"], decision["reason"]), (8, "idle, waiting"))
+        decision = self.autoscaler.decide(8, 1, 2, now=103.0)
+        self.assertEqual((decision["to"], decision["reason"]), (3, "idle"))
+        metrics = self.autoscaler.metrics()
+        self.assertEqual((metrics["size"], metrics["decisions"], metrics["resizes"]), (3, 2, 1))
+        self.assertEqual(metrics["reason_count"], {"idle, waiting": 1, "idle": 1})
+
+    def test_bounds(self):
+        with self.assertRaises(ValueError):
+            PoolAutoscaler(min_workers=4, max_workers=2)
+
+
+class PoolLimitTest(unittest.TestCase):
+    def test_resize_and_close(self):
+        limit = PoolLimit(1)
+        self.assertTrue(limit.acquire("first"))
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(limit.acquire("second")))
+        waiter.start()
+        waiter.join(0.05)
+        self.assertTrue(waiter.is_alive())
+        limit.resize(2)
+        waiter.join(2.0)
+        self.assertEqual(acquired, [True])
+        limit.release("first")
+        limit.release("first")
+        self.assertEqual(len(limit), 1)
+        limit.resize(1)
+        waiter = threading.Thread(target=lambda: acquired.append(limit.acquire("third")))
+        waiter.start()
+        waiter.join(0.05)
+        limit.close()
+        waiter.join(2.0)
+        self.assertEqual(acquired, [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+import os
+import unittest
+sys.path.append(os.getcwd())
+from type_define.deadline_watchdog import CancelToken, StepCancelled
+from CityPipe.process_backend import ControllerServer, ControllerClient, RemoteObject, WorkerCancelToken, \
+    setup_worker, run_step
+
+
+class CounterEnv:
+    # stands for MultiAgentEnvironment, step runs in the worker and counts in the controller
+    def __init__(self):
+        self.count = 0
+        self.agent_pool = []
+
+    def add(self, number: int) -> int:
+        self.count += number
+        return self.count
+
+    def fail(self):
+        raise KeyError("missing")
+
+    def _secret(self):
+        return "secret"
+
+    def step(self, name: str, number: int) -> (str, int):
+        return name, self.add(number)
+
+
+class CounterAgent:
+    # stands for the agent class of the controller
+    env = None
+
+    def __init__(self, llm, env, data_manager, name: str, agent_type: str, silent: bool):
+        self.llm = llm
+        self.env = env
+        self.name = name
+        self.history_action_list = []
+
+    def step(self, task, cancel_token=None):
+        if cancel_token is not None:
+            cancel_token.check()
+        return self.env.step(self.name, task)
+
+
+class ProcessBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.env = CounterEnv()
+        self.server = ControllerServer(data_manager=None, env=self.env)
+        self.client = ControllerClient(self.server.address, self.server.authkey)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_call_and_read(self):
+        env = RemoteObject(self.client.call, "env")
+        self.assertEqual(env.add(2), 2)
+        self.assertEqual(self.client.call("env", "count", None, None), 2)
+        self.assertEqual(self.env.count, 2)
+
+    def test_private_and_errors(self):
+        with self.assertRaises(AttributeError):
+            self.client.call("env", "_secret", (), {})
+        with self.assertRaises(AttributeError):
+            self.client.call("missing", "add", (1,), {})
+        with self.assertRaises(KeyError):
+            self.client.call("env", "fail", (), {})
+        self.assertEqual(self.client.call("env", "add", (1,), {}), 1)  # the connection is still usable
+
+    def test_step_runs_on_the_controller_env(self):
+        setup_worker(CounterAgent, lambda config: None, {}, CounterEnv, [], self.client.call, True)
+        self.assertEqual(run_step("agent 0", "police", [], 3), ("agent 0", 3))
+        self.assertEqual(run_step("agent 1", "police", [], 4), ("agent 1", 7))
+        self.assertEqual(self.env.count, 7)
+
+    def test_cancel_token(self):
+        token = CancelToken()
+        token_id = self.server.tokens.add(token)
+        worker_token = WorkerCancelToken(self.client.call, token_id)
+        self.assertFalse(worker_token.cancelled)
+        self.assertFalse(worker_token.wait(0.01))
+        token.cancel("timeout")
+        self.assertTrue(worker_token.wait(1.0))
+        with self.assertRaises(StepCancelled):
+            worker_token.check()
+        self.assertEqual(worker_token.reason, "timeout")
+        setup_worker(CounterAgent, lambda config: None, {}, CounterEnv, [], self.client.call, True)
+        with self.assertRaises(StepCancelled):
+            run_step("agent 0", "police", [], 1, token_id=token_id)
+        self.server.tokens.remove(token_id)
+        self.assertIsNone(self.server.tokens.reason(token_id))
+        self.assertEqual(self.env.count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
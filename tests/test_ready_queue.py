@@ -0,0 +1,54 @@
+import sys
+import os
+import unittest
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+from type_define.ready_queue import ReadyQueue
+
+
+def make_task(name: str, priority: int = None) -> Task:
+    task = Task(name, {})
+    task.priority = priority
+    return task
+
+
+class ReadyQueueTest(unittest.TestCase):
+    def test_priority_class_first(self):
+        low, urgent, unclassified = make_task("low", 3), make_task("urgent", 1), make_task("unclassified")
+        queue = ReadyQueue()
+        queue.update([unclassified, low, urgent], now=0.0)
+        self.assertEqual(queue.order(), [urgent, low, unclassified])
+        self.assertEqual(queue.rank(unclassified), (4, 0.0))
+
+    def test_slack_then_waiting_time(self):
+        early, tight, late = make_task("early", 1), make_task("tight", 1), make_task("late", 1)
+        queue = ReadyQueue()
+        queue.update([early], now=0.0)
+        queue.update([late, tight, early], slack={tight: 0.0, early: 5.0, late: 5.0}, now=1.0)
+        self.assertEqual(queue.order(), [tight, early, late])
+
+    def test_aging_lifts_waiting_tasks(self):
+        old, new = make_task("old", 3), make_task("new", 2)
+        for aging_interval, order in [(None, [new, old]), (10.0, [old, new])]:
+            queue = ReadyQueue(aging_interval=aging_interval)
+            queue.update([old], now=0.0)
+            queue.update([old, new], now=24.0)
+            self.assertEqual(queue.order(), order)
+        self.assertEqual(queue.rank(old), (1, 0.0))
+
+    def test_pop_and_finished_tasks(self):
+        first, second = make_task("first", 1), make_task("second", 2)
+        queue = ReadyQueue()
+        queue.update([first, second], now=0.0)
+        self.assertEqual(queue.pop(), first)
+        self.assertEqual(len(queue), 1)
+        # a task no longer ready leaves the queue and starts waiting anew when it comes back
+        queue.update([second], now=1.0)
+        queue.update([first, second], now=2.0)
+        self.assertEqual(queue.order(), [first, second])
+        queue.update([], now=3.0)
+        self.assertIsNone(queue.peek())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import sys
+import os
+import tempfile
+import threading
+import unittest
+sys.path.append(os.getcwd())
+from type_define.deadline_watchdog import StepCancelled
+from CityPipe.process_backend import run_step
+from CityPipe.remote_backend import RemoteWorkerPool, RemoteWorker, parse_address
+from test_process_backend import CounterEnv, CounterAgent
+
+
+def make_llm(config: dict):
+    return None
+
+
+def wait_step(timeout: float, cancel_token=None):
+    # a long step that ends at its checkpoint once cancelled
+    cancel_token.wait(timeout)
+    cancel_token.check()
+    return "finished"
+
+
+class RemoteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.env = CounterEnv()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def start(self, address) -> (RemoteWorkerPool, threading.Thread):
+        init = {"agent_class": CounterAgent, "llm_factory": make_llm, "llm_config": {}, "env_class": CounterEnv,
+                "agent_pool": [], "silent": True}
+        pool = RemoteWorkerPool(address, init=init, target={"env": self.env, "data_manager": None})
+        worker = RemoteWorker(pool.address, pool.authkey, slots=2, heartbeat_interval=0.2)
+        thread = threading.Thread(target=worker.run, daemon=True)
+        thread.start()
+        self.assertTrue(pool.wait_for_workers(1, timeout=5.0))
+        return pool, thread
+
+    def stop(self, pool: RemoteWorkerPool, thread: threading.Thread):
+        pool.shutdown()
+        thread.join(5.0)
+        self.assertFalse(thread.is_alive())
+
+    def test_step_over_tcp(self):
+        pool, thread = self.start(("127.0.0.1", 0))
+        future_list = [pool.submit(run_step, f"agent {idx}", "police", [], idx + 1) for idx in range(3)]
+        result_list = [future.result(timeout=5.0) for future in future_list]
+        self.assertEqual(sorted(name for name, _ in result_list), ["agent 0", "agent 1", "agent 2"])
+        self.assertEqual(self.env.count, 6)  # the env calls of the steps reach the env of the controller
+        self.assertEqual(pool.stats()["worker"], 1)
+        self.stop(pool, thread)
+
+    def test_step_over_unix_socket(self):
+        path = os.path.join(self.directory.name, "pool.sock")
+        pool, thread = self.start(path)
+        self.assertEqual(pool.submit(run_step, "agent 0", "police", [], 5).result(timeout=5.0), ("agent 0", 5))
+        self.stop(pool, thread)
+        self.assertFalse(os.path.exists(path))
+
+    def test_cancel_leased_step(self):
+        pool, thread = self.start(("127.0.0.1", 0))
+        future = pool.submit(wait_step, 5.0)
+        while not future.running():
+            threading.Event().wait(0.01)
+        self.assertTrue(pool.cancel(future, "timeout"))
+        with self.assertRaises(StepCancelled):
+            future.result(timeout=2.0)
+        self.stop(pool, thread)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("10.0.0.1:7000"), ("10.0.0.1", 7000))
+        self.assertEqual(parse_address("/tmp/pool.sock"), "/tmp/pool.sock")
+
+
+if __name__ == "__main__":
+    unittest.main()
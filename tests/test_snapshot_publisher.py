@@ -0,0 +1,74 @@
+import sys
+import os
+import json
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+sys.path.append(os.getcwd())
+from type_define.snapshot_publisher import SnapshotPublisher, acquire_publisher, release_publisher, publish, write_snapshot
+
+
+class SnapshotPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "logs", "task_list.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, path: str = None):
+        with open(path or self.path) as f:
+            return json.load(f)
+
+    def test_unchanged_snapshot_is_not_written(self):
+        publisher = SnapshotPublisher()
+        self.assertTrue(publisher.publish(self.path, {"status": "running"}))
+        publisher.flush()
+        self.assertFalse(publisher.publish(self.path, {"status": "running"}))
+        self.assertTrue(publisher.publish(self.path, {"status": "success"}))
+        publisher.close()
+        self.assertEqual(self.read(), {"status": "success"})
+
+    def test_overflow_is_written_not_dropped(self):
+        publisher = SnapshotPublisher(max_pending=2)
+        path_list = [os.path.join(self.directory.name, f"snapshot_{idx}.json") for idx in range(10)]
+        resume = threading.Event()
+
+        def slow_write(path, data, indent=4):
+            if threading.current_thread() is publisher._thread:
+                resume.wait(5.0)  # the worker falls behind while the snapshots are published
+            write_snapshot(path, data, indent)
+
+        with mock.patch("type_define.snapshot_publisher.write_snapshot", slow_write):
+            threading.Timer(0.2, resume.set).start()
+            with self.assertLogs("type_define.snapshot_publisher", level="WARNING"):
+                for idx, path in enumerate(path_list):
+                    publisher.publish(path, {"idx": idx})
+            publisher.close()
+        self.assertEqual([self.read(path) for path in path_list], [{"idx": idx} for idx in range(10)])
+
+    def test_publish_without_owner_writes_at_once(self):
+        publish(self.path, {"owner": None})
+        self.assertEqual(self.read(), {"owner": None})
+        publisher = acquire_publisher()
+        publish(self.path, {"owner": "controller"})
+        release_publisher(publisher)  # the last owner writes what is pending
+        self.assertEqual(self.read(), {"owner": "controller"})
+
+    def test_listen(self):
+        publisher = SnapshotPublisher()
+        publisher.publish(self.path, {"version": 1})
+        publisher.flush()
+        address = publisher.listen()
+        with socket.create_connection(address, timeout=2.0) as client:
+            reader = client.makefile("r")
+            self.assertEqual(json.loads(reader.readline()), {"path": self.path, "snapshot": {"version": 1}})
+            publisher.publish(self.path, {"version": 2})
+            self.assertEqual(json.loads(reader.readline())["snapshot"], {"version": 2})
+        publisher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+
+
+class AssignMatcher:
+    '''
+    Deterministic assignment of free agents to available tasks, tried before asking the controller llm.
+
+    A task needs task.number agents of its candidate_list, it gets all of them or none.
+    Tasks are served in the order given (the ready queue order), a later task may move agents of an
+    earlier one to other candidates of it (augmenting path) but never takes its place.
+    The result is only returned when it is the one valid answer:
+    - no served task could use other agents, there is no alternating path from a served agent to a
+      free one and no alternating cycle between served agents
+    - no task left out ranks the same as a served task
+    otherwise match returns None and the llm chooses.
+    '''
+    def match(self, task_list: [Task], free_agent_list: [str], rank=None) -> [(Task, [str])]:
+        '''
+        task_list: available tasks, the most urgent first
+        free_agent_list: names of the free agents
+        rank: callable Task -> comparable, tasks of equal rank are equally urgent, None ranks every task apart
+        return: [(task, agent names)] in task_list order, [] if nothing can be assigned, None if ambiguous
+        '''
+        free_agent_set = set(free_agent_list)
+        eligible = {task: [name for name in dict.fromkeys(task.candidate_list) if name in free_agent_set]
+                    for task in task_list}
+        owner = {}  # agent name -> Task
+        assigned = {}  # Task -> [agent name]
+        left_out = []
+        for task in task_list:
+            if task.number <= 0 or len(eligible[task]) < task.number:
+                continue
+            backup = (dict(owner), {key: list(value) for key, value in assigned.items()})
+            for _ in range(task.number):
+                if not self._augment(task, eligible, owner, assigned, set()):
+                    owner, assigned = backup
+                    left_out.append(task)
+                    break
+
+        if rank is not None and left_out:
+            served_rank = {rank(task) for task in assigned}
+            if any(rank(task) in served_rank for task in left_out):
+                return None
+        if self._has_alternative(eligible, owner):
+            return None
+        return [(task, assigned[task]) for task in task_list if assigned.get(task)]
+
+    def _augment(self, task: Task, eligible: dict, owner: dict, assigned: dict, visited: set) -> bool:
+        # give task one more agent, an agent of another task moves only if that task finds a replacement
+        for name in eligible[task]:
+            if name in visited or owner.get(name) is task:
+                continue
+            visited.add(name)
+            other = owner.get(name)
+            if other is None or self._augment(other, eligible, owner, assigned, visited):
+                if other is not None:
+                    assigned[other].remove(name)
+                owner[name] = task
+                assigned.setdefault(task, []).append(name)
+                return True
+        return False
+
+    @staticmethod
+    def _has_alternative(eligible: dict, owner: dict) -> bool:
+        # a -> b when b could take the place of a in the task of a
+        # another assignment exists iff a served agent reaches a free agent or the served agents have a cycle
+        successor = {}
+        for name, task in owner.items():
+            successor[name] = [other for other in eligible[task] if owner.get(other) is not task]
+            if any(other not in owner for other in successor[name]):
+                return True
+        # served agents reach a free agent only through served agents, check them for a cycle
+        indegree = {name: 0 for name in owner}
+        for name in owner:
+            for other in successor[name]:
+                indegree[other] += 1
+        stack = [name for name, degree in indegree.items() if degree == 0]
+        visited = 0
+        while stack:
+            name = stack.pop()
+            visited += 1
+            for other in successor[name]:
+                indegree[other] -= 1
+                if indegree[other] == 0:
+                    stack.append(other)
+        return visited != len(owner)
@@ -0,0 +1,345 @@
+import sys
+import os
+import struct
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+
+'''
+Compact binary format of graphs and summary trees, written and read as a stream.
+
+The stream is a header followed by length framed records, so a reader only needs one record in memory.
+Values are tagged, ints are varints and every string is written once: the first time it is seen
+it goes into the string table inline, later occurrences are the varint index into that table.
+A graph is a list of node records followed by edge records, edges are pairs of node indexes.
+'''
+
+MAGIC = b"GBA\x01"
+GRAPH = 1
+SUMMARY_TREE = 2
+
+# value tags
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _NEW_STR, _LIST, _DICT = range(9)
+# record tags
+_END, _NODE, _EDGE, _TREE_NODE, _TREE_INFO = range(5)
+
+_FLOAT_STRUCT = struct.Struct("<d")
+_EDGE_BLOCK = 4096  # edges per edge record
+_FLUSH_SIZE = 1 << 16
+
+
+def _encode_varint(buffer: bytearray, value: int):
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _decode_varint(data: bytes, pos: int) -> (int, int):
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+def _encode_value(buffer: bytearray, value, string_index: dict):
+    if value is None:
+        buffer.append(_NONE)
+    elif value is True:
+        buffer.append(_TRUE)
+    elif value is False:
+        buffer.append(_FALSE)
+    elif isinstance(value, int):
+        buffer.append(_INT)
+        _encode_varint(buffer, value << 1 if value >= 0 else (-value << 1) - 1)  # zigzag
+    elif isinstance(value, float):
+        buffer.append(_FLOAT)
+        buffer += _FLOAT_STRUCT.pack(value)
+    elif isinstance(value, str):
+        index = string_index.get(value)
+        if index is None:
+            string_index[value] = len(string_index)
+            data = value.encode("utf-8")
+            buffer.append(_NEW_STR)
+            _encode_varint(buffer, len(data))
+            buffer += data
+        else:
+            buffer.append(_STR)
+            _encode_varint(buffer, index)
+    elif isinstance(value, (list, tuple)):
+        buffer.append(_LIST)
+        _encode_varint(buffer, len(value))
+        for item in value:
+            _encode_value(buffer, item, string_index)
+    elif isinstance(value, dict):
+        buffer.append(_DICT)
+        _encode_varint(buffer, len(value))
+        for key, item in value.items():
+            _encode_value(buffer, key, string_index)
+            _encode_value(buffer, item, string_index)
+    else:
+        _encode_value(buffer, str(value), string_index)
+
+
+def _decode_value(data: bytes, pos: int, string_table: list):
+    tag = data[pos]
+    pos += 1
+    if tag == _STR:
+        index, pos = _decode_varint(data, pos)
+        return string_table[index], pos
+    elif tag == _NEW_STR:
+        size, pos = _decode_varint(data, pos)
+        value = data[pos:pos + size].decode("utf-8")
+        string_table.append(value)
+        return value, pos + size
+    elif tag == _INT:
+        value, pos = _decode_varint(data, pos)
+        return (value >> 1 if value & 1 == 0 else -((value + 1) >> 1)), pos
+    elif tag == _LIST:
+        size, pos = _decode_varint(data, pos)
+        value = []
+        for _ in range(size):
+            item, pos = _decode_value(data, pos, string_table)
+            value.append(item)
+        return value, pos
+    elif tag == _DICT:
+        size, pos = _decode_varint(data, pos)
+        value = {}
+        for _ in range(size):
+            key, pos = _decode_value(data, pos, string_table)
+            value[key], pos = _decode_value(data, pos, string_table)
+        return value, pos
+    elif tag == _NONE:
+        return None, pos
+    elif tag == _TRUE:
+        return True, pos
+    elif tag == _FALSE:
+        return False, pos
+    elif tag == _FLOAT:
+        return _FLOAT_STRUCT.unpack_from(data, pos)[0], pos + 8
+    raise ValueError(f"unknown tag {tag} in the binary stream")
+
+
+class BinaryWriter:
+    def __init__(self, stream, kind: int):
+        self.stream = stream
+        self.string_index = {}
+        self._buffer = bytearray(MAGIC)
+        self._buffer.append(kind)
+
+    def write_record(self, tag: int, value):
+        payload = bytearray()
+        _encode_value(payload, value, self.string_index)
+        self.write_raw_record(tag, payload)
+
+    def write_raw_record(self, tag: int, payload: bytes):
+        self._buffer.append(tag)
+        _encode_varint(self._buffer, len(payload))
+        self._buffer += payload
+        if len(self._buffer) >= _FLUSH_SIZE:
+            self.flush()
+
+    def close(self):
+        self._buffer.append(_END)
+        self.flush()
+
+    def flush(self):
+        self.stream.write(bytes(self._buffer))
+        self._buffer = bytearray()
+
+
+class BinaryReader:
+    def __init__(self, stream, kind: int, chunk_size: int = _FLUSH_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.string_table = []
+        self._buffer = b""
+        self._pos = 0
+        if self._read(len(MAGIC) + 1) != MAGIC + bytes([kind]):
+            raise ValueError("not a binary graph / summary tree stream of this version")
+
+    def _read(self, size: int) -> bytes:
+        if len(self._buffer) - self._pos < size:
+            rest = self._buffer[self._pos:]
+            self._buffer = rest + self.stream.read(max(self.chunk_size, size - len(rest)))
+            self._pos = 0
+            if len(self._buffer) < size:
+                raise EOFError("unexpected end of the binary stream")
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+    def read_raw_record(self) -> (int, bytes):
+        # (tag, payload), (_END, b"") at the end of the stream
+        tag = self._read(1)[0]
+        if tag == _END:
+            return tag, b""
+        size = 0
+        shift = 0
+        while True:
+            byte = self._read(1)[0]
+            size |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        return tag, self._read(size)
+
+    def read_record(self):
+        tag, payload = self.read_raw_record()
+        if tag == _END:
+            return tag, None
+        return tag, _decode_value(payload, 0, self.string_table)[0]
+
+
+'''
+    Graph, the same fields as Graph.write_graph_to_json plus the task id
+'''
+def dump_graph(graph: Graph, stream):
+    dump_graph_records(*graph_records(graph), stream)
+
+
+def graph_records(graph: Graph) -> ([list], [(int, int)]):
+    # the node records and the edges as node indexes dump_graph writes, the graph can change once they are taken
+    index = {}
+    node_record_list = []
+    for node in graph.vertex:
+        index[node] = len(index)
+        node_record_list.append([
+            node.id,
+            node.description,
+            [task.description for task in node.parent_task_list],
+            [task.description for task in node.predecessor_task_list],
+            node.number,
+            list(node.candidate_list),
+            node.reflect,
+            list(node.milestones),
+            node.status,
+        ])
+    edge_list = [(index[start], index[end]) for start, end in graph.edge if start in index and end in index]
+    return node_record_list, edge_list
+
+
+def dump_graph_records(node_record_list: [list], edge_list: [(int, int)], stream):
+    writer = BinaryWriter(stream, GRAPH)
+    for node_record in node_record_list:
+        writer.write_record(_NODE, node_record)
+    payload = bytearray()
+    count = 0
+    for start, end in edge_list:
+        _encode_varint(payload, start)
+        _encode_varint(payload, end)
+        count += 1
+        if count == _EDGE_BLOCK:
+            writer.write_raw_record(_EDGE, payload)
+            payload = bytearray()
+            count = 0
+    if count > 0:
+        writer.write_raw_record(_EDGE, payload)
+    writer.close()
+
+
+def iter_graph(stream):
+    '''
+    Stream the records of a binary graph without building it
+    yield ("node", dict) in vertex order, then ("edge", (start index, end index))
+    '''
+    reader = BinaryReader(stream, GRAPH)
+    while True:
+        tag, payload = reader.read_raw_record()
+        if tag == _END:
+            return
+        elif tag == _NODE:
+            node_id, description, parent, predecessor, number, candidate_list, reflect, milestones, status = \
+                _decode_value(payload, 0, reader.string_table)[0]
+            yield "node", {
+                "id": node_id,
+                "parent_task_list": parent,
+                "predecessor_task_list": predecessor,
+                "description": description,
+                "number": number,
+                "candidate list": candidate_list,
+                "reflect": reflect,
+                "milestones": milestones,
+                "status": status,
+            }
+        elif tag == _EDGE:
+            pos = 0
+            while pos < len(payload):
+                start, pos = _decode_varint(payload, pos)
+                end, pos = _decode_varint(payload, pos)
+                yield "edge", (start, end)
+        else:
+            raise ValueError(f"unknown record {tag} in the binary graph")
+
+
+def load_graph(stream) -> Graph:
+    # parent and predecessor tasks outside the graph come back as tasks with only a description
+    graph = Graph()
+    node_list = []
+    predecessor_name = {}
+    outside = {}
+    for kind, record in iter_graph(stream):
+        if kind == "edge":
+            graph.add_edge(node_list[record[0]], node_list[record[1]])
+            continue
+        task = Task(record["description"], {})
+        task.id = record["id"]
+        task.number = record["number"]
+        task.candidate_list = record["candidate list"]
+        task.reflect = record["reflect"]
+        task.milestones = record["milestones"]
+        task.status = record["status"]
+        task.parent_task_list = [outside.get(name) or outside.setdefault(name, Task(name, {}))
+                                 for name in record["parent_task_list"]]
+        if record["predecessor_task_list"]:
+            predecessor_name[task] = record["predecessor_task_list"]  # resolved once all nodes are read
+        node_list.append(task)
+        graph.add_node(task)
+    by_description = {task.description: task for task in node_list}
+    for task, name_list in predecessor_name.items():
+        task.predecessor_task_list = [by_description.get(name) or outside.get(name) or outside.setdefault(name, Task(name, {}))
+                                      for name in name_list]
+    return graph
+
+
+'''
+    TaskSummaryTree
+'''
+def dump_summary_tree(tree, stream):
+    writer = BinaryWriter(stream, SUMMARY_TREE)
+    writer.write_record(_TREE_INFO, [tree.root_id, tree.task_nodes_id])
+    for node in tree.nodes:
+        # children_id is rebuilt from parent_id
+        writer.write_record(_TREE_NODE, [node.id, node.parent_id, node.action, node.task, node.success])
+    writer.close()
+
+
+def load_summary_tree(tree, stream):
+    from type_define.task_summary_tree import TaskSummaryNode
+    reader = BinaryReader(stream, SUMMARY_TREE)
+    tree.nodes = []
+    node_dict = {}
+    while True:
+        tag, record = reader.read_record()
+        if tag == _END:
+            break
+        elif tag == _TREE_INFO:
+            tree.root_id, tree.task_nodes_id = record
+        elif tag == _TREE_NODE:
+            node = TaskSummaryNode(record[0])
+            node.parent_id, node.action, node.task, node.success = record[1:]
+            tree.nodes.append(node)
+            node_dict[node.id] = node
+        else:
+            raise ValueError(f"unknown record {tag} in the binary summary tree")
+    for node in tree.nodes:
+        if node.parent_id is not None:
+            node_dict[node.parent_id].children_id.append(node.id)
+    return tree
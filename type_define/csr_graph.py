@@ -0,0 +1,332 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+import numpy as np
+from type_define.graph import Graph, Task
+
+# status codes of the status array, the same codes as Task.status_id
+UNKNOWN, RUNNING, SUCCESS, FAILURE = 0, 1, 2, 3
+STATUS_LIST = Task.status_list[:4]
+STATUS_CODE = {status: code for code, status in enumerate(STATUS_LIST)}
+
+
+def _build_csr(num_node: int, src: np.ndarray, dst: np.ndarray) -> (np.ndarray, np.ndarray):
+    # row pointer and column index of src -> dst, rows keep the edge insertion order
+    order = np.argsort(src, kind="stable")
+    ptr = np.zeros(num_node + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_node), out=ptr[1:])
+    return ptr, dst[order].astype(np.int32)
+
+
+def _gather(ptr: np.ndarray, idx: np.ndarray, node_ids: np.ndarray) -> np.ndarray:
+    # concatenated neighbours of node_ids without a python loop
+    start = ptr[node_ids]
+    length = ptr[node_ids + 1] - start
+    total = int(length.sum())
+    if total == 0:
+        return np.empty(0, dtype=idx.dtype)
+    offset = np.repeat(start - (np.cumsum(length) - length), length) + np.arange(total)
+    return idx[offset]
+
+
+class CSRGraph:
+    '''
+    Compact task graph for very large DAGs.
+    Nodes are integer ids 0..num_node-1, successors and predecessors are stored as CSR arrays
+    and the task status as an int8 array, so the whole graph is a handful of numpy arrays.
+
+    The graph is immutable, convert it with to_graph() to edit it and back with from_graph().
+    When it is built from a Graph the Task objects are kept in task_list, and the read API
+    used by TaskManager and GlobalController (vertex, edge, get_open_task_list,
+    check_graph_completion, get_graph_status_with_id, get_node_by_order...) works on them.
+    '''
+    def __init__(self, num_node: int, src, dst, status=None, task_list: [Task] = None):
+        src = np.asarray(src, dtype=np.int64).reshape(-1)
+        dst = np.asarray(dst, dtype=np.int64).reshape(-1)
+        if len(src) > 0:
+            # drop duplicate edges, keep the first occurrence
+            _, first = np.unique(src * num_node + dst, return_index=True)
+            first = np.sort(first)
+            src, dst = src[first], dst[first]
+        self.num_node = num_node
+        self.src = src.astype(np.int32)
+        self.dst = dst.astype(np.int32)
+        self.succ_ptr, self.succ_idx = _build_csr(num_node, src, dst)
+        self.pred_ptr, self.pred_idx = _build_csr(num_node, dst, src)
+        if status is None:
+            self.status = np.zeros(num_node, dtype=np.int8)
+        else:
+            self.status = np.asarray(status, dtype=np.int8).copy()
+        self.task_list = task_list
+        self._task_index = None
+        self._topological_id = None
+        self._frontier = None  # Kahn frontiers, see _kahn
+        self.id = None  # id of the Graph it was built from
+        self._slack = (None, {})  # see Graph.get_slack
+
+    '''
+        Adapters
+    '''
+    @classmethod
+    def from_graph(cls, graph: Graph):
+        task_list = graph.vertex
+        index = {task: idx for idx, task in enumerate(task_list)}
+        edge_list = [(index[start], index[end]) for start, end in graph.edge if start in index and end in index]
+        edge = np.array(edge_list, dtype=np.int64).reshape(-1, 2)
+        status = [task.status_id if task.status_id <= FAILURE else UNKNOWN for task in task_list]
+        csr_graph = cls(len(task_list), edge[:, 0], edge[:, 1], status=status, task_list=task_list)
+        csr_graph.id = graph.id  # an editable copy keeps logging as the same graph
+        return csr_graph
+
+    def to_graph(self) -> Graph:
+        self.sync_status()
+        if self.task_list is None:
+            task_list = [Task(f"task {idx}", {}) for idx in range(self.num_node)]
+            for task, code in zip(task_list, self.status):
+                task.status = STATUS_LIST[code]
+        else:
+            task_list = self.task_list
+        graph = Graph()
+        if self.id is not None:
+            graph.id = self.id
+        for task in task_list:
+            graph.add_node(task)
+        for start, end in zip(self.src.tolist(), self.dst.tolist()):
+            graph.add_edge(task_list[start], task_list[end])
+        return graph
+
+    def sync_status(self):
+        # pull the status of the Task objects into the status array
+        if self.task_list is not None:
+            status = np.fromiter((task.status_id for task in self.task_list), dtype=np.int64, count=self.num_node)
+            status[status > FAILURE] = UNKNOWN  # statuses interned by Task beyond the four known ones
+            self.status = status.astype(np.int8)
+
+    def get_node_id(self, node: Task) -> int:
+        if self._task_index is None:
+            self._task_index = {task: idx for idx, task in enumerate(self._to_task(np.arange(self.num_node)))}
+        return self._task_index[node]
+
+    def _to_task(self, node_ids) -> [Task]:
+        if self.task_list is None:
+            raise ValueError("the graph is not built from Task objects")
+        return [self.task_list[idx] for idx in np.asarray(node_ids).tolist()]
+
+    '''
+        Id based vectorized API
+    '''
+    @property
+    def in_degree(self) -> np.ndarray:
+        return np.diff(self.pred_ptr)
+
+    @property
+    def out_degree(self) -> np.ndarray:
+        return np.diff(self.succ_ptr)
+
+    def get_successor_id(self, node_id: int) -> np.ndarray:
+        return self.succ_idx[self.succ_ptr[node_id]:self.succ_ptr[node_id + 1]]
+
+    def get_predecessor_id(self, node_id: int) -> np.ndarray:
+        return self.pred_idx[self.pred_ptr[node_id]:self.pred_ptr[node_id + 1]]
+
+    def get_entry_id(self) -> np.ndarray:
+        return np.flatnonzero(self.in_degree == 0)
+
+    def get_exit_id(self) -> np.ndarray:
+        return np.flatnonzero(self.out_degree == 0)
+
+    def get_reachable(self, source_ids, reverse: bool = False, include_source: bool = False) -> np.ndarray:
+        '''
+        Boolean mask of the nodes reachable from source_ids, one numpy step per BFS level
+        - reverse: follow predecessors instead of successors
+        - include_source: mark the sources themselves
+        '''
+        ptr, idx = (self.pred_ptr, self.pred_idx) if reverse else (self.succ_ptr, self.succ_idx)
+        mask = np.zeros(self.num_node, dtype=bool)
+        frontier = np.unique(np.asarray(source_ids, dtype=np.int64))
+        if include_source:
+            mask[frontier] = True
+        while frontier.size > 0:
+            neighbour = _gather(ptr, idx, frontier)
+            neighbour = np.unique(neighbour[~mask[neighbour]])
+            mask[neighbour] = True
+            frontier = neighbour
+        return mask
+
+    def _kahn(self) -> [(np.ndarray, np.ndarray, np.ndarray)]:
+        '''
+        (frontier, src, dst) of every round of Kahn's algorithm: the nodes whose predecessors are all in the earlier
+        frontiers and the edges leaving them. A frontier is in the order the queue of Graph.get_topological_order
+        lists it: a node follows the last of its predecessors, the successors of a node in the order of its edges.
+        Nodes on or behind a cycle are in no frontier. The graph is immutable, the rounds are computed once.
+        '''
+        if self._frontier is None:
+            self._frontier = []
+            remain = self.in_degree.copy()
+            frontier = np.flatnonzero(remain == 0)
+            while frontier.size > 0:
+                src = np.repeat(frontier, self.out_degree[frontier])
+                dst = _gather(self.succ_ptr, self.succ_idx, frontier)
+                self._frontier.append((frontier, src, dst))
+                remain -= np.bincount(dst, minlength=self.num_node)
+                ready = dst[remain[dst] == 0]
+                # the last edge into a node is the one that empties its count, keep the nodes in that order
+                _, last = np.unique(ready[::-1], return_index=True)
+                frontier = ready[np.sort(ready.size - 1 - last)]
+        return self._frontier
+
+    def get_level(self) -> np.ndarray:
+        '''
+        Level of every node: the length of the longest path from an entry node.
+        Nodes on or behind a cycle get -1.
+        '''
+        level = np.full(self.num_node, -1, dtype=np.int64)
+        for depth, (frontier, _, _) in enumerate(self._kahn()):
+            level[frontier] = depth
+        return level
+
+    def get_level_width(self) -> np.ndarray:
+        # number of nodes on each level
+        level = self.get_level()
+        return np.bincount(level[level >= 0])
+
+    def get_topological_id(self) -> np.ndarray:
+        # the order of Graph.get_topological_order, cycles are left out like there
+        if self._topological_id is None:
+            frontier_list = [frontier for frontier, _, _ in self._kahn()]
+            self._topological_id = np.concatenate(frontier_list) if frontier_list else np.empty(0, dtype=np.int64)
+        return self._topological_id
+
+    def get_open_mask(self) -> np.ndarray:
+        return (self.status == UNKNOWN) | (self.status == RUNNING)
+
+    def get_blocked(self, mask: np.ndarray) -> np.ndarray:
+        '''
+        Boolean mask of the nodes with an ancestor in mask, counted along the Kahn frontiers: a node is blocked once
+        an edge from a masked or blocked node reaches it. Nodes on or behind a cycle are blocked, they can never start
+        '''
+        blocked = np.ones(self.num_node, dtype=bool)
+        for frontier, _, _ in self._kahn():
+            blocked[frontier] = False
+        for _, src, dst in self._kahn():
+            hit = dst[mask[src] | blocked[src]]
+            blocked[hit] = True
+        return blocked
+
+    def get_ready_id(self) -> np.ndarray:
+        # unknown nodes without any unknown or running ancestor, the ready set of Graph
+        blocked = self.get_blocked(self.get_open_mask())
+        return np.flatnonzero((self.status == UNKNOWN) & ~blocked)
+
+    def is_completed(self) -> bool:
+        # same rule as Graph.check_graph_completion on the status array
+        if np.any(self.status == RUNNING):
+            return False
+        blocked = self.get_blocked(self.status != SUCCESS)
+        return not np.any((self.status == UNKNOWN) & ~blocked)
+
+    def get_open_ancestor(self, block_size: int = 1024) -> (np.ndarray, np.ndarray):
+        '''
+        (node id, ancestor id) of every open node and each of its open ancestors, sorted by node then ancestor,
+        the predecessor_task_list of Graph.get_open_task_list.
+        The ancestors are carried along the Kahn frontiers as bitsets over the open nodes, block_size open nodes at
+        a time so the bitsets of a block take block_size / 8 bytes per node, only the nodes behind the block count
+        '''
+        open_ids = np.flatnonzero(self.get_open_mask())
+        node_list, ancestor_list = [], []
+        for start in range(0, open_ids.size, block_size):
+            column = open_ids[start:start + block_size]
+            bit = np.full(self.num_node, -1, dtype=np.int64)
+            bit[column] = np.arange(column.size)
+            behind = self.get_reachable(column)
+            row = np.full(self.num_node, -1, dtype=np.int64)
+            row[behind] = np.arange(np.count_nonzero(behind))
+            bitset = np.zeros((np.count_nonzero(behind), (column.size + 7) // 8), dtype=np.uint8)
+            for _, src, dst in self._kahn():
+                keep = behind[dst]
+                src, dst = src[keep], dst[keep]
+                carried = np.zeros((src.size, bitset.shape[1]), dtype=np.uint8)
+                from_row = row[src] >= 0
+                carried[from_row] = bitset[row[src[from_row]]]
+                own = np.flatnonzero(bit[src] >= 0)
+                carried[own, bit[src[own]] // 8] |= (128 >> (bit[src[own]] % 8)).astype(np.uint8)
+                np.bitwise_or.at(bitset, row[dst], carried)
+            # the set bits of the open nodes behind the block
+            node = open_ids[behind[open_ids]]
+            byte_row, byte = np.nonzero(bitset[row[node]])
+            bits = np.unpackbits(bitset[row[node]][byte_row, byte][:, None], axis=1)
+            bit_row, bit_idx = np.nonzero(bits)
+            node_list.append(node[byte_row[bit_row]])
+            ancestor_list.append(column[byte[bit_row] * 8 + bit_idx])
+        if not node_list:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        node, ancestor = np.concatenate(node_list), np.concatenate(ancestor_list)
+        order = np.lexsort((ancestor, node))
+        return node[order], ancestor[order]
+
+    '''
+        Task based API, compatible with Graph
+    '''
+    @property
+    def vertex(self) -> [Task]:
+        return self._to_task(np.arange(self.num_node))
+
+    @property
+    def edge(self) -> [(Task, Task)]:
+        task_list = self._to_task(np.arange(self.num_node))
+        return [(task_list[start], task_list[end]) for start, end in zip(self.src.tolist(), self.dst.tolist())]
+
+    def get_node_from(self, node: Task) -> [Task]:
+        return self._to_task(self.get_successor_id(self.get_node_id(node)))
+
+    def get_node_to(self, node: Task) -> [Task]:
+        return self._to_task(self.get_predecessor_id(self.get_node_id(node)))
+
+    def get_entry_node(self) -> [Task]:
+        return self._to_task(self.get_entry_id())
+
+    def get_exit_node(self) -> [Task]:
+        return self._to_task(self.get_exit_id())
+
+    def get_all_node(self) -> [Task]:
+        return self.vertex
+
+    def get_topological_order(self) -> [Task]:
+        return self._to_task(self.get_topological_id())
+
+    def get_open_task_list(self) -> [Task]:
+        # predecessor_task_list holds every open ancestor of each open task, like Graph.get_open_task_list
+        self.sync_status()
+        open_ids = np.flatnonzero(self.get_open_mask())
+        node, ancestor = self.get_open_ancestor()
+        start = np.searchsorted(node, open_ids, side="left").tolist()
+        end = np.searchsorted(node, open_ids, side="right").tolist()
+        ancestor_task = self._to_task(ancestor)
+        open_task_list = self._to_task(open_ids)
+        for task, first, last in zip(open_task_list, start, end):
+            task.predecessor_task_list = ancestor_task[first:last]
+            task._direct_pre_task_list = list(task.predecessor_task_list)
+        return open_task_list
+
+    def check_graph_completion(self) -> bool:
+        self.sync_status()
+        return self.is_completed()
+
+    def _duration_key(self, duration) -> tuple:
+        # the structure never changes, the statuses are read from the tasks
+        self.sync_status()
+        return self.status.tobytes(), duration, getattr(getattr(duration, "__self__", None), "version", None)
+
+    # the renderers of Graph only depend on the methods above
+    get_node_by_order = Graph.get_node_by_order
+    get_graph_status = Graph.get_graph_status
+    get_graph_status_with_id = Graph.get_graph_status_with_id
+    get_graph_list = Graph.get_graph_list
+    get_bottom_level = Graph.get_bottom_level
+    get_critical_path = Graph.get_critical_path
+    get_slack = Graph.get_slack
+    predict_makespan = Graph.predict_makespan
+    get_parallelism = Graph.get_parallelism
+    to_json = Graph.to_json
+    graph_flow = Graph.graph_flow
+    __str__ = Graph.__str__
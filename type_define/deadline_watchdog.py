@@ -0,0 +1,209 @@
+import sys
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+import queue
+from concurrent.futures import Executor, Future
+sys.path.append(os.getcwd())
+
+logger = logging.getLogger(__name__)
+
+
+class StepCancelled(Exception):
+    '''
+    Raised inside a step at its next checkpoint once its CancelToken is cancelled
+    '''
+    pass
+
+
+class CancelToken:
+    '''
+    Cooperative cancellation of one agent step.
+    A thread can not be stopped from outside, so the step checks the token between its llm calls, tools
+    and retries: check() raises StepCancelled and wait() is a sleep that returns early once cancelled.
+    '''
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def check(self):
+        if self._event.is_set():
+            raise StepCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        # sleep up to timeout seconds, True if cancelled meanwhile
+        return self._event.wait(timeout)
+
+
+class DeadlineWatchdog:
+    '''
+    One background thread that calls a callback at the deadline of a key, unless the key was cancelled before.
+    Deadlines are kept in a heap, the thread sleeps until the earliest one or until an earlier one is scheduled,
+    so a deadline fires on time whatever else the controller is doing.
+    A cancelled or rescheduled entry stays in the heap and is skipped when it comes up.
+
+    Args:
+    - name: str, name of the thread
+    '''
+    def __init__(self, name: str = "DeadlineWatchdog"):
+        self._heap = []  # (deadline, sequence, key)
+        self._entry = {}  # key -> (deadline, sequence, callback), the live entry of each key
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return len(self._entry)
+
+    def schedule(self, key, deadline: float, callback):
+        # deadline: time.time() at which callback() is called, a key scheduled again keeps only the new deadline
+        with self._condition:
+            sequence = next(self._sequence)
+            self._entry[key] = (deadline, sequence, callback)
+            heapq.heappush(self._heap, (deadline, sequence, key))
+            if self._heap[0][1] == sequence:
+                self._condition.notify()
+
+    def cancel(self, key) -> bool:
+        # False if the key already fired or was never scheduled
+        with self._condition:
+            return self._entry.pop(key, None) is not None
+
+    def close(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._shutdown:
+                    # drop the entries cancelled or rescheduled since they were pushed
+                    while self._heap and self._entry.get(self._heap[0][2], (None, None))[1] != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    self._condition.wait(self._heap[0][0] - time.time() if self._heap else None)
+                if self._shutdown:
+                    return
+                _, _, key = heapq.heappop(self._heap)
+                _, _, callback = self._entry.pop(key)
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"DeadlineWatchdog callback of {key} failed: {e}")
+
+
+class StepPool(Executor):
+    '''
+    Thread pool of the agent steps that can give up on a stuck thread.
+    A step past its deadline keeps its thread until its next checkpoint, replace(future) retires that thread:
+    it leaves once the step returns and a new thread takes its place at once, the other threads go on as they are.
+    Threads start on demand up to max_workers, they are daemons so a step that never returns does not block exit.
+
+    Args:
+    - max_workers: int, threads taking steps, the retired ones not counted
+    - thread_name_prefix: str, name of the threads
+    '''
+    def __init__(self, max_workers: int, thread_name_prefix: str = "StepPool"):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self.replace_count = 0
+        self._queue = queue.SimpleQueue()  # (future, fn, args, kwargs), None stops a thread
+        self._idle = threading.Semaphore(0)  # threads waiting for a step
+        self._lock = threading.Lock()
+        self._thread = set()  # threads taking steps
+        self._retired = set()  # threads that leave after their step
+        self._running = {}  # future -> thread running it
+        self._sequence = itertools.count()
+        self._shutdown = False
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new steps after shutdown")
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            if not self._idle.acquire(timeout=0) and len(self._thread) < self.max_workers:
+                self._start(idle=False)
+            return future
+
+    def replace(self, future: Future) -> bool:
+        # False if future is not running on a thread of the pool
+        with self._lock:
+            thread = self._running.get(future)
+            if thread is None or thread in self._retired or self._shutdown:
+                return False
+            self._thread.discard(thread)
+            self._retired.add(thread)
+            self.replace_count += 1
+            self._start(idle=True)
+            return True
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            # the steps queued before still run
+            for _ in self._thread:
+                self._queue.put(None)
+            thread_list = list(self._thread | self._retired)
+        if wait:
+            for thread in thread_list:
+                thread.join()
+
+    def _start(self, idle: bool):
+        thread = threading.Thread(target=self._work, args=(idle,), daemon=True,
+                                  name=f"{self.thread_name_prefix}_{next(self._sequence)}")
+        self._thread.add(thread)
+        thread.start()
+
+    def _work(self, idle: bool):
+        thread = threading.current_thread()
+        if idle:
+            self._idle.release()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            with self._lock:
+                # listed before it runs, a step seen running can be replaced
+                self._running[future] = thread
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self._lock:
+                self._running.pop(future, None)
+                if thread in self._retired:
+                    self._retired.remove(thread)
+                    return
+            self._idle.release()
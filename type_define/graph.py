@@ -3,9 +3,41 @@ import os
 import uuid
 sys.path.append(os.getcwd())
 import json
-import networkx as nx
-import matplotlib.pyplot as plt
 import threading
+import weakref
+import heapq
+from collections import deque
+
+
+_status_lock = threading.Lock() # interning of new status strings
+# references to a list held only by a task slot, as counted by sys.getrefcount inside Task.copy
+_UNREFERENCED = 3
+
+
+class _SharedList:
+    '''
+    Copy-on-write list attribute of Task. Task.copy shares the lists with the original,
+    the first access on either side replaces its own reference with a private copy.
+    A list still referenced outside the task (a caller kept the value it read or assigned)
+    may be changed through that reference, Task.copy gives the copy its own list of it instead.
+    '''
+    def __init__(self, slot: str, bit: int):
+        self.slot = slot
+        self.bit = bit
+
+    def __get__(self, task, owner=None):
+        if task is None:
+            return self
+        if task._shared & self.bit:
+            value = list(getattr(task, self.slot))
+            setattr(task, self.slot, value)
+            task._shared &= ~self.bit
+            return value
+        return getattr(task, self.slot)
+
+    def __set__(self, task, value):
+        setattr(task, self.slot, value)
+        task._shared &= ~self.bit
 
 
 class Task:
@@ -13,39 +45,111 @@ class Task:
     failure = "failure"
     unknown = "unknown"
     running = "running"
+    # the status is stored as an interned code, an index of status_list
+    status_list = [unknown, running, success, failure]
+    status_code = {status: code for code, status in enumerate(status_list)}
+
+    __slots__ = ("_graphs", "id", "content", "_parent_task_list", "_predecessor_task_list", "description",
+                 "goal", "criticism", "_milestones", "_status", "_candidate_list", "number", "available",
+                 "reflect", "priority", "_pre_idxs", "_agent", "_summary", "_direct_pre_task_list", "_shared")
+
+    parent_task_list = _SharedList("_parent_task_list", 1)  # upper level task
+    predecessor_task_list = _SharedList("_predecessor_task_list", 2)  # previous task
+    milestones = _SharedList("_milestones", 4)
+    candidate_list = _SharedList("_candidate_list", 8)
+    _shared_list = (parent_task_list, predecessor_task_list, milestones, candidate_list)
+    _all_shared = parent_task_list.bit | predecessor_task_list.bit | milestones.bit | candidate_list.bit
 
     def __init__(self, name: str, content: dict):
+        self._graphs = None # WeakSet of the graphs that hold this task, notified on status change
+        self._shared = 0 # bits of the list attributes shared with a copy
         self.id = str(uuid.uuid4())
         self.content = content  # Task related content (e.g. task detail, task data, etc.)
-        self.parent_task_list = []  # upper level task
-        self.predecessor_task_list = []  # previous task
+        self._parent_task_list = []  # upper level task
+        self._predecessor_task_list = []  # previous task
         self.description = name # 
         self.goal = None # deprecated
         self.criticism = None # deprecated
-        self.milestones = []
-        self.status = Task.unknown
-        self.candidate_list = []
+        self._milestones = []
+        self._status = 0 # Task.unknown
+        self._candidate_list = []
         self.number = 1
         self.available = True
         self.reflect = None
+        self.priority = None # response priority class, 1 is the most urgent, None if not classified
 
         self._pre_idxs = [] # only used by task manager
         self._agent = [] # only used by task manager and agent
         self._summary = ["running"] # only used by task manager
         self._direct_pre_task_list = [] # only used by global controller
-    
+
+    @property
+    def status(self) -> str:
+        return Task.status_list[self._status]
+
+    @status.setter
+    def status(self, status: str):
+        code = Task.status_code.get(status)
+        if code is None:
+            with _status_lock:
+                code = Task.status_code.get(status)
+                if code is None:
+                    # the name is listed before its code is published, readers never see a code without a name
+                    Task.status_list.append(status)
+                    code = Task.status_code[status] = len(Task.status_list) - 1
+        old_code = self._status
+        self._status = code
+        if old_code != code and self._graphs:
+            old_status = Task.status_list[old_code]
+            for graph in list(self._graphs):
+                graph._on_status_change(self, old_status, status)
+
+    @property
+    def status_id(self) -> int:
+        return self._status
+
+    def __getstate__(self):
+        # pickled for another process: the graphs stay behind, the status goes by name since codes are per process
+        state = {slot: getattr(self, slot) for slot in Task.__slots__ if slot != "_graphs" and hasattr(self, slot)}
+        state["_status"] = Task.status_list[self._status]
+        return state
+
+    def __setstate__(self, state):
+        self._graphs = None
+        self._status = 0
+        status = state.pop("_status")
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.status = status
+
     def copy(self):
-        new_task = Task(self.description, self.content)
-        new_task.parent_task_list = self.parent_task_list
-        new_task.predecessor_task_list = self.predecessor_task_list
+        # the copy shares the lists until one side touches them, see _SharedList
+        new_task = Task.__new__(Task)
+        new_task._graphs = None
+        new_task.id = str(uuid.uuid4())
+        new_task.content = self.content
+        shared = Task._all_shared
+        for shared_list in Task._shared_list:
+            value = getattr(self, shared_list.slot)
+            if not self._shared & shared_list.bit and sys.getrefcount(value) > _UNREFERENCED:
+                # still referenced outside the task, a change through that reference must not reach the copy
+                value = list(value)
+                shared &= ~shared_list.bit
+            setattr(new_task, shared_list.slot, value)
+        new_task.description = self.description
         new_task.goal = self.goal
         new_task.criticism = self.criticism
-        new_task.milestones = self.milestones
-        new_task.status = self.status
-        new_task.candidate_list = self.candidate_list
+        new_task._status = self._status
         new_task.number = self.number
         new_task.available = self.available
         new_task.reflect = self.reflect
+        new_task.priority = self.priority
+        new_task._pre_idxs = []
+        new_task._agent = []
+        new_task._summary = ["running"]
+        new_task._direct_pre_task_list = []
+        self._shared |= shared
+        new_task._shared = shared
         return new_task
 
     def to_json(self) -> dict:
@@ -92,111 +196,378 @@ class Task:
             # "milestones": self.milestones,
             "number": self.number,
             "candidate list": self.candidate_list,
+            "priority": self.priority,
             "available": self.available
         }
 
 
+class GraphDiagnostics:
+    '''
+    Problems found by Graph.from_dependency, task and dependency indexes are 1-based like _pre_idxs
+    - dangling: (task index, dependency index) pointing outside the task list, the edge is dropped
+    - self_loop: task index depending on itself, the edge is dropped
+    - duplicate: (task index, dependency index) listed more than once
+    - cycle: task indexes of one dependency cycle, tasks on it can never start
+    - dropped: (task index, dependency index) dropped to break the cycles, see Graph.from_dependency
+    '''
+    def __init__(self):
+        self.dangling = []
+        self.self_loop = []
+        self.duplicate = []
+        self.cycle = []
+        self.dropped = []
+
+    @property
+    def valid(self) -> bool:
+        return not self.dangling and not self.self_loop and not self.cycle
+
+    def to_json(self) -> dict:
+        return {
+            "dangling": self.dangling,
+            "self_loop": self.self_loop,
+            "duplicate": self.duplicate,
+            "cycle": self.cycle,
+            "dropped": self.dropped,
+        }
+
+    def __str__(self):
+        return str(self.to_json())
+
+
 class Graph:
     def __init__(self):
-        self.vertex = []
-        self.edge = []
-        self.G = nx.DiGraph()
+        # adjacency indexes, dicts are used as insertion ordered sets so that
+        # traversal order stays the same as the order nodes / edges were added
+        self._vertex = {}  # Task -> None
+        self._edge = {}  # (start, end) -> None, ordered edge view
+        self._successor = {}  # Task -> {Task: None}
+        self._predecessor = {}  # Task -> {Task: None}
+        # parent task -> {child Task in the graph: None}, filled from parent_task_list when a node is added,
+        # so parent_task_list has to be set before the node is added (as decompose / merge do)
+        self._children = {}
+        # memoized transitive closure as bitsets, Task -> int of all predecessor / successor
+        self._bit = {}  # Task -> bit index, assigned once in the order nodes appear
+        self._bit_node = []  # bit index -> Task
+        self._ancestor_cache = {}
+        self._descendant_cache = {}
+        # bumped on every structure change, derived data is cached per version
+        self._version = 0
+        self._topological_order = (-1, ())  # (version, tasks in Kahn order)
+        self._status_version = 0  # bumped on every status change of a task in the graph
+        self._slack = (None, {})  # (_duration_key of the slack, Task -> slack)
+        # ready set, rebuilt after a structure change and updated incrementally on status change
+        self._ready_lock = threading.RLock()
+        self._ready_version = -1
+        self._open_count = {}  # Task -> number of predecessors that are unknown or running
+        self._unfinished_count = {}  # Task -> number of predecessors that are not success
+        self._ready = set()  # unknown tasks without open predecessor, runnable now
+        self._unblocked = set()  # unknown tasks whose predecessors all succeeded
+        self._running = set()
+        self._pre_dirty = set()  # tasks whose predecessor_task_list has to be refreshed
+        self.id = str(uuid.uuid4())  # names the graph in a GraphMutationLog shared by several graphs
+        self.mutation_log = None  # GraphMutationLog, receives a delta after every mutation
 
         self._json_count = 0
 
+    @property
+    def vertex(self) -> [Task]:
+        with self._ready_lock:
+            return list(self._vertex)
+
+    @property
+    def edge(self) -> [(Task, Task)]:
+        with self._ready_lock:
+            return list(self._edge)
+
+    def attach_log(self, mutation_log, snapshot: bool = True):
+        '''
+        Record every following mutation in mutation_log (GraphMutationLog),
+        a snapshot of the current graph is written first unless snapshot is False
+        '''
+        if self.mutation_log is mutation_log:
+            return
+        self.mutation_log = mutation_log
+        if snapshot:
+            mutation_log.snapshot(self)
+
+    def has_node(self, node: Task) -> bool:
+        return node in self._vertex
+
+    def has_edge(self, start_node: Task, end_node: Task) -> bool:
+        return (start_node, end_node) in self._edge
+
     def add_node(self, node: Task):
-        if node not in self.vertex:
-            self.vertex.append(node)
+        # structure changes hold the ready lock, a status change on another thread walks the same indexes
+        with self._ready_lock:
+            if node not in self._vertex:
+                self._vertex[node] = None
+                if node._graphs is None:
+                    node._graphs = weakref.WeakSet()
+                node._graphs.add(self)
+                for parent in node.parent_task_list:
+                    self._children.setdefault(parent, {})[node] = None
+                self._get_bit(node)
+                self._version += 1
+                if self.mutation_log is not None:
+                    self.mutation_log.add_node(self, node)
 
     def add_edge(self, start_node: Task, end_node: Task):
-        if (start_node, end_node) not in self.edge:
-            self.edge.append((start_node, end_node))
+        with self._ready_lock:
+            if (start_node, end_node) not in self._edge:
+                self._invalidate_closure(start_node, end_node)
+                self._version += 1
+                self._edge[(start_node, end_node)] = None
+                self._successor.setdefault(start_node, {})[end_node] = None
+                self._predecessor.setdefault(end_node, {})[start_node] = None
+                if self.mutation_log is not None:
+                    self.mutation_log.add_edge(self, start_node, end_node)
+
+    @classmethod
+    def from_dependency(cls, task_list: [Task], pre_idxs_list: [[int]] = None,
+                        drop_cycles: bool = False) -> ("Graph", GraphDiagnostics):
+        '''
+        Build the graph of a plan in one pass and validate it in O(V+E)
+        - task_list: list of Task
+        - pre_idxs_list: 1-based dependency indexes of each task, task._pre_idxs by default.
+          A task without dependency runs in parallel with the previous task, it gets the same predecessors
+        - drop_cycles: break every dependency cycle at its dependency on the latest task of the plan order,
+          the dropped dependencies are listed in diagnostics.dropped. Otherwise the cycle stays in the graph
+        '''
+        if pre_idxs_list is None:
+            pre_idxs_list = [task._pre_idxs for task in task_list]
+        diagnostics = GraphDiagnostics()
+        task_num = len(task_list)
+        predecessor_idx = []  # 0-based predecessors of every task
+        for t_id, pre_idxs in enumerate(pre_idxs_list):
+            if len(pre_idxs) == 0:
+                predecessor_idx.append(list(predecessor_idx[-1]) if t_id > 0 else [])
+                continue
+            predecessor = {}
+            for idx in pre_idxs:
+                if not isinstance(idx, int) or idx < 1 or idx > task_num:
+                    diagnostics.dangling.append((t_id + 1, idx))
+                elif idx == t_id + 1:
+                    diagnostics.self_loop.append(t_id + 1)
+                elif idx - 1 in predecessor:
+                    diagnostics.duplicate.append((t_id + 1, idx))
+                else:
+                    predecessor[idx - 1] = None
+            predecessor_idx.append(list(predecessor))
+
+        # Kahn, the tasks left over are on a cycle or behind one
+        while True:
+            remain = [len(predecessor) for predecessor in predecessor_idx]
+            successor_idx = [[] for _ in range(task_num)]
+            for t_id, predecessor in enumerate(predecessor_idx):
+                for idx in predecessor:
+                    successor_idx[idx].append(t_id)
+            queue = [t_id for t_id in range(task_num) if remain[t_id] == 0]
+            for t_id in queue:
+                for successor in successor_idx[t_id]:
+                    remain[successor] -= 1
+                    if remain[successor] == 0:
+                        queue.append(successor)
+            if len(queue) == task_num:
+                break
+            # every left over task has a left over predecessor, walk back until a task repeats
+            t_id = next(t_id for t_id in range(task_num) if remain[t_id] > 0)
+            seen = {}
+            while t_id not in seen:
+                seen[t_id] = len(seen)
+                t_id = next(idx for idx in predecessor_idx[t_id] if remain[idx] > 0)
+            cycle = [idx + 1 for idx in reversed(list(seen)[seen[t_id]:])]
+            if not diagnostics.cycle:
+                diagnostics.cycle = cycle
+            if not drop_cycles:
+                break
+            # a cycle goes back in the plan order at least once, the dependency going back the furthest is dropped
+            pre, t_id = max(zip(cycle, cycle[1:] + cycle[:1]), key=lambda edge: edge[0] - edge[1])
+            predecessor_idx[t_id - 1].remove(pre - 1)
+            diagnostics.dropped.append((t_id, pre))
+
+        # the adjacency is written directly, a new graph has no cache to invalidate
+        graph = cls()
+        for task in task_list:
+            graph.add_node(task)
+        for t_id, predecessor in enumerate(predecessor_idx):
+            end_node = task_list[t_id]
+            for idx in predecessor:
+                start_node = task_list[idx]
+                graph._edge[(start_node, end_node)] = None
+                graph._successor.setdefault(start_node, {})[end_node] = None
+                graph._predecessor.setdefault(end_node, {})[start_node] = None
+        graph._version += 1
+        return graph, diagnostics
 
     def get_node_from(self, node: Task):
-        return [edge[1] for edge in self.edge if edge[0] == node]
+        with self._ready_lock:
+            return list(self._successor.get(node, ()))
 
     def get_node_to(self, node: Task):
-        return [edge[0] for edge in self.edge if edge[1] == node]
+        with self._ready_lock:
+            return list(self._predecessor.get(node, ()))
 
     def get_entry_node(self):
-        return [node for node in self.vertex if len(self.get_node_to(node)) == 0]
+        with self._ready_lock:
+            return [node for node in self._vertex if not self._predecessor.get(node)]
 
     def get_exit_node(self):
-        return [node for node in self.vertex if len(self.get_node_from(node)) == 0]
+        with self._ready_lock:
+            return [node for node in self._vertex if not self._successor.get(node)]
 
     def delete_node(self, node: Task):
-        self.vertex.remove(node)
-        self.edge = [edge for edge in self.edge if edge[0] != node and edge[1] != node]
+        with self._ready_lock:
+            if node not in self._vertex:
+                raise ValueError(f"node {node.description} is not in the graph")
+            self._invalidate_closure(node, node)
+            self._version += 1
+            del self._vertex[node]
+            if node._graphs is not None:
+                node._graphs.discard(self)
+            for parent in node.parent_task_list:
+                children = self._children.get(parent)
+                if children is not None:
+                    children.pop(node, None)
+                    if not children:
+                        del self._children[parent]
+            for successor in self._successor.pop(node, ()):
+                del self._predecessor[successor][node]
+                del self._edge[(node, successor)]
+            for predecessor in self._predecessor.pop(node, ()):
+                del self._successor[predecessor][node]
+                del self._edge[(predecessor, node)]
+            if self.mutation_log is not None:
+                self.mutation_log.remove_node(self, node)
 
     def remove_node_merge_edge(self, node: Task):
-        predecessor_list = self.get_node_to(node)
-        successor_list = self.get_node_from(node)
-        for predecessor in predecessor_list:
-            for successor in successor_list:
-                self.add_edge(predecessor, successor)
-        self.delete_node(node)
+        with self._ready_lock:
+            predecessor_list = self.get_node_to(node)
+            successor_list = self.get_node_from(node)
+            for predecessor in predecessor_list:
+                for successor in successor_list:
+                    self.add_edge(predecessor, successor)
+            self.delete_node(node)
 
     def insert_node_merge_edge(self, node: Task, predecessor: Task):
-        # predecessor -> node -> successor / predecessor -> successor
-        # insert node between predecessor and all successor
-        successor_list = self.get_node_from(predecessor)
-        # add parent list
-        node.parent_task_list = predecessor.parent_task_list
-        for successor in successor_list:
-            self.add_edge(node, successor)
-        self.add_edge(predecessor, node)
-        self.add_node(node)
+        with self._ready_lock:
+            # predecessor -> node -> successor / predecessor -> successor
+            # insert node between predecessor and all successor
+            successor_list = self.get_node_from(predecessor)
+            # add parent list
+            node.parent_task_list = predecessor.parent_task_list
+            for successor in successor_list:
+                self.add_edge(node, successor)
+            self.add_edge(predecessor, node)
+            self.add_node(node)
 
     def delete_edge(self, start_node: Task, end_node: Task):
-        self.edge.remove((start_node, end_node))
+        with self._ready_lock:
+            if (start_node, end_node) not in self._edge:
+                raise ValueError(f"edge {start_node.description} -> {end_node.description} is not in the graph")
+            self._invalidate_closure(start_node, end_node)
+            self._version += 1
+            del self._edge[(start_node, end_node)]
+            del self._successor[start_node][end_node]
+            del self._predecessor[end_node][start_node]
+            if self.mutation_log is not None:
+                self.mutation_log.remove_edge(self, start_node, end_node)
 
     def merge_at(self, sub_graph, node: Task):
-        predecessor_list = self.get_node_to(node)
-        successor_list = self.get_node_from(node)
+        # the whole merge under the lock, a status change never sees a half merged graph
+        with self._ready_lock:
+            predecessor_list = self.get_node_to(node)
+            successor_list = self.get_node_from(node)
 
-        sub_graph_entry_list = sub_graph.get_entry_node()
-        sub_graph_exit_list = sub_graph.get_exit_node()
+            sub_graph_entry_list = sub_graph.get_entry_node()
+            sub_graph_exit_list = sub_graph.get_exit_node()
 
-        for predecessor in predecessor_list:
-            for sub_graph_entry in sub_graph_entry_list:
-                self.add_edge(predecessor, sub_graph_entry)
+            for predecessor in predecessor_list:
+                for sub_graph_entry in sub_graph_entry_list:
+                    self.add_edge(predecessor, sub_graph_entry)
 
-        for edge in sub_graph.edge:
-            self.add_edge(edge[0], edge[1])
+            for edge in sub_graph.edge:
+                self.add_edge(edge[0], edge[1])
 
-        for successor in successor_list:
-            for sub_graph_exit in sub_graph_exit_list:
-                self.add_edge(sub_graph_exit, successor)
+            for successor in successor_list:
+                for sub_graph_exit in sub_graph_exit_list:
+                    self.add_edge(sub_graph_exit, successor)
 
-        for sub_node in sub_graph.vertex:
-            self.add_node(sub_node)
+            for sub_node in sub_graph.vertex:
+                self.add_node(sub_node)
 
-        self.delete_node(node)
+            self.delete_node(node)
 
     def replace_node(self, old_node: Task, new_node: Task):
-        new_node.parent_task_list = old_node.parent_task_list
-        predecessor_list = self.get_node_to(old_node)
-        successor_list = self.get_node_from(old_node)
-        for predecessor in predecessor_list:
-            self.add_edge(predecessor, new_node)
-        for successor in successor_list:
-            self.add_edge(new_node, successor)
-        self.delete_node(old_node)
-        self.add_node(new_node)
+        with self._ready_lock:
+            new_node.parent_task_list = old_node.parent_task_list
+            predecessor_list = self.get_node_to(old_node)
+            successor_list = self.get_node_from(old_node)
+            for predecessor in predecessor_list:
+                self.add_edge(predecessor, new_node)
+            for successor in successor_list:
+                self.add_edge(new_node, successor)
+            self.delete_node(old_node)
+            self.add_node(new_node)
+
+    def _invalidate_closure(self, start_node: Task, end_node: Task):
+        # an edge start_node -> end_node is added or removed:
+        # the predecessors of end_node and everything below it change,
+        # the successors of start_node and everything above it change.
+        # a node is only cached after all of its predecessors (successors) are cached,
+        # so the walk can stop at the first node that is not in the cache.
+        with self._ready_lock:
+            for cache, neighbour, node in ((self._ancestor_cache, self._successor, end_node),
+                                           (self._descendant_cache, self._predecessor, start_node)):
+                open_node_list = [node]
+                while open_node_list:
+                    node = open_node_list.pop()
+                    if cache.pop(node, None) is not None:
+                        open_node_list.extend(neighbour.get(node, ()))
+
+    def _get_bit(self, node: Task) -> int:
+        if node not in self._bit:
+            self._bit[node] = len(self._bit_node)
+            self._bit_node.append(node)
+        return 1 << self._bit[node]
+
+    def _decode_bitset(self, bitset: int) -> [Task]:
+        node_list = []
+        while bitset:
+            low = bitset & -bitset
+            node_list.append(self._bit_node[low.bit_length() - 1])
+            bitset ^= low
+        return node_list
+
+    def _get_closure(self, node: Task, neighbour: dict, cache: dict) -> int:
+        # iterative depth first closure, every visited node is memoized on the way.
+        # nodes that are still on the stack are cut to stay finite on a cyclic graph
+        stack = [node]
+        visiting = set()
+        while stack:
+            current = stack[-1]
+            if current in cache:
+                stack.pop()
+                continue
+            if current not in visiting:
+                visiting.add(current)
+                stack.extend(n for n in neighbour.get(current, ()) if n not in cache and n not in visiting)
+                continue
+            stack.pop()
+            closure = 0
+            for n in neighbour.get(current, ()):
+                closure |= self._get_bit(n) | cache.get(n, 0)
+            cache[current] = closure
+        return cache[node]
 
     def get_all_predecessor(self, node: Task):
-        predecessor_list = []
-        for predecessor in self.get_node_to(node):
-            predecessor_list.append(predecessor)
-            predecessor_list += self.get_all_predecessor(predecessor)
-        return predecessor_list
+        # all predecessors in the order they were added to the graph
+        with self._ready_lock:
+            return self._decode_bitset(self._get_closure(node, self._predecessor, self._ancestor_cache))
 
     def get_all_successor(self, node: Task):
-        successor_list = []
-        for successor in self.get_node_from(node):
-            successor_list.append(successor)
-            successor_list += self.get_all_successor(successor)
-        return successor_list
+        # all successors in the order they were added to the graph
+        with self._ready_lock:
+            return self._decode_bitset(self._get_closure(node, self._successor, self._descendant_cache))
 
     def get_all_node(self):
         return self.vertex
@@ -210,40 +581,93 @@ class Graph:
     def get_failed_node(self):
         return [node for node in self.vertex if node.status == Task.failure]
 
+    @staticmethod
+    def _is_open(status: str) -> bool:
+        return status == Task.unknown or status == Task.running
+
+    def _update_ready(self, node: Task):
+        if node.status == Task.unknown and self._open_count[node] == 0:
+            self._ready.add(node)
+        else:
+            self._ready.discard(node)
+        if node.status == Task.unknown and self._unfinished_count[node] == 0:
+            self._unblocked.add(node)
+        else:
+            self._unblocked.discard(node)
+        if node.status == Task.running:
+            self._running.add(node)
+        else:
+            self._running.discard(node)
+
+    def _refresh_ready(self):
+        # recount every task after the structure changed, O(V) bitset operations
+        with self._ready_lock:
+            if self._ready_version == self._version:
+                return
+            open_mask = 0
+            unfinished_mask = 0
+            for node in self.vertex:
+                if self._is_open(node.status):
+                    open_mask |= self._get_bit(node)
+                if node.status != Task.success:
+                    unfinished_mask |= self._get_bit(node)
+            self._open_count = {}
+            self._unfinished_count = {}
+            self._ready, self._unblocked, self._running = set(), set(), set()
+            for node in self.vertex:
+                predecessor = self._get_closure(node, self._predecessor, self._ancestor_cache)
+                self._open_count[node] = (predecessor & open_mask).bit_count()
+                self._unfinished_count[node] = (predecessor & unfinished_mask).bit_count()
+                self._update_ready(node)
+            self._pre_dirty = set(self._open_count)
+            self._ready_version = self._version
+
+    def _on_status_change(self, node: Task, old_status: str, new_status: str):
+        # called by Task.status, only the successors of the task are touched
+        if self.mutation_log is not None:
+            self.mutation_log.set_status(self, node, new_status)
+        with self._ready_lock:
+            self._status_version += 1
+            if self._ready_version != self._version or node not in self._open_count:
+                return
+            open_delta = self._is_open(new_status) - self._is_open(old_status)
+            unfinished_delta = (new_status != Task.success) - (old_status != Task.success)
+            if open_delta != 0 or unfinished_delta != 0:
+                for successor in self.get_all_successor(node):
+                    if successor not in self._open_count:
+                        continue
+                    self._open_count[successor] += open_delta
+                    self._unfinished_count[successor] += unfinished_delta
+                    self._update_ready(successor)
+                    if open_delta != 0:
+                        self._pre_dirty.add(successor)
+            self._update_ready(node)
+
+    def get_ready_node(self) -> [Task]:
+        # unknown tasks without unknown or running predecessor, in the order they were added
+        self._refresh_ready()
+        with self._ready_lock:
+            return sorted(self._ready, key=lambda node: self._bit[node])
+
     def get_open_task_list(self):
+        self._refresh_ready()
         open_task_list = self.get_open_node()
-        for node in open_task_list:
-            predecessor = self.get_all_predecessor(node)
-            _direct_pre_task_list = []
-            for task in predecessor:
-                if (task.status == Task.unknown or task.status == Task.running) and task in open_task_list:
-                    node.predecessor_task_list.append(task)
-                    _direct_pre_task_list.append(task)
-            node._direct_pre_task_list =_direct_pre_task_list
-
-            for p_n in set(node.predecessor_task_list):
-                if (p_n.status == Task.unknown or p_n.status == Task.running) and p_n in open_task_list:
-                    node.predecessor_task_list.append(p_n)
-            predecessor_task_list = []
-            for task in node.predecessor_task_list:
-                if task.status == Task.unknown or task.status == Task.running:
-                    predecessor_task_list.append(task)
-            node.predecessor_task_list = list(set(predecessor_task_list))
+        with self._ready_lock:
+            pre_dirty = [node for node in open_task_list if node in self._pre_dirty]
+            self._pre_dirty.difference_update(pre_dirty)
+        # only tasks whose predecessors changed since the last call are rebuilt
+        for node in pre_dirty:
+            predecessor_task_list = [task for task in self.get_all_predecessor(node)
+                                     if self._is_open(task.status) and task in self._vertex]
+            node.predecessor_task_list = predecessor_task_list
+            node._direct_pre_task_list = list(predecessor_task_list)
         return open_task_list
     
     def check_graph_completion(self):
-        all_nodes = self.get_all_node()  # get all nodes
-        running_nodes = [node for node in all_nodes if node.status == Task.running]
-        if not running_nodes:  # there is no running node
-            for node in all_nodes:
-                if node.status == Task.unknown:  # there is a node that has not been executed
-                    predecessors = self.get_all_predecessor(node)
-                    if not predecessors or all(pred.status == Task.success for pred in predecessors):
-                        # all unexecuted nodes have completed predecessors
-                        return False  # the graph is not completed
-            # all unexecuted nodes have completed predecessors
-            return True
-        return False # there is a running node
+        # completed when nothing is running and no unknown task has all its predecessors succeeded
+        self._refresh_ready()
+        with self._ready_lock:
+            return len(self._running) == 0 and len(self._unblocked) == 0
 
     def to_json(self) -> dict:
         return {
@@ -267,15 +691,35 @@ class Graph:
             "edge_list": [(edge[0].to_json(), edge[1].to_json()) for edge in self.edge]
         }
     
+    def get_topological_order(self) -> [Task]:
+        # breadth first from the entry nodes, a task follows once all its predecessors are listed.
+        # tasks on a cycle never get there and are left out, the order is cached per graph version
+        version, order = self._topological_order
+        if version != self._version:
+            version = self._version
+            open_node_list = deque(self.get_entry_node())
+            remain_predecessor = {}
+            order = []
+            while open_node_list:
+                node = open_node_list.popleft()
+                order.append(node)
+                for successor in self.get_node_from(node):
+                    remain = remain_predecessor.get(successor, len(self._predecessor[successor])) - 1
+                    remain_predecessor[successor] = remain
+                    if remain == 0:
+                        open_node_list.append(successor)
+            order = tuple(order)
+            self._topological_order = (version, order)
+        return list(order)
+
+    def get_node_by_order(self, order_id: int) -> Task:
+        # order_id is the 1-based id shown by get_graph_status_with_id
+        return self.get_topological_order()[order_id - 1]
+
     def get_graph_status(self) -> str:
         # traverse from the entry node, write a description for each node, and write the current running status
-        open_node_list = self.get_entry_node()
-        close_node_list = []
         description = ""
-
-        while len(open_node_list) != 0:
-            node = open_node_list.pop(0)
-            close_node_list.append(node)
+        for node in self.get_topological_order():
             if node.status == Task.running:
                 description += f"{node.description} is running\n"
             elif node.status == Task.success:
@@ -285,24 +729,13 @@ class Graph:
             else:
                 description += f"{node.description} is waiting to be executed\n"
 
-            for successor in self.get_node_from(node):
-                successor_predecessor_list = self.get_node_to(successor)
-                if all(predecessor in close_node_list for predecessor in successor_predecessor_list):
-                    if successor not in open_node_list and successor not in close_node_list:
-                        open_node_list.append(successor)
-
         return description
     
 
     def get_graph_status_with_id(self) -> str:
         # traverse from the entry node, write a description for each node, and write the current running status
-        open_node_list = self.get_entry_node()
-        close_node_list = []
         description = ""
-        idx = 1
-        while len(open_node_list) != 0:
-            node = open_node_list.pop(0)
-            close_node_list.append(node)
+        for idx, node in enumerate(self.get_topological_order(), start=1):
             if node.status == Task.unknown or node.status == Task.running:
                 description += f"id {idx} {node.description} is running\n"
             elif node.status == Task.success:
@@ -311,72 +744,154 @@ class Graph:
                 description += f"id {idx} {node.description} is failed\n"
             else:
                 assert False, f"id {idx} {node.description} is waiting to be executed\n"
-            idx += 1
-
-            for successor in self.get_node_from(node):
-                successor_predecessor_list = self.get_node_to(successor)
-                if all(predecessor in close_node_list for predecessor in successor_predecessor_list):
-                    if successor not in open_node_list and successor not in close_node_list:
-                        open_node_list.append(successor)
                         
         return description
 
     def get_graph_list(self) -> [Task]:
-        node_list = []
-        open_node_list = self.get_entry_node()
-        close_node_list = []
-
-        while len(open_node_list) != 0:
-            node = open_node_list.pop(0)
-            close_node_list.append(node)
-            
-            node_list.append(node)
+        return self.get_topological_order()
+
+    '''
+        Critical path and parallelism
+        duration: callable Task -> seconds, e.g. TaskDuration.estimate, every task takes 1 by default.
+        Tasks on a cycle are left out like in get_topological_order.
+    '''
+    def get_level_width(self) -> [int]:
+        # number of tasks on each level, the level of a task is the longest chain of predecessors before it
+        level = {}
+        width = []
+        for node in self.get_topological_order():
+            level[node] = max((level[predecessor] + 1 for predecessor in self.get_node_to(node)), default=0)
+            if level[node] == len(width):
+                width.append(0)
+            width[level[node]] += 1
+        return width
+
+    def get_bottom_level(self, duration=None) -> dict:
+        # Task -> duration of the longest path from the task to an exit node, the task included
+        duration = duration or (lambda node: 1.0)
+        bottom_level = {}
+        for node in reversed(self.get_topological_order()):
+            bottom_level[node] = duration(node) + max(
+                (bottom_level[successor] for successor in self.get_node_from(node)), default=0.0)
+        return bottom_level
+
+    def get_critical_path(self, duration=None) -> ([Task], float):
+        # the longest path weighted by duration, a lower bound of the makespan with any number of workers
+        duration = duration or (lambda node: 1.0)
+        finish = {}
+        previous = {}
+        for node in self.get_topological_order():
+            for predecessor in self.get_node_to(node):
+                if node not in previous or finish[predecessor] > finish[previous[node]]:
+                    previous[node] = predecessor
+            start = finish[previous[node]] if node in previous else 0.0
+            finish[node] = start + duration(node)
+        if not finish:
+            return [], 0.0
+        node = max(finish, key=finish.get)
+        length = finish[node]
+        path = [node]
+        while node in previous:
+            node = previous[node]
+            path.append(node)
+        return path[::-1], length
+
+    def _duration_key(self, duration) -> tuple:
+        # what the durations of the tasks depend on: the structure, the statuses and the measurements,
+        # a bound method of an object with a version (e.g. TaskDuration.remaining) is cached until it changes
+        return self._version, self._status_version, duration, getattr(getattr(duration, "__self__", None), "version", None)
+
+    def get_slack(self, duration=None) -> dict:
+        # Task -> how long the task can be delayed without delaying the critical path, 0 on the critical path
+        # cached per _duration_key like the topological order per version, the dict is shared and not to be changed
+        key = self._duration_key(duration)
+        if self._slack[0] == key:
+            return self._slack[1]
+        duration = duration or (lambda node: 1.0)
+        order = self.get_topological_order()
+        top_level = {}
+        for node in order:
+            top_level[node] = max((top_level[predecessor] + duration(predecessor)
+                                   for predecessor in self.get_node_to(node)), default=0.0)
+        bottom_level = self.get_bottom_level(duration)
+        critical_length = max(bottom_level.values(), default=0.0)
+        slack = {node: critical_length - top_level[node] - bottom_level[node] for node in order}
+        self._slack = (key, slack)
+        return slack
+
+    def predict_makespan(self, worker_num: int, duration=None, bottom_level: dict = None) -> float:
+        # list scheduling with worker_num workers, a ready task with the largest bottom level goes first
+        duration = duration or (lambda node: 1.0)
+        if bottom_level is None:
+            bottom_level = self.get_bottom_level(duration)
+        remain = {node: len(self.get_node_to(node)) for node in bottom_level}
+        ready = [(-bottom_level[node], idx, node) for idx, node in enumerate(bottom_level) if remain[node] == 0]
+        heapq.heapify(ready)
+        running = []  # (finish time, sequence, Task)
+        now = 0.0
+        sequence = len(bottom_level)
+        while ready or running:
+            while ready and len(running) < worker_num:
+                _, _, node = heapq.heappop(ready)
+                heapq.heappush(running, (now + duration(node), sequence, node))
+                sequence += 1
+            now, _, node = heapq.heappop(running)
             for successor in self.get_node_from(node):
-                successor_predecessor_list = self.get_node_to(successor)
-                if all(predecessor in close_node_list for predecessor in successor_predecessor_list):
-                    if successor not in open_node_list and successor not in close_node_list:
-                        open_node_list.append(successor)
-                        
-        return node_list
+                if successor not in remain:
+                    continue
+                remain[successor] -= 1
+                if remain[successor] == 0:
+                    heapq.heappush(ready, (-bottom_level[successor], sequence, successor))
+                    sequence += 1
+        return now
+
+    def get_parallelism(self, duration=None, max_worker_num: int = None, tolerance: float = 0.05) -> int:
+        # the fewest workers whose predicted makespan is within tolerance of the critical path
+        duration = duration or (lambda node: 1.0)
+        width = max(self.get_level_width(), default=1)
+        if max_worker_num is not None:
+            width = min(width, max_worker_num)
+        bottom_level = self.get_bottom_level(duration)
+        critical_length = max(bottom_level.values(), default=0.0)
+        for worker_num in range(1, width):
+            if self.predict_makespan(worker_num, duration, bottom_level) <= critical_length * (1 + tolerance):
+                return worker_num
+        return max(width, 1)
 
 
     def __str__(self):
         return str(self.graph_flow())
     
+    '''
+        Views are written by the shared background GraphRenderer, these calls only take a snapshot
+    '''
     def draw_graph(self, path):
-        self.G.clear()
-        for node in self.vertex:
-            self.G.add_node(node.description, description=node.description)
-        for edge in self.edge:
-            self.G.add_edge(edge[0].description, edge[1].description)
-        pos = nx.spring_layout(self.G)
-        nx.draw(self.G, pos, with_labels=True)
-        node_labels = nx.get_node_attributes(self.G, 'description')
-        nx.draw_networkx_labels(self.G, pos, labels=node_labels)
-        plt.savefig(path)  # Save as png image
-        plt.close()
-
-    def _write_graph_to_md(self, path):
-        with open(path, 'w') as f:
-            f.write('```mermaid\n')
-            f.write('graph TD\n')
-            for node in self.vertex:
-                f.write(f'    {node.id}["{node.description} task-status: {node.status}"]\n')
-            for edge in self.edge:
-                f.write(f'    {edge[0].id} --> {edge[1].id}\n')
-            f.write('```\n')
+        from type_define.graph_renderer import get_renderer, GraphRenderer
+        get_renderer().submit(self, GraphRenderer.png, path)
 
     def write_graph_to_md(self, path):
-        thread = threading.Thread(target=self._write_graph_to_md, args=(path,))
-        thread.start()
+        from type_define.graph_renderer import get_renderer, GraphRenderer
+        get_renderer().submit(self, GraphRenderer.md, path)
 
-    def write_graph_to_json(self, path):
-        path = path + "graph_" + str(self._json_count) + ".json"
+    def write_graph_to_json(self, path, binary: bool = True):
+        # binary: also write graph_<n>.bin next to the json, see type_define.binary_format
+        from type_define.graph_renderer import get_renderer, GraphRenderer
+        path = path + "graph_" + str(self._json_count)
         self._json_count += 1
-        with open(path, 'w') as f:
-            json_vertex = [node.to_json() for node in self.vertex]
-            json_edge = [(edge[0].description, edge[1].description) for edge in self.edge]
-            json.dump({"vertex": json_vertex, "edge": json_edge}, f, indent=4)
+        get_renderer().submit(self, GraphRenderer.json, path + ".json")
+        if binary:
+            get_renderer().submit(self, GraphRenderer.binary, path + ".bin")
+
+    def write_graph_to_binary(self, path):
+        from type_define.binary_format import dump_graph
+        with open(path, 'wb') as f:
+            dump_graph(self, f)
+
+    @classmethod
+    def load_graph_from_binary(cls, path):
+        from type_define.binary_format import load_graph
+        with open(path, 'rb') as f:
+            return load_graph(f)
 
     def get_co_parent_list(node1:Task, node2:Task) -> [Task]:
         parent_list1 = node1.parent_task_list
@@ -392,12 +907,9 @@ class Graph:
         return co_parent_list
 
     def get_exist_sub_graph(self, task:Task):
-        # get the sub graph that contains the task
+        # get the sub graph that contains the task, i.e. the tasks decomposed from it
         sub_graph = Graph()
-        sub_node_list = []
-        for node in self.vertex:
-            if task in node.parent_task_list:
-                sub_node_list.append(node)
+        sub_node_list = dict(self._children.get(task, ()))
         for node in sub_node_list:
             sub_graph.add_node(node)
         for node in sub_node_list:
@@ -426,3 +938,6 @@ if __name__ == "__main__":
 
     graph.remove_node_merge_edge(node1)
     graph.write_graph_to_md("img/remove_graph.md")
+
+    from type_define.graph_renderer import get_renderer
+    get_renderer().flush()
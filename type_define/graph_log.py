@@ -0,0 +1,230 @@
+import sys
+import os
+import json
+import threading
+import weakref
+sys.path.append(os.getcwd())
+from type_define.graph import Graph, Task
+
+
+def task_record(task: Task) -> dict:
+    # the part of a task needed to rebuild it, same fields as Task.to_json
+    return {
+        "id": task.id,
+        "description": task.description,
+        "milestones": task.milestones,
+        "candidate_list": task.candidate_list,
+        "number": task.number,
+        "status": task.status,
+    }
+
+
+class GraphDelta:
+    '''
+    One mutation of a Graph, version is the version of the log after the mutation
+    and graph_id the id of the mutated Graph, several graphs may share one log
+    '''
+    add_node = "add_node"
+    remove_node = "remove_node"
+    add_edge = "add_edge"
+    remove_edge = "remove_edge"
+    status = "status"
+    snapshot = "snapshot"
+
+    def __init__(self, version: int, op: str, data: dict, graph_id: str = None):
+        self.version = version
+        self.op = op
+        self.data = data
+        self.graph_id = graph_id
+
+    def to_json(self) -> dict:
+        return {"version": self.version, "graph": self.graph_id, "op": self.op, **self.data}
+
+    @classmethod
+    def from_json(cls, data: dict):
+        data = dict(data)
+        return cls(data.pop("version"), data.pop("op"), data, data.pop("graph", None))
+
+
+def _write_lines(file, buffer: [str]):
+    # also run by weakref.finalize at exit, so it holds no reference to the log
+    if buffer and not file.closed:
+        file.write("".join(buffer))
+        file.flush()
+    buffer.clear()
+
+
+class GraphMutationLog:
+    '''
+    Append-only log of typed graph deltas with a version counter.
+    Every snapshot_interval deltas of a graph a compact snapshot of the whole graph is appended,
+    so any past version can be rebuilt from the closest snapshot plus the deltas after it.
+    The records are buffered and written to the file at each snapshot, on flush and close,
+    in memory only the deltas since the last snapshot of each graph are kept.
+
+    Args:
+    - path: str, jsonl file to append to, None keeps the log in memory only
+    - snapshot_interval: int, number of deltas of a graph between two snapshots
+    '''
+    def __init__(self, path: str = None, snapshot_interval: int = 200):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.version = 0
+        self.deltas = []  # GraphDelta, snapshots included
+        self._since_snapshot = {}  # graph id -> number of deltas since its last snapshot
+        self._lock = threading.RLock()
+        self._file = None
+        self._buffer = []  # json lines not written yet
+        if path is not None:
+            if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self._file = open(path, "a")
+            # the records still buffered at exit are written too
+            self._finalizer = weakref.finalize(self, _write_lines, self._file, self._buffer)
+
+    def _append(self, graph: Graph, op: str, data: dict) -> GraphDelta:
+        with self._lock:
+            self.version += 1
+            delta = GraphDelta(self.version, op, data, graph.id)
+            if self._file is not None:
+                self._buffer.append(json.dumps(delta.to_json(), separators=(",", ":"), default=str) + "\n")
+            if op == GraphDelta.snapshot:
+                # the deltas before the snapshot are only needed from the file now
+                self.deltas = [item for item in self.deltas if item.graph_id != graph.id]
+                self.deltas.append(delta)
+                self._since_snapshot[graph.id] = 0
+                self.flush()
+            else:
+                self.deltas.append(delta)
+                self._since_snapshot[graph.id] = self._since_snapshot.get(graph.id, 0) + 1
+                if self._since_snapshot[graph.id] >= self.snapshot_interval:
+                    self.snapshot(graph)
+            return delta
+
+    '''
+        Called by Graph after each mutation
+    '''
+    def add_node(self, graph: Graph, node: Task):
+        self._append(graph, GraphDelta.add_node, {"task": task_record(node)})
+
+    def remove_node(self, graph: Graph, node: Task):
+        self._append(graph, GraphDelta.remove_node, {"id": node.id})
+
+    def add_edge(self, graph: Graph, start_node: Task, end_node: Task):
+        self._append(graph, GraphDelta.add_edge, {"start": start_node.id, "end": end_node.id})
+
+    def remove_edge(self, graph: Graph, start_node: Task, end_node: Task):
+        self._append(graph, GraphDelta.remove_edge, {"start": start_node.id, "end": end_node.id})
+
+    def set_status(self, graph: Graph, node: Task, status: str):
+        self._append(graph, GraphDelta.status, {"id": node.id, "status": status})
+
+    def snapshot(self, graph: Graph):
+        # edges may point to tasks that are not added yet (e.g. in the middle of merge_at),
+        # those tasks are stored as detached and indexed after the vertex
+        vertex = graph.vertex
+        edge = graph.edge
+        index = {node: idx for idx, node in enumerate(vertex)}
+        detached = []
+        for start, end in edge:
+            for node in (start, end):
+                if node not in index:
+                    index[node] = len(index)
+                    detached.append(node)
+        self._append(graph, GraphDelta.snapshot, {
+            "vertex": [task_record(node) for node in vertex],
+            "detached": [task_record(node) for node in detached],
+            "edge": [(index[start], index[end]) for start, end in edge],
+        })
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                _write_lines(self._file, self._buffer)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self.flush()
+                self._finalizer.detach()
+                self._file.close()
+                self._file = None
+
+    '''
+        Post-mortem
+    '''
+    @classmethod
+    def load(cls, path: str):
+        mutation_log = cls()
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    mutation_log.deltas.append(GraphDelta.from_json(json.loads(line)))
+        if mutation_log.deltas:
+            mutation_log.version = mutation_log.deltas[-1].version
+        return mutation_log
+
+    def rebuild(self, version: int = None, graph_id: str = None) -> Graph:
+        '''
+        Rebuild the graph as it was at version, the latest version by default.
+        graph_id selects the graph, by default the one mutated last at or before version.
+        A version older than the deltas kept in memory is read back from the file.
+        '''
+        if version is None:
+            version = self.version
+        with self._lock:
+            older = [delta for delta in self.deltas if delta.version <= version]
+            if graph_id is None and older:
+                graph_id = older[-1].graph_id
+            kept = [delta for delta in self.deltas if delta.graph_id == graph_id]
+            if (not older and self.deltas) or (kept and kept[0].op == GraphDelta.snapshot and kept[0].version > version):
+                # the deltas before the last snapshot of the graph are only in the file
+                if self.path is None:
+                    raise ValueError(f"version {version} is older than the deltas kept in memory")
+                self.flush()
+                return GraphMutationLog.load(self.path).rebuild(version, graph_id)
+            deltas = [delta for delta in kept if delta.version <= version]
+        start = 0
+        for idx, delta in enumerate(deltas):
+            if delta.op == GraphDelta.snapshot:
+                start = idx
+
+        graph = Graph()
+        task_dict = {}
+
+        def get_task(record: dict) -> Task:
+            task = task_dict.get(record["id"])
+            if task is None:
+                task = Task(record.get("description", ""), {})
+                task.id = record["id"]
+                task_dict[task.id] = task
+            for key in ["description", "milestones", "candidate_list", "number", "status"]:
+                if key in record:
+                    setattr(task, key, record[key])
+            return task
+
+        for delta in deltas[start:]:
+            data = delta.data
+            if delta.op == GraphDelta.snapshot:
+                graph = Graph()
+                node_list = [get_task(record) for record in data["vertex"] + data["detached"]]
+                for node in node_list[:len(data["vertex"])]:
+                    graph.add_node(node)
+                for start_idx, end_idx in data["edge"]:
+                    graph.add_edge(node_list[start_idx], node_list[end_idx])
+            elif delta.op == GraphDelta.add_node:
+                graph.add_node(get_task(data["task"]))
+            elif delta.op == GraphDelta.remove_node:
+                if data["id"] in task_dict and graph.has_node(task_dict[data["id"]]):
+                    graph.delete_node(task_dict[data["id"]])
+            elif delta.op == GraphDelta.add_edge:
+                graph.add_edge(get_task({"id": data["start"]}), get_task({"id": data["end"]}))
+            elif delta.op == GraphDelta.remove_edge:
+                start_node, end_node = get_task({"id": data["start"]}), get_task({"id": data["end"]})
+                if graph.has_edge(start_node, end_node):
+                    graph.delete_edge(start_node, end_node)
+            elif delta.op == GraphDelta.status:
+                get_task(data)
+        if graph_id is not None:
+            graph.id = graph_id
+        return graph
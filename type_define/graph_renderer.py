@@ -0,0 +1,183 @@
+import sys
+import os
+import json
+import math
+import logging
+import threading
+from collections import OrderedDict
+sys.path.append(os.getcwd())
+from type_define.binary_format import graph_records, dump_graph_records
+import networkx as nx
+from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
+
+
+class GraphRenderer:
+    '''
+    One background worker that writes mermaid / png views and json / binary copies of graphs.
+
+    submit() takes a snapshot of the graph and returns at once. A newer job of the same graph and kind
+    replaces the pending one and is written to its own path, so a burst of graph updates costs one write of
+    the newest version, whatever path (e.g. a timestamp) each update was given. Once max_pending jobs wait,
+    submit() waits for the worker to take one.
+    Node positions are cached by task id, a new version only lays out the new nodes, the least recently
+    drawn positions are dropped past max_position.
+
+    Args:
+    - max_pending: int, maximum number of jobs waiting to be written
+    - layout_iterations: int, spring layout iterations once positions are cached
+    - max_position: int, maximum number of cached node positions
+    '''
+    md = "md"
+    png = "png"
+    json = "json"
+    binary = "bin"
+
+    def __init__(self, max_pending: int = 64, layout_iterations: int = 10, max_position: int = 10000):
+        self.max_pending = max_pending
+        self.layout_iterations = layout_iterations
+        self.max_position = max_position
+        self.coalesced = 0  # jobs replaced by a newer one before they were written
+        self._pending = OrderedDict()  # (graph id, kind) -> (path, snapshot)
+        self._condition = threading.Condition()
+        self._busy = False
+        self._shutdown = False
+        self._position = OrderedDict()  # task id -> (x, y), least recently drawn first
+        self._thread = threading.Thread(target=self._run, name="GraphRenderer", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def snapshot(graph, kind: str) -> dict:
+        # everything the writer of kind reads, taken on the caller thread so the graph can keep changing
+        if kind == GraphRenderer.binary:
+            return {"binary": graph_records(graph)}
+        vertex = graph.vertex
+        edge = graph.edge
+        if kind == GraphRenderer.json:
+            return {"json": {
+                "vertex": [node.to_json() for node in vertex],
+                "edge": [(start.description, end.description) for start, end in edge],
+            }}
+        return {
+            "node": [(node.id, node.description, node.status) for node in vertex],
+            "edge": [(start.id, end.id) for start, end in edge],
+        }
+
+    def submit(self, graph, kind: str, path: str):
+        snapshot = self.snapshot(graph, kind)
+        key = (graph.id, kind)
+        with self._condition:
+            if key not in self._pending:
+                self._condition.wait_for(lambda: len(self._pending) < self.max_pending or self._shutdown)
+            if self._pending.pop(key, None) is not None:
+                self.coalesced += 1
+            self._pending[key] = (path, snapshot)
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        # wait until every submitted job is written
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._shutdown)
+                if self._shutdown and not self._pending:
+                    return
+                (_, kind), (path, snapshot) = self._pending.popitem(last=False)
+                self._busy = True
+                self._condition.notify_all()  # a submit waiting for a place
+            try:
+                if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                if kind == GraphRenderer.md:
+                    self._write_md(snapshot, path)
+                elif kind == GraphRenderer.png:
+                    self._write_png(snapshot, path)
+                elif kind == GraphRenderer.json:
+                    with open(path, 'w') as f:
+                        json.dump(snapshot["json"], f, indent=4)
+                elif kind == GraphRenderer.binary:
+                    with open(path, 'wb') as f:
+                        dump_graph_records(*snapshot["binary"], f)
+            except Exception as e:
+                logger.error(f"GraphRenderer failed to write {path}: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write_md(self, snapshot: dict, path: str):
+        with open(path, 'w') as f:
+            f.write('```mermaid\n')
+            f.write('graph TD\n')
+            for node_id, description, status in snapshot["node"]:
+                f.write(f'    {node_id}["{description} task-status: {status}"]\n')
+            for start, end in snapshot["edge"]:
+                f.write(f'    {start} --> {end}\n')
+            f.write('```\n')
+
+    def _layout(self, G: nx.DiGraph) -> dict:
+        # start from the cached positions, a new node starts next to its placed neighbours
+        position = {}
+        new_node = []
+        for node in G.nodes:
+            if node in self._position:
+                position[node] = self._position[node]
+                self._position.move_to_end(node)
+            else:
+                new_node.append(node)
+        for idx, node in enumerate(new_node):
+            placed = [position[neighbour] for neighbour in nx.all_neighbors(G, node) if neighbour in position]
+            if placed:
+                x = sum(p[0] for p in placed) / len(placed)
+                y = sum(p[1] for p in placed) / len(placed)
+            else:
+                x, y = 0.0, 0.0
+            angle = 2 * math.pi * idx / max(len(new_node), 1)
+            position[node] = (x + 0.1 * math.cos(angle), y + 0.1 * math.sin(angle))
+        if len(G) > 0:
+            if len(new_node) == len(G):
+                position = nx.spring_layout(G)
+            elif new_node:
+                position = nx.spring_layout(G, pos=position, iterations=self.layout_iterations)
+        self._position.update({node: tuple(p) for node, p in position.items()})
+        while len(self._position) > self.max_position:
+            self._position.popitem(last=False)
+        return position
+
+    def _write_png(self, snapshot: dict, path: str):
+        G = nx.DiGraph()
+        label = {}
+        for node_id, description, _ in snapshot["node"]:
+            G.add_node(node_id)
+            label[node_id] = description
+        G.add_edges_from((start, end) for start, end in snapshot["edge"] if start in label and end in label)
+        position = self._layout(G)
+        figure = Figure()
+        ax = figure.add_subplot()
+        nx.draw(G, position, ax=ax)
+        nx.draw_networkx_labels(G, position, labels=label, ax=ax)
+        figure.savefig(path)  # Save as png image
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> GraphRenderer:
+    # the renderer shared by every graph, started on first use
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = GraphRenderer()
+        return _renderer
@@ -0,0 +1,180 @@
+import sys
+import os
+import time
+import math
+import threading
+from collections import deque, Counter
+sys.path.append(os.getcwd())
+from LLM.call_stats import LLMCallStats, get_call_stats
+
+
+class PoolAutoscaler:
+    '''
+    Sizes the agent step pool of GlobalController between min_workers and max_workers.
+
+    Each decision looks at
+    1. rate limits: a 429 of the llm in the last window seconds shrinks the pool by backoff, the 429s before a backoff
+       are not counted again, and the pool does not grow until cooldown seconds after it, more workers would only get
+       more 429s
+    2. demand: steps in flight plus ready tasks an agent is free for, workers past it would only wait
+    3. llm latency: a p95 over saturation times the lowest p95 seen lately means the endpoint queues the requests,
+       the pool keeps its size instead of growing
+    Otherwise a pool under the demand grows by growth_factor, while the llm is slow the steps hold their workers on io.
+    Once the llm has rate limited the pool, it grows one worker at a time, so it stays close to the limit.
+    A pool over the demand shrinks to it once it stayed over it for scale_down_delay seconds.
+    Every decision is kept with its signals, metrics() returns them with the count of each reason.
+
+    Args:
+    - min_workers: int, smallest pool, also the size the pool starts with
+    - max_workers: int, largest pool
+    - interval: float, seconds between two decisions
+    - window: float, seconds of llm calls and rate limits a decision looks at
+    - growth_factor: float, the pool grows at least by one worker
+    - backoff: float, factor of the pool size on a rate limit
+    - cooldown: float, seconds without growth after a rate limit
+    - saturation: float, p95 latency over the lowest recent p95 that stops the growth
+    - scale_down_delay: float, seconds the pool stays over the demand before it shrinks
+    - llm_stats: LLMCallStats, None reads the stats of every model of the process
+    '''
+    def __init__(self, min_workers: int = 1, max_workers: int = 32, interval: float = 1.0, window: float = 30.0,
+                 growth_factor: float = 1.5, backoff: float = 0.5, cooldown: float = 30.0, saturation: float = 2.0,
+                 scale_down_delay: float = 10.0, llm_stats: LLMCallStats = None):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(f"need 1 <= min_workers <= max_workers, got {min_workers} and {max_workers}")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.window = window
+        self.growth_factor = growth_factor
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.saturation = saturation
+        self.scale_down_delay = scale_down_delay
+        self.llm_stats = llm_stats or get_call_stats()
+        self.size = min_workers  # size of the latest decision
+        self.history = deque(maxlen=100)  # the latest decisions
+        self.reason_count = Counter()
+        self.resize_count = 0
+        self._p95 = deque()  # (time, p95) of the decisions of the last 10 windows, the lowest one is the baseline
+        self._last_decision = None
+        self._last_backoff = None
+        self._over_since = None  # time the pool got larger than the demand
+        self._lock = threading.Lock()
+
+    def decide(self, size: int, ready: int, in_flight: int, now: float = None) -> dict:
+        # the new size of a pool of size workers with its signals, None until interval seconds after the last decision
+        now = time.time() if now is None else now
+        if self._last_decision is not None and now - self._last_decision < self.interval:
+            return None
+        self._last_decision = now
+        llm = self.llm_stats.summary(self.window, now, since=self._last_backoff)
+        baseline = self._baseline(llm["p95"], now)
+        demand = min(max(ready + in_flight, self.min_workers), self.max_workers)
+        cooling = self._last_backoff is not None and now - self._last_backoff < self.cooldown
+        if demand >= size:
+            self._over_since = None
+        elif self._over_since is None:
+            self._over_since = now
+
+        target = size
+        if llm["rate_limit"] > 0 and not cooling:
+            target, reason = math.ceil(size * self.backoff), "rate limited"
+            self._last_backoff = now
+        elif demand < size:
+            if now - self._over_since >= self.scale_down_delay:
+                target, reason = demand, "idle"
+            else:
+                reason = "idle, waiting"
+        elif demand == size:
+            reason = "steady"
+        elif cooling:
+            reason = "rate limit cooldown"
+        elif llm["p95"] is not None and baseline is not None and llm["p95"] > baseline * self.saturation:
+            reason = "llm saturated"
+        elif self._last_backoff is not None:
+            target, reason = size + 1, "queue"
+        else:
+            target, reason = min(demand, max(size + 1, math.ceil(size * self.growth_factor))), "queue"
+        target = min(max(target, self.min_workers), self.max_workers)
+
+        decision = {
+            "time": now,
+            "from": size,
+            "to": target,
+            "reason": reason,
+            "ready": ready,
+            "in_flight": in_flight,
+            "demand": demand,
+            "llm_calls": llm["calls"],
+            "p50": llm["p50"],
+            "p95": llm["p95"],
+            "baseline_p95": baseline,
+            "rate_limit": llm["rate_limit"],
+        }
+        with self._lock:
+            self.size = target
+            self.history.append(decision)
+            self.reason_count[reason] += 1
+            self.resize_count += target != size
+        return decision
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "min_workers": self.min_workers,
+                "max_workers": self.max_workers,
+                "decisions": sum(self.reason_count.values()),
+                "resizes": self.resize_count,
+                "reason_count": dict(self.reason_count),
+                "history": list(self.history),
+            }
+
+    def _baseline(self, p95: float, now: float) -> float:
+        # lowest p95 of the last 10 windows, the latency of the endpoint when it is not queueing
+        if p95 is not None:
+            self._p95.append((now, p95))
+        while self._p95 and now - self._p95[0][0] > 10 * self.window:
+            self._p95.popleft()
+        return min((value for _, value in self._p95), default=None)
+
+
+class PoolLimit:
+    '''
+    Semaphore whose size can change, held by the running steps of a thread pool of max_workers threads.
+    A thread pool can not shrink, replacing it leaves its queued steps to its old threads, a smaller limit holds
+    back the next step at once. Each holder is a key, releasing a key twice or a key not held does nothing.
+    '''
+    def __init__(self, size: int):
+        self.size = size
+        self._holder = set()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._holder)
+
+    def resize(self, size: int):
+        with self._condition:
+            self.size = size
+            self._condition.notify_all()
+
+    def acquire(self, key) -> bool:
+        # wait for a free place, False once closed
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._holder) < self.size or self._closed)
+            if self._closed:
+                return False
+            self._holder.add(key)
+            return True
+
+    def release(self, key):
+        with self._condition:
+            if key in self._holder:
+                self._holder.remove(key)
+                self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
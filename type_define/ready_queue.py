@@ -0,0 +1,64 @@
+import sys
+import os
+import time
+import heapq
+import itertools
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+
+
+class ReadyQueue:
+    '''
+    Heap of the ready tasks of the controller, the head is the task a free agent should take first.
+    Tasks are ranked by
+    1. priority class: task.priority, 1 is the most urgent, unclassified tasks rank one class after the lowest class
+    2. aging: every aging_interval seconds a task has been waiting lifts it by one class, so low classes are not starved
+    3. slack: time the task can wait without delaying the critical path, less slack goes first
+    4. waiting time: the task ready first goes first
+
+    Args:
+    - aging_interval: float, seconds of waiting worth one priority class, None disables aging
+    - default_priority: int, class of the tasks without priority, None puts them after the lowest class
+    '''
+    def __init__(self, aging_interval: float = 300.0, default_priority: int = None):
+        self.aging_interval = aging_interval
+        self.default_priority = default_priority
+        self._heap = []  # (class, slack, ready since, sequence, Task)
+        self._ready_since = {}  # Task -> time it was first seen ready
+        self._rank = {}  # Task -> (class after aging, slack), equal ranks are equally urgent
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def update(self, ready_task_list: [Task], slack: dict = None, now: float = None):
+        # rebuild the heap from the tasks ready now, the ranks change with the waiting time and the graph
+        now = time.time() if now is None else now
+        slack = slack or {}
+        self._ready_since = {task: self._ready_since.get(task, now) for task in ready_task_list}
+        default_priority = self.default_priority
+        if default_priority is None:
+            default_priority = max((task.priority for task in ready_task_list if task.priority is not None), default=0) + 1
+        self._heap = []
+        self._rank = {}
+        for task in ready_task_list:
+            ready_since = self._ready_since[task]
+            priority = task.priority if task.priority is not None else default_priority
+            if self.aging_interval:
+                priority -= int((now - ready_since) // self.aging_interval)
+            self._rank[task] = (priority, round(slack.get(task, 0.0), 6))
+            self._heap.append(self._rank[task] + (ready_since, next(self._sequence), task))
+        heapq.heapify(self._heap)
+
+    def rank(self, task: Task) -> tuple:
+        return self._rank.get(task)
+
+    def peek(self) -> Task:
+        return self._heap[0][-1] if self._heap else None
+
+    def pop(self) -> Task:
+        return heapq.heappop(self._heap)[-1]
+
+    def order(self) -> [Task]:
+        # every task in pop order, the heap is kept
+        return [item[-1] for item in sorted(self._heap)]
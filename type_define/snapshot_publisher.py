@@ -0,0 +1,216 @@
+import sys
+import os
+import json
+import socket
+import hashlib
+import logging
+import threading
+import itertools
+from collections import OrderedDict
+sys.path.append(os.getcwd())
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotPublisher:
+    '''
+    One background worker that writes json status snapshots, like logs/task_list.json.
+
+    publish() encodes the snapshot on the caller thread with the compact C encoder and compares its hash
+    with the last published snapshot of the same path, an unchanged snapshot costs no disk write.
+    A newer snapshot of a path replaces the one still pending, so a burst of changes is one write.
+    Past max_pending paths, the oldest pending snapshot is written on the caller thread instead of being dropped.
+    Files are written to a temporary file and renamed, a reader never sees half a snapshot.
+    With listen(), every written snapshot is also sent to the connected clients as one json line
+    {"path": path, "snapshot": snapshot}, a new client first gets the latest snapshot of every path.
+
+    Args:
+    - max_pending: int, maximum number of paths waiting to be written in the background
+    - indent: int, indent of the files, None writes them compact
+    '''
+    def __init__(self, max_pending: int = 8, indent: int = 4):
+        self.max_pending = max_pending
+        self.indent = indent
+        self._pending = OrderedDict()  # path -> (sequence, compact json)
+        self._sequence = itertools.count()
+        self._written = {}  # path -> sequence of the last written snapshot
+        self._write_lock = threading.Lock()  # the worker and a caller writing an overflow path
+        self._digest = {}  # path -> hash of the last published snapshot
+        self._latest = {}  # path -> compact json of the last written snapshot
+        self._condition = threading.Condition()
+        self._busy = False
+        self._shutdown = False
+        self._client = []  # connected sockets
+        self._client_lock = threading.Lock()
+        self._server = None
+        self._thread = threading.Thread(target=self._run, name="SnapshotPublisher", daemon=True)
+        self._thread.start()
+
+    def publish(self, path: str, snapshot) -> bool:
+        # False if the snapshot is the same as the last one of path
+        data = json.dumps(snapshot)
+        digest = hashlib.blake2b(data.encode("utf-8"), digest_size=16).digest()
+        overflow = []
+        with self._condition:
+            if self._digest.get(path) == digest:
+                return False
+            self._digest[path] = digest
+            self._pending.pop(path, None)
+            self._pending[path] = (next(self._sequence), data)
+            while len(self._pending) > self.max_pending:
+                overflow.append(self._pending.popitem(last=False))
+            self._condition.notify()
+        for overflow_path, (sequence, overflow_data) in overflow:
+            # the worker is behind, the caller writes the oldest path itself rather than lose it
+            logger.warning(f"SnapshotPublisher has more than {self.max_pending} paths pending, writing {overflow_path} synchronously")
+            self._write(overflow_path, sequence, overflow_data)
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        # wait until every published snapshot is written
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self._server is not None:
+            self._server.close()
+        with self._client_lock:
+            for client in self._client:
+                client.close()
+            self._client = []
+
+    def listen(self, address: tuple = ("127.0.0.1", 0)) -> tuple:
+        # publish over a local tcp socket too, return the bound address
+        if self._server is None:
+            self._server = socket.create_server(address)
+            threading.Thread(target=self._accept, name="SnapshotPublisherServer", daemon=True).start()
+        return self._server.getsockname()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            client.settimeout(1.0)  # a client that does not read is dropped instead of blocking the writer
+            with self._condition:
+                latest = list(self._latest.items())
+            try:
+                for path, data in latest:
+                    client.sendall(self._message(path, data))
+            except OSError:
+                client.close()
+                continue
+            with self._client_lock:
+                self._client.append(client)
+
+    @staticmethod
+    def _message(path: str, data: str) -> bytes:
+        return f'{{"path": {json.dumps(path)}, "snapshot": {data}}}\n'.encode("utf-8")
+
+    def _broadcast(self, path: str, data: str):
+        with self._client_lock:
+            if not self._client:
+                return
+            message = self._message(path, data)
+            alive = []
+            for client in self._client:
+                try:
+                    client.sendall(message)
+                    alive.append(client)
+                except OSError:
+                    client.close()
+            self._client = alive
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._shutdown)
+                if self._shutdown and not self._pending:
+                    return
+                path, (sequence, data) = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                self._write(path, sequence, data)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, path: str, sequence: int, data: str):
+        try:
+            with self._write_lock:
+                # a newer snapshot of the path may have been written meanwhile by the other writer
+                if self._written.get(path, -1) > sequence:
+                    return
+                write_snapshot(path, data, self.indent)
+                self._written[path] = sequence
+                with self._condition:
+                    self._latest[path] = data
+                self._broadcast(path, data)
+        except Exception as e:
+            logger.error(f"SnapshotPublisher failed to write {path}: {e}")
+            with self._condition:
+                if path not in self._pending:
+                    self._digest.pop(path, None)  # written again by its next snapshot
+
+
+def write_snapshot(path: str, data: str, indent: int = 4):
+    # write the compact json data to path through a temporary file
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        if indent is None:
+            f.write(data)
+        else:
+            json.dump(json.loads(data), f, indent=indent)
+    os.replace(tmp_path, path)
+
+
+_publisher = None
+_publisher_owner = 0  # acquire_publisher calls not released yet
+_publisher_lock = threading.Lock()
+
+
+def _shared_publisher() -> SnapshotPublisher:
+    global _publisher
+    if _publisher is None:
+        _publisher = SnapshotPublisher()
+    return _publisher
+
+
+def acquire_publisher() -> SnapshotPublisher:
+    # the shared publisher for an owner that gives it back with release_publisher
+    global _publisher_owner
+    with _publisher_lock:
+        _publisher_owner += 1
+        return _shared_publisher()
+
+
+def publish(path: str, snapshot) -> bool:
+    # through the publisher of the owners, written on the caller thread when no owner holds one
+    with _publisher_lock:
+        if _publisher is not None and _publisher_owner > 0:
+            # under the lock, release_publisher closes the publisher only after the snapshot is pending
+            return _publisher.publish(path, snapshot)
+    write_snapshot(path, json.dumps(snapshot))
+    return True
+
+
+def release_publisher(publisher: SnapshotPublisher):
+    # the last owner writes the pending snapshots and stops the worker, the next user starts a new publisher
+    global _publisher, _publisher_owner
+    with _publisher_lock:
+        if publisher is not _publisher:
+            return
+        _publisher_owner -= 1
+        if _publisher_owner > 0:
+            return
+        _publisher = None
+    publisher.close()
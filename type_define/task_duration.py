@@ -0,0 +1,60 @@
+import sys
+import os
+import json
+import threading
+sys.path.append(os.getcwd())
+from type_define.graph import Task
+from type_define.snapshot_publisher import publish
+
+
+class TaskDuration:
+    '''
+    Measured step durations of tasks, kept across runs in a json file.
+    While a controller holds the snapshot publisher the file is written in the background, add() only updates
+    the memory, otherwise add() writes it at once.
+    A task is estimated by the mean duration of the tasks with the same description,
+    then by the mean of all measured tasks, then by default_duration.
+
+    Args:
+    - path: str, json file the measurements are loaded from and saved to, None keeps them in memory
+    - default_duration: float, seconds used before anything is measured
+    '''
+    def __init__(self, path: str = None, default_duration: float = 60.0):
+        self.path = path
+        self.default_duration = default_duration
+        self.record = {}  # description -> [count, total seconds]
+        self.count = 0
+        self.total = 0.0
+        self.version = 0  # bumped on every measurement, analytics cached on the durations compare it
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.record = {key: list(value) for key, value in json.load(f).items()}
+            for count, total in self.record.values():
+                self.count += count
+                self.total += total
+
+    def add(self, task: Task, duration: float):
+        with self._lock:
+            count, total = self.record.get(task.description, [0, 0.0])
+            self.record[task.description] = [count + 1, total + duration]
+            self.count += 1
+            self.total += duration
+            self.version += 1
+            if self.path is not None:
+                # a burst of steps is one write, GlobalController.stop flushes the publisher
+                publish(self.path, self.record)
+
+    def estimate(self, task: Task) -> float:
+        count, total = self.record.get(task.description, [0, 0.0])
+        if count > 0:
+            return total / count
+        if self.count > 0:
+            return self.total / self.count
+        return self.default_duration
+
+    def remaining(self, task: Task) -> float:
+        # finished tasks take no more time, used to predict the rest of a run
+        if task.status == Task.success or task.status == Task.failure:
+            return 0.0
+        return self.estimate(task)
@@ -97,3 +97,12 @@ class TaskSummaryTree:
             self.nodes.append(new_node)
         self.root_id = data['root_id']
         self.task_nodes_id = data['task_nodes_id']
+
+    def to_binary(self, stream):
+        # compact streamed form of to_json, see type_define.binary_format
+        from type_define.binary_format import dump_summary_tree
+        dump_summary_tree(self, stream)
+
+    def load_from_binary(self, stream):
+        from type_define.binary_format import load_summary_tree
+        load_summary_tree(self, stream)